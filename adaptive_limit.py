@@ -0,0 +1,176 @@
+"""
+Controle adaptativo (AIMD) de concorrência das requisições ao GLPI e ao Ollama.
+
+Cada backend tem um limite de requisições simultâneas, compartilhado por todos
+os serviços do processo (como as sessões de http_transport). Enquanto a
+latência está saudável e o limite está sendo usado por inteiro, ele cresce de
+forma aditiva (+ADAPTIVE_LIMIT_INCREASE por janela de `limite` respostas); com
+429/5xx, timeouts, erros de conexão ou picos de latência (acima de
+<BACKEND>_LIMIT_LATENCY_TOLERANCE x a latência de base), é multiplicado por
+ADAPTIVE_LIMIT_DECREASE, no máximo uma vez por janela. O Retry-After de um 429/503
+pausa novas requisições. A vazão resultante (req/s) fica no log e em /metrics.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from metrics import REGISTRY, limiter_collector
+
+OK, OVERLOAD, IGNORED = "ok", "overload", "ignored"
+
+# backend -> (limite inicial, teto, tolerância de latência)
+_DEFAULTS = {"glpi": ("2", "8", "2.5"), "ollama": ("1", "4", "3.0")}
+
+
+@dataclass
+class AdaptiveLimitConfig:
+    enabled: bool; initial: float; min_limit: float; max_limit: float; increase: float; decrease: float
+    latency_tolerance: float; min_samples: int
+    @classmethod
+    def from_env(cls, backend: str) -> 'AdaptiveLimitConfig':
+        prefix = backend.upper(); initial, ceiling, tolerance = _DEFAULTS.get(backend, ("1", "4", "2.5"))
+        max_limit = max(1.0, float(os.getenv(f'{prefix}_LIMIT_MAX', ceiling)))
+        return cls(enabled=os.getenv('ADAPTIVE_LIMIT_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   initial=min(max_limit, max(1.0, float(os.getenv(f'{prefix}_LIMIT_INITIAL', initial)))), min_limit=1.0, max_limit=max_limit,
+                   increase=float(os.getenv('ADAPTIVE_LIMIT_INCREASE', '1')),
+                   decrease=min(0.95, max(0.1, float(os.getenv('ADAPTIVE_LIMIT_DECREASE', '0.5')))),
+                   latency_tolerance=float(os.getenv(f'{prefix}_LIMIT_LATENCY_TOLERANCE', tolerance)),
+                   min_samples=int(os.getenv('ADAPTIVE_LIMIT_MIN_SAMPLES', '10')))
+
+
+def _retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    value = response.headers.get('Retry-After') if response is not None else None
+    try: return max(0.0, float(value)) if value else None
+    except ValueError: return None  # formato de data HTTP: ignorado
+
+
+def classify(error: Optional[BaseException]) -> str:
+    """Sobrecarga: 429/5xx, timeout ou falha de conexão. Outros erros (4xx, JSON inválido) não mexem no limite."""
+    if error is None: return OK
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return OVERLOAD if status is not None and (status == 429 or status >= 500) else IGNORED
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)): return OVERLOAD
+    return IGNORED
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, config: AdaptiveLimitConfig):
+        self.name = name; self.config = config; self.logger = logging.getLogger(__name__)
+        self.limit = config.initial; self.in_flight = 0
+        self.baselines: Dict[str, Tuple[float, int]] = {}; self.ewma_latency: Optional[float] = None
+        self.successes = 0; self.overloads = 0; self.decreases = 0; self.wait_seconds = 0.0
+        self._completed: Deque[float] = deque(maxlen=5000); self._last_decrease = 0.0; self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    # -- reserva e liberação -------------------------------------------------------
+    def acquire(self) -> float:
+        """Espera uma vaga (e o fim de uma pausa por Retry-After); retorna o instante de início."""
+        if not self.config.enabled: return time.monotonic()
+        requested = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until: self._cond.wait(self._paused_until - now)
+                elif self.in_flight >= int(self.limit): self._cond.wait(1.0)
+                else: break
+            self.in_flight += 1; started = time.monotonic(); self.wait_seconds += started - requested
+        return started
+
+    def release(self, started: float, outcome: str, retry_after: Optional[float] = None, kind: str = "") -> None:
+        """Registra o resultado; `kind` separa a latência de base de requisições de custo diferente (ex.: 'POST search')."""
+        if not self.config.enabled: return
+        now = time.monotonic(); latency = now - started
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit); self.in_flight = max(0, self.in_flight - 1)
+            if outcome == OK:
+                self.successes += 1; self._completed.append(now)
+                baseline, samples = self.baselines.get(kind, (latency, 0))
+                if samples >= self.config.min_samples and latency > self.config.latency_tolerance * baseline:
+                    self._decrease(started, f"latência {latency:.2f}s acima de {self.config.latency_tolerance:g}x a base de {baseline:.2f}s{f' em {kind}' if kind else ''}")
+                elif saturated: self._increase()
+                # A base acompanha devagar mudanças duradouras; a EWMA rápida é só para o log
+                self.baselines[kind] = (baseline + 0.05 * (latency - baseline), samples + 1)
+                self.ewma_latency = latency if self.ewma_latency is None else self.ewma_latency + 0.3 * (latency - self.ewma_latency)
+            elif outcome == OVERLOAD:
+                self.overloads += 1
+                self._decrease(started, f"sobrecarga após {latency:.2f}s" + (f", Retry-After {retry_after:.0f}s" if retry_after else ""))
+                if retry_after: self._paused_until = max(self._paused_until, now + retry_after)
+            self._cond.notify_all()
+
+    def _increase(self) -> None:
+        previous = int(self.limit)
+        self.limit = min(self.config.max_limit, self.limit + self.config.increase / self.limit)
+        if int(self.limit) > previous: self.logger.debug(f"Limite adaptativo '{self.name}' subiu para {int(self.limit)} requisição(ões) simultânea(s).")
+
+    def _decrease(self, started: float, reason: str) -> None:
+        # Requisições iniciadas antes do último corte já estão contabilizadas nele (um corte por janela)
+        if started < self._last_decrease: return
+        previous = self.limit; self.limit = max(self.config.min_limit, self.limit * self.config.decrease)
+        self._last_decrease = time.monotonic(); self.decreases += 1
+        self.logger.info(f"Limite adaptativo '{self.name}' reduzido de {previous:.1f} para {self.limit:.1f} ({reason}).")
+
+    def done(self, started: float, error: Optional[BaseException] = None, kind: str = "") -> None:
+        """Libera a vaga classificando o resultado pela exceção da requisição (None = sucesso)."""
+        self.release(started, classify(error), _retry_after(getattr(error, 'response', None)), kind)
+
+    @contextmanager
+    def request(self, kind: str = "") -> Iterator[None]:
+        """Executa o bloco dentro de uma vaga; o resultado (ou a exceção) ajusta o limite."""
+        started = self.acquire()
+        try: yield
+        except Exception as e: self.done(started, e, kind); raise
+        else: self.done(started, kind=kind)
+
+    # -- estado --------------------------------------------------------------------
+    def throughput(self, window: float = 60.0) -> Optional[float]:
+        """Respostas bem-sucedidas por segundo na última janela de `window` segundos."""
+        now = time.monotonic()
+        with self._cond: recent = [t for t in self._completed if now - t <= window]
+        if len(recent) < 2: return None
+        return len(recent) / max(now - recent[0], 1e-6)
+
+    def snapshot(self) -> Dict[str, Any]:
+        throughput = self.throughput()
+        with self._cond:
+            return {"backend": self.name, "limit": self.limit, "max_limit": self.config.max_limit, "in_flight": self.in_flight,
+                    "ewma_latency": self.ewma_latency, "baselines": {kind: base for kind, (base, _) in self.baselines.items()}, "throughput": throughput,
+                    "successes": self.successes, "overloads": self.overloads, "decreases": self.decreases, "wait_seconds": self.wait_seconds}
+
+    def log_state(self) -> None:
+        if not self.config.enabled: return
+        s = self.snapshot(); fmt = lambda value, unit: f"{value:.2f}{unit}" if value is not None else "n/d"
+        bases = ", ".join(f"{kind or 'geral'} {base:.2f}s" for kind, base in s["baselines"].items()) or "n/d"
+        self.logger.info(f"Limite adaptativo '{s['backend']}': limite={s['limit']:.1f} (teto {s['max_limit']:g}), em andamento={s['in_flight']}, "
+                         f"vazão={fmt(s['throughput'], ' req/s')}, latência EWMA={fmt(s['ewma_latency'], 's')} (base: {bases}), "
+                         f"sucessos={s['successes']}, sobrecargas={s['overloads']}, reduções={s['decreases']}, espera total={s['wait_seconds']:.1f}s")
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    """Retorna o limitador compartilhado do backend `name` ('glpi', 'ollama'), criando-o na primeira chamada."""
+    with _limiters_lock:
+        if name not in _limiters:
+            if not _limiters: REGISTRY.add_collector(limiter_collector(snapshots))
+            _limiters[name] = AdaptiveLimiter(name, AdaptiveLimitConfig.from_env(name))
+        return _limiters[name]
+
+
+def snapshots() -> List[Dict[str, Any]]:
+    with _limiters_lock: limiters = [limiter for limiter in _limiters.values() if limiter.config.enabled]
+    return [limiter.snapshot() for limiter in limiters]
+
+
+def log_state() -> None:
+    """Estado de todos os limitadores ativos (chamado ao fim de cada ciclo)."""
+    with _limiters_lock: limiters = list(_limiters.values())
+    for limiter in limiters: limiter.log_state()
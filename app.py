@@ -7,51 +7,98 @@ Versão: 6.0.0 - Lógica de rastreamento de chamados via arquivo de texto local.
 import os
 import logging
 import json
+import queue
+import sys
+import threading
 import time
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Set
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any, Tuple
 
 import requests
 from dotenv import load_dotenv
 from apscheduler.schedulers.blocking import BlockingScheduler
 
+from adaptive_limit import get_limiter, log_state as log_limits
+from dedup import DedupConfig, DuplicateGroup, NearDuplicateGrouper, SimilarityHistory
+from http_transport import GLPISession, TransportConfig, SessionTokenCache, get_session
+from leases import LeaseConfig, LeaseManager
+from llm_cache import CacheConfig, LLMResultCache
+from metrics import (BACKLOG, CLASSIFIER_DECISIONS, EVENT_LATENCY, REGISTRY, SESSION_REINITS, STAGE_ERRORS, STAGE_SECONDS, TICKETS_PROCESSED, CycleHealth,
+                     MetricsConfig, cache_collector, create_server, router_collector, start_server, work_queue_collector)
+from ollama_client import OllamaClient
+from ollama_router import EndpointRouter
+from pre_classifier import ClassifierConfig, PreClassifier, collect_examples, evaluate, is_holdout, load_classifier, prompt_fingerprint
+from preprocessing import PreprocessConfig, TicketPreprocessor
+from processed_store import ProcessedStore, content_hash
+from streaming import prefetch
+from webhook import WebhookConfig, enable_push_mode
+from work_queue import WorkQueue, WorkQueueConfig
+from write_behind import QUEUED, WriteBehindConfig, WriteBehindQueue
+
 load_dotenv()
 
 # =============================================================================
 # CONFIGURATION AND DATA MODELS
 # =============================================================================
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field, replace
 
 # ! MODIFICADO - GLPIConfig não precisa mais do ID do campo personalizado
 @dataclass
 class GLPIConfig:
     url: str; app_token: str; user_token: str
+    # GLPI_FETCH_MODE: 'full' (todos os chamados ativos) ou 'incremental' (watermark de date_mod)
+    fetch_mode: str = 'full'; active_status_ids: List[int] = field(default_factory=lambda: [1, 2, 3, 4])
+    search_page_size: int = 500; content_batch_size: int = 50
     @classmethod
     def from_env(cls) -> 'GLPIConfig':
-        return cls(url=os.getenv('GLPI_URL', ''), app_token=os.getenv('GLPI_APP_TOKEN', ''), user_token=os.getenv('GLPI_USER_TOKEN', ''))
+        return cls(url=os.getenv('GLPI_URL', ''), app_token=os.getenv('GLPI_APP_TOKEN', ''), user_token=os.getenv('GLPI_USER_TOKEN', ''),
+                   fetch_mode=os.getenv('GLPI_FETCH_MODE', 'full').strip().lower(),
+                   active_status_ids=[int(sid.strip()) for sid in os.getenv('GLPI_ACTIVE_STATUS_IDS', '1,2,3,4').split(',')],
+                   search_page_size=int(os.getenv('GLPI_SEARCH_PAGE_SIZE', '500')),
+                   content_batch_size=int(os.getenv('GLPI_CONTENT_BATCH_SIZE', '50')))
 
 # ... (outras classes de configuração e modelos de dados sem alterações) ...
 @dataclass
 class LLMConfig:
     api_urls: List[str]; model: str; analysis_prompt: str
+    latency_ewma_alpha: float = 0.3; circuit_failure_threshold: int = 3; circuit_open_seconds: float = 60.0
+    batch_size: int = 1  # OLLAMA_BATCH_SIZE > 1 ativa o modo lote (vários chamados por requisição)
     @classmethod
     def from_env(cls) -> 'LLMConfig':
-        return cls(api_urls=os.getenv('OLLAMA_API_URLS', 'http://localhost:11434').split(','), model=os.getenv('OLLAMA_MODEL', 'llama3'), analysis_prompt=os.getenv('OLLAMA_ANALYSIS_PROMPT', ''))
+        return cls(api_urls=os.getenv('OLLAMA_API_URLS', 'http://localhost:11434').split(','), model=os.getenv('OLLAMA_MODEL', 'llama3'), analysis_prompt=os.getenv('OLLAMA_ANALYSIS_PROMPT', ''),
+                   latency_ewma_alpha=float(os.getenv('OLLAMA_LATENCY_EWMA_ALPHA', '0.3')),
+                   circuit_failure_threshold=int(os.getenv('OLLAMA_CIRCUIT_FAILURE_THRESHOLD', '3')),
+                   circuit_open_seconds=float(os.getenv('OLLAMA_CIRCUIT_OPEN_SECONDS', '60')),
+                   batch_size=max(1, int(os.getenv('OLLAMA_BATCH_SIZE', '1'))))
 
 @dataclass
 class AppConfig:
-    log_level: str; assessment_interval_minutes: int
+    log_level: str; assessment_interval_minutes: int; max_workers: int; watermark_path: str
+    state_db_path: str; processed_batch_size: int; processed_retention_days: int; legacy_processed_path: str
     @classmethod
     def from_env(cls) -> 'AppConfig':
-        return cls(log_level=os.getenv('LOG_LEVEL', 'INFO'), assessment_interval_minutes=int(os.getenv('ASSESSMENT_INTERVAL_MINUTES', '30')))
+        # ASSESSMENT_MAX_WORKERS=1 mantém o modo sequencial original (com pausa entre chamados)
+        return cls(log_level=os.getenv('LOG_LEVEL', 'INFO'), assessment_interval_minutes=int(os.getenv('ASSESSMENT_INTERVAL_MINUTES', '30')),
+                   max_workers=max(1, int(os.getenv('ASSESSMENT_MAX_WORKERS', '1'))),
+                   watermark_path=os.getenv('GLPI_WATERMARK_PATH', '/tmp/glpi_assessor_watermark.txt'),
+                   state_db_path=os.getenv('STATE_DB_PATH', 'glpi_state.db'),
+                   processed_batch_size=int(os.getenv('PROCESSED_STORE_BATCH_SIZE', '20')),
+                   processed_retention_days=int(os.getenv('PROCESSED_RETENTION_DAYS', '90')),
+                   legacy_processed_path=os.getenv('PROCESSED_LEGACY_PATH', '/tmp/processed_ids.txt'))
 
 @dataclass
 class Ticket:
-    id: str; title: str; content: str
+    id: str; title: str; content: str; date_mod: str = ''
+    # Campos de ordenação da fila de trabalho: 15 (date_creation), 18 (time_to_resolve/SLA) e 80 (entidade)
+    date_creation: str = ''; due_date: str = ''; entity: str = ''
 
 @dataclass
 class LLMAnalysisResult:
     priority: int; urgency: int; new_title: str; new_category_id: int
+    # 'local' quando decidido pelo pré-classificador; 'cache' e 'dedup' quando herdado de um chamado idêntico
+    # ou quase duplicado (grupo ou histórico de similaridade). Só 'llm' entra no treino.
+    source: str = 'llm'
 
 def setup_logging(log_level: str = 'INFO') -> None:
     logging.basicConfig(level=getattr(logging, log_level.upper()), format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler(), logging.FileHandler('glpi_assessor.log')])
@@ -60,17 +107,33 @@ def setup_logging(log_level: str = 'INFO') -> None:
 # GLPI SERVICE
 # =============================================================================
 class GLPIService:
-    def __init__(self, config: GLPIConfig):
-        self.config = config; self.session_token: Optional[str] = None; self.logger = logging.getLogger(__name__); self.init_session()
-
-    # ... (init_session e _make_request sem alterações) ...
-    def init_session(self) -> bool:
+    def __init__(self, config: GLPIConfig, transport: Optional[TransportConfig] = None, session: Optional[GLPISession] = None):
+        self.config = config; self.logger = logging.getLogger(__name__)
+        self.transport = transport or TransportConfig.from_env()
+        self.http = get_session("glpi", self.transport.glpi_pool_size); self.limiter = get_limiter("glpi")
+        # Sessão própria ou a de outro serviço (daemon combinado); a trava evita reinicializações simultâneas
+        self.session = session or GLPISession(SessionTokenCache(self.transport.session_cache_path, self.transport.session_ttl_seconds,
+                                                                config.url, config.user_token))
+        if not self.session.token: self.init_session()
+
+    @property
+    def session_token(self) -> Optional[str]: return self.session.token
+    @session_token.setter
+    def session_token(self, value: Optional[str]) -> None: self.session.token = value
+    @property
+    def token_cache(self) -> SessionTokenCache: return self.session.token_cache
+
+    def init_session(self, force: bool = False) -> bool:
+        """Obtém um session_token, reaproveitando o do cache em disco quando ainda válido (exceto com `force`)."""
+        if not force:
+            cached_token = self.token_cache.load()
+            if cached_token: self.session_token = cached_token; self.logger.info("Sessão GLPI reaproveitada do cache local."); return True
         try:
             headers = {"App-Token": self.config.app_token, "Content-Type": "application/json"}; payload = {"user_token": self.config.user_token}
-            response = requests.post(f"{self.config.url}/initSession", headers=headers, json=payload, verify=False, timeout=10)
+            response = self.http.post(f"{self.config.url}/initSession", headers=headers, json=payload, verify=False, timeout=self.transport.glpi_timeout(10))
             response.raise_for_status()
             self.session_token = response.json().get("session_token")
-            if self.session_token: self.logger.info("Sessão GLPI inicializada com sucesso."); return True
+            if self.session_token: self.token_cache.save(self.session_token); self.logger.info("Sessão GLPI inicializada com sucesso."); return True
             self.logger.error(f"Falha ao obter session_token do GLPI. Resposta: {response.text}"); return False
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 400: self.logger.critical("ERRO 400 (Bad Request): Falha de Autenticação com o GLPI. Verifique os TOKENS no arquivo .env.")
@@ -80,15 +143,29 @@ class GLPIService:
             self.logger.error(f"Erro de conexão ao inicializar sessão GLPI: {e}"); self.session_token = None; return False
 
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
+        response = self._send(method, endpoint, **kwargs)
+        if response is None: return None
+        try: return response.json() if response.text else {}
+        except ValueError as e: self.logger.error(f"Resposta inválida da API para {method} {endpoint}: {e}"); return None
+
+    def _send(self, method: str, endpoint: str, **kwargs) -> Optional[requests.Response]:
+        """Executa a requisição (reinicializando a sessão em caso de 401) e retorna a resposta bruta."""
         if not self.session_token and not self.init_session(): return None
         headers = {"App-Token": self.config.app_token, "Session-Token": self.session_token, "Content-Type": "application/json"}
+        timeout = self.transport.glpi_timeout()
         try:
-            response = requests.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=20, **kwargs)
-            if response.status_code == 401:
-                self.logger.warning("Sessão GLPI expirada. Reinicializando...");
-                if self.init_session(): headers["Session-Token"] = self.session_token; response = requests.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=20, **kwargs)
-            response.raise_for_status()
-            return response.json() if response.text else {}
+            with self.limiter.request(f"{method} {endpoint.split('/')[0]}"):  # 429/5xx, timeouts e picos de latência reduzem o limite adaptativo
+                response = self.http.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=timeout, **kwargs)
+                if response.status_code == 401:
+                    expired_token = headers["Session-Token"]
+                    with self.session.lock:
+                        if self.session_token == expired_token:
+                            self.logger.warning("Sessão GLPI expirada. Reinicializando...")
+                            self.token_cache.clear(); SESSION_REINITS.inc(); self.init_session(force=True)
+                    if self.session_token and self.session_token != expired_token: headers["Session-Token"] = self.session_token; response = self.http.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=timeout, **kwargs)
+                response.raise_for_status()
+            self.token_cache.touch(headers["Session-Token"])
+            return response
         except requests.exceptions.HTTPError as e:
             self.logger.error(f"Erro na requisição API para {method} {endpoint}: {e.response.status_code} {e.response.reason} - {e.response.text}")
             return None
@@ -102,50 +179,144 @@ class GLPIService:
 
 
 
-    def get_all_active_tickets(self) -> List[Ticket]:
+    @staticmethod
+    def _to_ticket(row: Dict, content: Optional[str] = None) -> Ticket:
+        return Ticket(id=str(row.get('2')), title=row.get('1', "N/A"), content=(row.get('24') or "") if content is None else content,
+                      date_mod=row.get('19') or "", date_creation=row.get('15') or "", due_date=row.get('18') or "", entity=row.get('80') or "")
+
+    @staticmethod
+    def _total_count(response: requests.Response, body: Any) -> Optional[int]:
+        """Total de linhas da busca: cabeçalho Content-Range ('0-499/1532') ou `totalcount` do corpo."""
+        content_range = response.headers.get("Content-Range", "")
+        if "/" in content_range:
+            try: return int(content_range.rsplit("/", 1)[1])
+            except ValueError: pass
+        if isinstance(body, dict) and body.get('totalcount') is not None:
+            return int(body['totalcount'])
+        return None
+
+    def iter_search(self, itemtype: str, payload: Dict, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
         """
-        Busca os chamados mais recentes e filtra localmente para processar
-        apenas os que estão ativos.
+        Gera as páginas de search/<itemtype> sob demanda, seguindo o total informado pelo
+        GLPI. Apenas uma página fica em memória por vez e não há teto de linhas.
         """
-        self.logger.info("Buscando os chamados mais recentes para filtragem...")
-
-        # 1. Payload com a ordenação por data de criação (mais novos primeiro).
+        page_size = page_size or self.config.search_page_size; start = 0
+        while True:
+            with STAGE_SECONDS.time(stage="fetch"): response = self._send("POST", f"search/{itemtype}", json=dict(payload, range=f"{start}-{start + page_size - 1}"))
+            if response is None:
+                self.logger.warning(f"Busca em search/{itemtype} interrompida na linha {start}; o restante fica para o próximo ciclo."); return
+            try: body = response.json() if response.text else {}
+            except ValueError as e: self.logger.error(f"Resposta inválida de search/{itemtype}: {e}"); return
+            page = (body.get('data') or []) if isinstance(body, dict) else (body if isinstance(body, list) else [])
+            total = self._total_count(response, body)
+            if page: yield page
+            start += page_size
+            if not page or len(page) < page_size or (total is not None and start >= total): return
+
+    def iter_active_tickets(self, is_processed: Callable[[str, Optional[str]], bool]) -> Iterator[List[Ticket]]:
+        """
+        Gera, página a página, os chamados ativos ainda não processados (mais novos primeiro).
+        O status é filtrado no servidor e conferido de novo localmente. `is_processed`
+        recebe o ID e o conteúdo do chamado.
+        """
+        self.logger.info("Buscando chamados ativos página a página...")
         payload = {
             "is_deleted": 0,
-            "forcedisplay": [2, 1, 24, 12],  # ID, Título, Conteúdo, Status
-            "range": "0-2000",
-            # A MUDANÇA CRÍTICA: Ordenar por data de criação, do mais novo para o mais antigo
+            "criteria": self._any_of(12, self.config.active_status_ids),
+            "forcedisplay": [2, 1, 24, 12, 15, 19, 18, 80],  # ID, Título, Conteúdo, Status, Criação, Modificação, SLA, Entidade
             "sort": 15,  # 15 é o ID do campo 'date_creation' (Data de Criação)
             "order": "DESC"
         }
+        listed = 0
+        for page in self.iter_search("Ticket", payload):
+            listed += len(page)
+            tickets = [self._to_ticket(item) for item in page if item.get('12') in self.config.active_status_ids and not is_processed(str(item.get('2')), item.get('24') or "")]
+            if tickets: yield tickets
+        self.logger.info(f"Busca concluída: {listed} chamados ativos listados pela API.")
 
-        response_data = self._make_request("POST", "search/Ticket", json=payload)
-
-        full_ticket_list = []
-        if isinstance(response_data, dict) and 'data' in response_data:
-            full_ticket_list = response_data['data']
-        elif isinstance(response_data, list):
-            full_ticket_list = response_data
-
-        if not full_ticket_list:
-            self.logger.info("Nenhum chamado foi retornado pela API.")
-            return []
-
-        self.logger.info(f"API retornou {len(full_ticket_list)} chamados recentes. Filtrando apenas os ativos...")
+    def get_all_active_tickets(self) -> List[Ticket]:
+        """Busca todos os chamados ativos (versão em lista de `iter_active_tickets`)."""
+        return [ticket for page in self.iter_active_tickets(lambda ticket_id, content: False) for ticket in page]
 
-        # 2. Filtramos a lista comparando NÚMERO com NÚMERO.
-        active_tickets_data = [
-            item for item in full_ticket_list
-            if item.get('12') in [1, 2, 3, 4]
-        ]
+    @staticmethod
+    def _any_of(field_id: int, values: List[Any]) -> List[Dict]:
+        """Critérios 'equals' ligados por OR (equivalente a um IN do SQL)."""
+        return [{'link': 'OR', 'field': field_id, 'searchtype': 'equals', 'value': v} for v in values]
 
-        # 3. Montamos a lista final de objetos Ticket.
-        tickets = [
-            Ticket(id=str(item.get('2')), title=item.get('1', "N/A"), content=item.get('24', ""))
-            for item in active_tickets_data
-        ]
-
-        self.logger.info(f"Encontrados {len(tickets)} chamados verdadeiramente ativos para processar.")
+    def iter_active_tickets_incremental(self, watermark: Optional[str], is_processed: Callable[[str, Optional[str]], bool],
+                                        fetch_content: bool = True, modified_after_processing: Optional[Callable[[str, float], bool]] = None
+                                        ) -> Iterator[List[Ticket]]:
+        """
+        Gera apenas chamados ativos modificados após `watermark` (date_mod), com os
+        filtros de status aplicados no servidor. A listagem não traz o conteúdo (campo 24);
+        ele é buscado em lotes somente para os IDs ainda não processados de cada página
+        (`is_processed` é consultado só pelo ID, com conteúdo None) e para os processados cujo
+        date_mod é posterior ao processamento (`modified_after_processing`). Estes só seguem
+        se o hash do conteúdo mudou: a modificação feita pelo próprio PUT da análise (título,
+        prioridade, categoria) não altera o conteúdo e é descartada. Sem `fetch_content` (fila
+        de trabalho, que busca o conteúdo e confere o hash ao processar), os chamados vêm sem conteúdo.
+        """
+        self.logger.info(f"Busca incremental de chamados ativos (date_mod > {watermark or 'início'})...")
+        criteria: List[Dict] = [{'criteria': self._any_of(12, self.config.active_status_ids)}]
+        if watermark:
+            # 'morethan' é estrito e o date_mod tem resolução de 1s: recua 1s para não perder edições no mesmo segundo
+            # do watermark (os já processados são descartados pelo histórico)
+            try: since = (datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S") - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+            except ValueError: since = watermark
+            criteria.append({'link': 'AND', 'field': 19, 'searchtype': 'morethan', 'value': since})
+        payload = {"is_deleted": 0, "criteria": criteria, "forcedisplay": [2, 1, 12, 19, 15, 18, 80], "sort": 19, "order": "ASC"}
+        listed = pending_total = edited_total = 0
+        for page in self.iter_search("Ticket", payload):
+            listed += len(page)
+            pending = {str(item.get('2')): item for item in page if not is_processed(str(item.get('2')), None)}
+            recheck = set()
+            if modified_after_processing:
+                for item in page:
+                    ticket_id = str(item.get('2')); modified = self._timestamp(item.get('19'))
+                    if ticket_id not in pending and modified is not None and modified_after_processing(ticket_id, modified):
+                        pending[ticket_id] = item; recheck.add(ticket_id)
+            ids = list(pending); batch_size = self.config.content_batch_size; pending_total += len(ids) - len(recheck)
+            if not fetch_content:
+                if ids: yield [self._to_ticket(pending[ticket_id], "") for ticket_id in ids]
+                continue
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                batch_payload = {"is_deleted": 0, "criteria": self._any_of(2, batch), "forcedisplay": [2, 24], "range": f"0-{len(batch) - 1}"}
+                with STAGE_SECONDS.time(stage="fetch"): response_data = self._make_request("POST", "search/Ticket", json=batch_payload)
+                rows = response_data.get('data', []) if isinstance(response_data, dict) else (response_data or [])
+                contents = {str(row.get('2')): row.get('24') or "" for row in rows}
+                edited = [ticket_id for ticket_id in batch if ticket_id in recheck and not is_processed(ticket_id, contents.get(ticket_id, ""))]
+                if edited: self.logger.info(f"Chamado(s) {', '.join('#' + t for t in edited)} editado(s) após a análise; serão reprocessados.")
+                tickets = [self._to_ticket(pending[ticket_id], contents.get(ticket_id, "")) for ticket_id in batch
+                           if ticket_id not in recheck or ticket_id in edited]
+                edited_total += len(edited)
+                if tickets: yield tickets
+        self.logger.info(f"API listou {listed} chamados ativos modificados; {pending_total} ainda não processados, {edited_total} editados após a análise.")
+
+    @staticmethod
+    def _timestamp(value: Optional[str]) -> Optional[float]:
+        """date_mod do GLPI ('AAAA-MM-DD HH:MM:SS', horário local) em segundos desde a época."""
+        try: return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp() if value else None
+        except ValueError: return None
+
+    def get_active_tickets_by_ids(self, ticket_ids: List[str]) -> Optional[List[Ticket]]:
+        """
+        Busca pelo ID, em lotes de GLPI_CONTENT_BATCH_SIZE, os chamados ainda ativos (eventos do
+        webhook e fila de trabalho). Retorna None se alguma busca falhar.
+        """
+        return self.get_tickets_by_ids(ticket_ids, self.config.active_status_ids)
+
+    def get_tickets_by_ids(self, ticket_ids: List[str], status_ids: Optional[List[int]] = None) -> Optional[List[Ticket]]:
+        """Como `get_active_tickets_by_ids`, mas com qualquer status quando `status_ids` é None (treino do pré-classificador)."""
+        tickets: List[Ticket] = []; batch_size = self.config.content_batch_size
+        for i in range(0, len(ticket_ids), batch_size):
+            batch = ticket_ids[i:i + batch_size]; criteria = [{'criteria': self._any_of(2, batch)}]
+            if status_ids is not None: criteria.append({'link': 'AND', 'criteria': self._any_of(12, status_ids)})
+            payload = {"is_deleted": 0, "criteria": criteria, "forcedisplay": [2, 1, 24, 12, 19, 15, 18, 80], "range": f"0-{len(batch) - 1}"}
+            with STAGE_SECONDS.time(stage="fetch"): response_data = self._make_request("POST", "search/Ticket", json=payload)
+            if response_data is None: return None
+            rows = response_data.get('data', []) if isinstance(response_data, dict) else (response_data or [])
+            tickets += [self._to_ticket(row) for row in rows if status_ids is None or row.get('12') in status_ids]
         return tickets
 
     def oldget_all_active_tickets(self) -> List[Ticket]:
@@ -182,50 +353,160 @@ class GLPIService:
         return tickets
 
     # ! MODIFICADO - Apenas atualiza o chamado, não o marca mais.
-    def update_ticket(self, ticket_id: str, analysis: LLMAnalysisResult) -> bool:
-        """Atualiza um chamado com os dados da análise da LLM."""
-        self.logger.info(f"Preparando atualização para chamado #{ticket_id}...")
-
+    @staticmethod
+    def ticket_input(analysis: LLMAnalysisResult) -> Dict[str, Any]:
         payload_input = {"name": analysis.new_title, "priority": analysis.priority, "urgency": analysis.urgency}
         if analysis.new_category_id > 0:
             payload_input["itilcategories_id"] = analysis.new_category_id
+        return payload_input
 
-        payload = {"input": payload_input}
-        response = self._make_request("PUT", f"Ticket/{ticket_id}", json=payload)
+    def update_ticket(self, ticket_id: str, analysis: LLMAnalysisResult) -> bool:
+        """Atualiza um chamado com os dados da análise da LLM."""
+        self.logger.info(f"Preparando atualização para chamado #{ticket_id}...")
+
+        payload = {"input": self.ticket_input(analysis)}
+        with STAGE_SECONDS.time(stage="update"): response = self._make_request("PUT", f"Ticket/{ticket_id}", json=payload)
 
         if response is not None:
             self.logger.info(f"Chamado #{ticket_id} atualizado com sucesso.")
             return True
 
-        self.logger.error(f"Falha ao atualizar o chamado #{ticket_id}.")
+        self.logger.error(f"Falha ao atualizar o chamado #{ticket_id}."); STAGE_ERRORS.inc(stage="update")
         return False
 
+    def update_tickets(self, inputs: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Atualização em massa (PUT Ticket com uma lista em `input`, cada item com seu `id`).
+        O GLPI responde um objeto {"<id>": true|false, "message": ...} por item; retorna
+        o sucesso de cada item na ordem de `inputs`.
+        """
+        with STAGE_SECONDS.time(stage="update"): response = self._make_request("PUT", "Ticket", json={"input": inputs})
+        if not isinstance(response, list):
+            self.logger.error(f"Falha na atualização em lote de {len(inputs)} chamado(s)."); STAGE_ERRORS.inc(len(inputs), stage="update")
+            return [False] * len(inputs)
+        confirmed: Dict[str, bool] = {}
+        for item in response:
+            if not isinstance(item, dict): continue
+            for key, value in item.items():
+                if key != "message": confirmed[str(key)] = value is True
+            if item.get("message"): self.logger.warning(f"GLPI na atualização em lote: {item['message']}")
+        results = [confirmed.get(str(item_input["id"]), False) for item_input in inputs]
+        for item_input, ok in zip(inputs, results):
+            if not ok: self.logger.error(f"Falha ao atualizar o chamado #{item_input['id']} (lote)."); STAGE_ERRORS.inc(stage="update")
+        return results
+
 # =============================================================================
 # LLM SERVICE (Sem alterações)
 # =============================================================================
 class LLMService:
-    def __init__(self, config: LLMConfig):
-        self.config = config; self.logger = logging.getLogger(__name__)
+    def __init__(self, config: LLMConfig, transport: Optional[TransportConfig] = None, cache: Optional[LLMResultCache] = None,
+                 preprocessor: Optional[TicketPreprocessor] = None, classifier: Optional[PreClassifier] = None):
+        self.config = config; self.logger = logging.getLogger(__name__); self.cache = cache; self.classifier = classifier
+        self.preprocessor = preprocessor or TicketPreprocessor(PreprocessConfig.from_env())
+        self.transport = transport or TransportConfig.from_env()
+        self.http = get_session("ollama", self.transport.ollama_pool_size)
+        self.router = EndpointRouter(config.api_urls, alpha=config.latency_ewma_alpha,
+                                     failure_threshold=config.circuit_failure_threshold, open_seconds=config.circuit_open_seconds)
+        self.client = OllamaClient(self.http, self.router, self.transport, config.model)
+
+    def warm_up(self) -> None:
+        """Carrega o modelo nos endpoints e deixa as regras de análise no cache de prefixo (OLLAMA_WARMUP)."""
+        self.client.warm_up(self.config.analysis_prompt)
 
     def analyze_ticket(self, ticket: Ticket) -> Optional[LLMAnalysisResult]:
+        """
+        Analisa o chamado na LLM, reaproveitando do cache o resultado de chamados com
+        título e descrição idênticos e aplicando direto as decisões confiantes do pré-classificador.
+        """
+        cache_key = self.cache.key(ticket.title, ticket.content) if self.cache else None
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Análise do chamado #{ticket.id} obtida do cache.")
+                return LLMAnalysisResult(**dict(cached, source='cache'))
+        local = self.pre_classify(ticket)
+        if local: return local
+        analysis = self._request_analysis(ticket)
+        if analysis and cache_key: self.cache.put(cache_key, asdict(analysis))
+        return analysis
+
+    def pre_classify(self, ticket: Ticket) -> Optional[LLMAnalysisResult]:
+        """Decisão do pré-classificador local quando a confiança atinge o limiar (título mantido); None para usar a LLM."""
+        if not self.classifier: return None
+        decision = self.classifier.classify(self.preprocessor.process(ticket.content).text)
+        if decision is None: CLASSIFIER_DECISIONS.inc(result="llm"); return None
+        labels, confidence = decision; CLASSIFIER_DECISIONS.inc(result="local")
+        self.logger.info(f"Chamado #{ticket.id} classificado localmente (confiança {confidence:.2f}); chamada à LLM evitada.")
+        return LLMAnalysisResult(priority=labels["priority"], urgency=labels["urgency"], new_title=ticket.title,
+                                 new_category_id=labels["new_category_id"], source="local")
+
+    def _request_analysis(self, ticket: Ticket) -> Optional[LLMAnalysisResult]:
         self.logger.info(f"Analisando risco e título para o chamado #{ticket.id}")
-        full_content = f"TÍTULO ATUAL: {ticket.title}\n\nDESCRIÇÃO: {ticket.content}"
-        prompt = f"{self.config.analysis_prompt}\n\nCONTEÚDO DO CHAMADO:\n---\n{full_content}\n---\n\nJSON:"
-        for api_url in self.config.api_urls:
-            try:
-                payload = {"model": self.config.model, "prompt": prompt, "stream": False, "options": {"temperature": 0.2}, "format": "json"}
-                response = requests.post(f"{api_url.strip()}/api/generate", json=payload, timeout=45)
-                response.raise_for_status(); response_str = response.json().get("response", "").strip()
-                if not response_str: continue
-                response_json = json.loads(response_str)
-                return LLMAnalysisResult(
-                    priority=int(response_json.get("priority", 3)),
-                    urgency=int(response_json.get("urgency", 3)),
-                    new_title=str(response_json.get("new_title", ticket.title)).strip() or ticket.title,
-                    new_category_id=int(response_json.get("new_category_id", 0)))
-            except (requests.exceptions.RequestException, json.JSONDecodeError, TypeError, ValueError) as e:
-                self.logger.error(f"Falha ao analisar chamado #{ticket.id} com a LLM em {api_url}. Erro: {e}")
-        return None
+        full_content = f"TÍTULO ATUAL: {ticket.title}\n\nDESCRIÇÃO: {self.preprocessor.clean(ticket.id, ticket.content)}"
+        prompt = f"CONTEÚDO DO CHAMADO:\n---\n{full_content}\n---\n\nJSON:"
+        generated = self.client.generate_json(prompt, 45, lambda response_json: LLMAnalysisResult(
+            priority=int(response_json.get("priority", 3)),
+            urgency=int(response_json.get("urgency", 3)),
+            new_title=str(response_json.get("new_title", ticket.title)).strip() or ticket.title,
+            new_category_id=int(response_json.get("new_category_id", 0))), f"o chamado #{ticket.id}", options={"temperature": 0.2},
+            system=self.config.analysis_prompt, kind="analysis")
+        return generated[0] if generated else None
+
+    def analyze_batch(self, tickets: List[Ticket]) -> Dict[str, LLMAnalysisResult]:
+        """
+        Modo lote: envia vários chamados num único /api/generate, com as regras do prompt
+        uma só vez, e pede um item JSON por chamado. Cada item é validado isoladamente;
+        só os válidos são retornados, cabendo a quem chama analisar os ausentes um a um.
+        """
+        results: Dict[str, LLMAnalysisResult] = {}; pending: List[Ticket] = []
+        for ticket in tickets:
+            cached = self.cache.get(self.cache.key(ticket.title, ticket.content)) if self.cache else None
+            local = self.pre_classify(ticket) if cached is None else None
+            if cached is not None: results[ticket.id] = LLMAnalysisResult(**dict(cached, source='cache'))
+            elif local: results[ticket.id] = local
+            else: pending.append(ticket)
+        if not pending: return results
+        if len(pending) == 1:
+            analysis = self._request_analysis(pending[0])  # cache e pré-classificador já consultados acima
+            if analysis:
+                results[pending[0].id] = analysis
+                if self.cache: self.cache.put(self.cache.key(pending[0].title, pending[0].content), asdict(analysis))
+            return results
+
+        self.logger.info(f"Analisando em lote os chamados {', '.join('#' + t.id for t in pending)}")
+        blocks = "\n".join(f"CHAMADO ticket_id={t.id}:\n---\nTÍTULO ATUAL: {t.title}\n\nDESCRIÇÃO: {self.preprocessor.clean(t.id, t.content)}\n---" for t in pending)
+        prompt = (f"MODO LOTE: analise CADA chamado abaixo de forma independente, aplicando as regras acima. "
+                  f"Responda com um objeto JSON {{\"resultados\": [...]}} contendo exatamente um item por chamado, cada item com as chaves "
+                  f"ticket_id, new_title, priority, urgency, new_category_id.\n\n{blocks}\n\nJSON:")
+        started = time.monotonic()
+        generated = self.client.generate_json(prompt, 45 * len(pending), lambda data: data, f"o lote de {len(pending)} chamados",
+                                              options={"temperature": 0.2}, system=self.config.analysis_prompt,
+                                              kind="batch", adaptive=False)  # o custo cresce com o tamanho do lote: vale o prazo fixo
+        if not generated: return results
+        data, stats = generated
+        items = data.get("resultados", data) if isinstance(data, dict) else data
+        if isinstance(items, dict):  # também aceita {"<ticket_id>": {...}}
+            items = [dict(v, ticket_id=k) for k, v in items.items() if isinstance(v, dict)]
+        by_id = {t.id: t for t in pending}
+        for item in items if isinstance(items, list) else []:
+            ticket = by_id.get(str(item.get("ticket_id", "")).strip().lstrip("#")) if isinstance(item, dict) else None
+            analysis = self._validate_batch_item(item, ticket) if ticket else None
+            if analysis and ticket.id not in results:
+                results[ticket.id] = analysis
+                if self.cache: self.cache.put(self.cache.key(ticket.title, ticket.content), asdict(analysis))
+        missing = [t.id for t in pending if t.id not in results]
+        self.logger.info(f"Lote de {len(pending)} chamados em {time.monotonic() - started:.1f}s: prompt de {stats.get('prompt_eval_count', 'n/d')} tokens, "
+                         f"{stats.get('eval_count') or 0} tokens gerados ({stats.get('tokens_per_second') or 0:.1f} tokens/s), {len(missing)} item(ns) ausente(s) ou inválido(s).")
+        return results
+
+    @staticmethod
+    def _validate_batch_item(item: Dict[str, Any], ticket: Ticket) -> Optional[LLMAnalysisResult]:
+        try:
+            priority, urgency, category = int(item["priority"]), int(item["urgency"]), int(item.get("new_category_id", 0))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not (1 <= priority <= 5 and 1 <= urgency <= 5 and category >= 0): return None
+        return LLMAnalysisResult(priority=priority, urgency=urgency, new_title=str(item.get("new_title") or "").strip() or ticket.title, new_category_id=category)
 
 # =============================================================================
 # MAIN APPLICATION LOGIC
@@ -235,81 +516,420 @@ class TicketAssessorApp:
         self.app_config = AppConfig.from_env()
         setup_logging(self.app_config.log_level)
         self.logger = logging.getLogger(__name__)
-        self.glpi_service = GLPIService(GLPIConfig.from_env())
-        self.llm_service = LLMService(LLMConfig.from_env())
-        # ! NOVO - Define o caminho do arquivo de rastreamento
-        self.processed_ids_path = "/tmp/processed_ids.txt"
-
-    # ! NOVO - Método para carregar IDs do arquivo de texto
-    def _load_processed_ids(self) -> Set[str]:
-        """Carrega os IDs dos chamados já processados a partir de um arquivo de texto."""
-        if not os.path.exists(self.processed_ids_path):
-            return set()
-        try:
-            with open(self.processed_ids_path, 'r') as f:
-                return {line.strip() for line in f if line.strip()}
-        except IOError as e:
-            self.logger.error(f"Não foi possível ler o arquivo de IDs processados: {e}")
-            return set()
-
-    # ! NOVO - Método para salvar um novo ID no arquivo de texto
-    def _mark_as_processed(self, ticket_id: str) -> None:
-        """Adiciona o ID de um chamado ao arquivo de rastreamento."""
-        try:
-            with open(self.processed_ids_path, 'a') as f:
-                f.write(f"{ticket_id}\n")
-            self.logger.info(f"Chamado #{ticket_id} marcado como processado no arquivo local.")
-        except IOError as e:
-            self.logger.error(f"Não foi possível escrever no arquivo de IDs processados: {e}")
+        transport = TransportConfig.from_env()
+        self.glpi_service = GLPIService(GLPIConfig.from_env(), transport)
+        llm_config = LLMConfig.from_env(); cache_config = CacheConfig.from_env()
+        cache = LLMResultCache(cache_config, "assessor", llm_config.model, llm_config.analysis_prompt) if cache_config.path else None
+        # Pré-classificador local (opcional): decisões confiantes dispensam a LLM
+        self.classifier_config = ClassifierConfig.from_env()
+        self.llm_service = LLMService(llm_config, transport, cache, classifier=load_classifier(self.classifier_config, self._classifier_fingerprint(llm_config)))
+        # Histórico de chamados processados (SQLite), com importação única do antigo arquivo em /tmp
+        self.store = ProcessedStore(self.app_config.state_db_path, "assessor", batch_size=self.app_config.processed_batch_size,
+                                    retention_days=self.app_config.processed_retention_days)
+        self.store.import_text_file(self.app_config.legacy_processed_path)
+        if self.store.get_meta("watermark") is None and os.path.exists(self.app_config.watermark_path):
+            with open(self.app_config.watermark_path, 'r') as f: legacy_watermark = f.read().strip()
+            if legacy_watermark: self.store.set_meta("watermark", legacy_watermark)
+        # Agrupamento de quase duplicados (opcional): uma chamada à LLM por grupo
+        dedup_config = DedupConfig.from_env()
+        self.dedup = NearDuplicateGrouper(dedup_config, SimilarityHistory(self.app_config.state_db_path, "assessor", dedup_config)) if dedup_config.enabled else None
+        self._saved_llm_calls = 0; self._counter_lock = threading.Lock()
+        # Métricas (/metrics) e saúde do último ciclo (/healthz); o servidor HTTP é iniciado no __main__
+        self.health = CycleHealth(); REGISTRY.add_collector(router_collector(self.llm_service.router))
+        if cache: REGISTRY.add_collector(cache_collector(cache))
+        # Fila write-behind (opcional): atualizações enviadas em massa por tamanho ou tempo
+        write_config = WriteBehindConfig.from_env(); self._confirmations: "queue.Queue" = queue.Queue()
+        self.writer = WriteBehindQueue("Ticket", self.glpi_service.update_tickets, self._on_write_result, write_config) if write_config.enabled else None
+        self._run_lock = threading.Lock()
+        # Fila de trabalho persistente (opcional): o ciclo só enfileira e `start_draining` processa continuamente
+        queue_config = WorkQueueConfig.from_env()
+        self.work_queue = WorkQueue(self.app_config.state_db_path, "assessor", queue_config) if queue_config.enabled else None
+        if self.work_queue: REGISTRY.add_collector(work_queue_collector(self.work_queue))
+        # Modo multi-worker (opcional): leases num armazenamento compartilhado e posse por hashing consistente
+        lease_config = LeaseConfig.from_env()
+        self.leases = LeaseManager(lease_config, "assessor") if lease_config.enabled else None
+        if self.leases: self.leases.start()
+
+    def _is_processed(self, ticket_id: str, content: Optional[str]) -> bool:
+        """Já processado e, quando o conteúdo é conhecido, sem edição desde então."""
+        return self.store.is_processed(ticket_id, content_hash(content) if content is not None else None)
+
+    def _mark_as_processed(self, ticket: Ticket, analysis: LLMAnalysisResult) -> None:
+        """Registra o chamado no histórico com o hash do conteúdo, o modelo e o resultado aplicado."""
+        model = 'pre-classifier' if analysis.source == 'local' else self.llm_service.config.model
+        self.store.mark(ticket.id, content_hash(ticket.content), model, asdict(analysis))
+        if self.leases: self.leases.complete(ticket.id, content_hash(ticket.content))
+        TICKETS_PROCESSED.inc(); self.logger.info(f"Chamado #{ticket.id} marcado como processado.")
+
+    @staticmethod
+    def _classifier_fingerprint(llm_config: LLMConfig) -> str:
+        return prompt_fingerprint(llm_config.model, llm_config.analysis_prompt)
+
+    def train_classifier(self, save: bool) -> Dict[str, Any]:
+        """
+        Monta os exemplos a partir das decisões próprias da LLM no histórico (sem as herdadas do cache
+        ou de duplicados, que repetiriam o mesmo texto entre treino e holdout), avalia um modelo treinado sem o
+        holdout (CLASSIFIER_HOLDOUT) e, com `save`, treina com todos os exemplos e grava em CLASSIFIER_MODEL_PATH.
+        """
+        config = self.classifier_config
+        if save and not config.path: raise ValueError("CLASSIFIER_MODEL_PATH não definido: não há onde gravar o pré-classificador.")
+        history = [(ticket_id, stored_hash, result) for ticket_id, stored_hash, result in self.store.results() if result.get('source', 'llm') == 'llm']
+        examples, stats = collect_examples(history, self.glpi_service.get_tickets_by_ids, lambda content: self.llm_service.preprocessor.process(content).text,
+                                           content_hash, self.glpi_service.config.content_batch_size)
+        self.logger.info(f"Pré-classificador: {len(examples)} exemplo(s) de {stats['history']} decisão(ões) da LLM "
+                         f"({stats['missing']} chamado(s) não encontrado(s), {stats['edited']} editado(s) depois da análise).")
+        if len(examples) < config.min_examples:
+            raise ValueError(f"Exemplos insuficientes para treinar o pré-classificador: {len(examples)} (mínimo CLASSIFIER_MIN_EXAMPLES={config.min_examples}).")
+        fingerprint = self._classifier_fingerprint(self.llm_service.config)
+        train = [e for e in examples if not is_holdout(e[0], config.holdout)]; holdout = [e for e in examples if is_holdout(e[0], config.holdout)]
+        report = dict(evaluate(PreClassifier.train(train, config, fingerprint), holdout), train_examples=len(train), **stats)
+        self.logger.info(f"Avaliação no holdout ({len(holdout)} chamado(s)): acurácia {report['accuracy']}, cobertura {report['coverage']:.1%} "
+                         f"no limiar {config.min_confidence:.2f}, acurácia do aplicado {report['applied_accuracy'] if report['applied_accuracy'] is not None else 'n/d'}.")
+        if save:
+            model = PreClassifier.train(examples, config, fingerprint); model.save(config.path); self.llm_service.classifier = model
+            self.logger.info(f"Pré-classificador treinado com {len(examples)} exemplo(s) e gravado em {config.path}.")
+        return report
+
+    def process_events(self, events: Dict[str, float]) -> None:
+        """
+        Processa na hora os chamados notificados pelo webhook ({id: instante da notificação}),
+        sem esperar o próximo ciclo. Chamados já processados e sem edição são ignorados.
+        Com a fila de trabalho, os chamados apenas entram nela (à frente, pela regra 'event').
+        """
+        if self.work_queue:
+            now, now_monotonic = time.time(), time.monotonic()
+            self.work_queue.enqueue({'ticket_id': ticket_id, 'notified_at': now - (now_monotonic - received)} for ticket_id, received in events.items())
+            return
+        with self._run_lock:
+            started = time.monotonic(); processed_count = 0
+            try:
+                tickets = [t for t in self.glpi_service.get_active_tickets_by_ids(list(events)) or [] if not self._is_processed(t.id, t.content)]
+                if self.leases:
+                    # Eventos valem para qualquer instância (o webhook chega a uma só); o lease evita duplicidade
+                    claimed = self.leases.claim({t.id: content_hash(t.content) for t in tickets}); tickets = [t for t in tickets if t.id in claimed]
+                self.logger.info(f"Webhook: {len(events)} chamado(s) notificado(s), {len(tickets)} ativo(s) a processar.")
+                groups = self._group_pages([tickets] if tickets else [])
+                for ticket, analysis in self._settled(self._process_stream(self._batch_units(groups))):
+                    if analysis is not None: processed_count += 1; EVENT_LATENCY.observe(time.monotonic() - events[ticket.id])
+            finally:
+                self.store.flush()
+                self.logger.info(f"Webhook: {processed_count} chamado(s) atualizado(s) em {time.monotonic() - started:.1f}s.")
 
     def run_assessment_cycle(self):
+        # Ciclos (reconciliação, no modo push) e eventos do webhook não rodam ao mesmo tempo
+        with self._run_lock: self._run_assessment_cycle()
+
+    def _run_assessment_cycle(self):
         self.logger.info("====== INICIANDO CICLO DE ANÁLISE DE CHAMADOS ======")
         if not self.glpi_service.session_token:
-            self.logger.error("Ciclo de análise pulado. Não foi possível estabelecer uma sessão com o GLPI."); return
+            self.logger.error("Ciclo de análise pulado. Não foi possível estabelecer uma sessão com o GLPI.")
+            self.health.record(False, 0.0, "sem sessão GLPI"); return
 
+        self.llm_service.warm_up()
+        cycle_start = time.monotonic(); processed_count = 0; cycle_error: Optional[str] = None
         try:
-            # ! LÓGICA FINAL - Implementa o fluxo com arquivo de texto
-            # 1. Carrega a lista de IDs já processados
-            processed_ids = self._load_processed_ids()
-            self.logger.info(f"Carregados {len(processed_ids)} IDs de chamados já processados.")
-
-            # 2. Busca todos os chamados ativos no GLPI
-            active_tickets = self.glpi_service.get_all_active_tickets()
-
-            # 3. Filtra em memória para encontrar os que precisam de análise
-            tickets_to_process = [ticket for ticket in active_tickets if ticket.id not in processed_ids]
-
-            if not tickets_to_process:
+            # 1. Histórico de processados: consultado por chamado, sem carregar tudo em memória
+            self.store.compact()
+            if self.leases: self.leases.compact()
+            self.logger.info(f"Histórico contém {self.store.count()} chamados já processados.")
+
+            # 2. Busca os chamados ativos no GLPI página a página (janela completa ou incremental),
+            #    já sem os processados. A próxima página é baixada enquanto a atual é analisada.
+            incremental = self.glpi_service.config.fetch_mode == 'incremental'
+            if incremental:
+                pages = self.glpi_service.iter_active_tickets_incremental(self.store.get_meta("watermark"), self._is_processed,
+                                                                          fetch_content=self.work_queue is None,
+                                                                          modified_after_processing=self.store.modified_after)
+            else:
+                pages = self.glpi_service.iter_active_tickets(self._is_processed)
+            if self.work_queue:
+                self._enqueue_pages(pages, incremental); return
+            if self.leases: pages = self._claimed_pages(pages)
+            groups = self._group_pages(prefetch(pages)); self._saved_llm_calls = 0
+
+            # 3. Analisa, atualiza e, se tiver sucesso, marca como processado
+            #    (com GLPI_WRITE_BEHIND_ENABLED, a marcação ocorre quando o lote confirma o item)
+            watermark = WatermarkTracker(); seen = 0
+            for ticket, analysis in self._settled(self._process_stream(self._batch_units(groups))):
+                seen += 1; watermark.observe(ticket, analysis is not None); processed_count += analysis is not None
+
+            BACKLOG.set(seen)
+            if not seen:
                 self.logger.info("Nenhum chamado novo para processar encontrado neste ciclo.")
-                return
-
-            self.logger.info(f"Encontrados {len(tickets_to_process)} chamados para processar.")
-            for ticket in tickets_to_process:
-                self.logger.info(f"Processando chamado #{ticket.id}: '{ticket.title}'")
-                analysis = self.llm_service.analyze_ticket(ticket)
-
-                if analysis:
-                    # 4. Atualiza e, se tiver sucesso, marca como processado
-                    success = self.glpi_service.update_ticket(ticket.id, analysis)
-                    if success:
-                        self._mark_as_processed(ticket.id)
-                else:
-                    self.logger.warning(f"Não foi possível obter a análise da LLM para o chamado #{ticket.id}.")
-
-                time.sleep(5) # Pausa entre as análises
+            else:
+                self.logger.info(f"{processed_count} de {seen} chamados encontrados neste ciclo foram atualizados.")
+            if self.dedup:
+                self.logger.info(f"Agrupamento de quase duplicados economizou {self._saved_llm_calls} chamada(s) à LLM neste ciclo.")
+            if self.llm_service.classifier:
+                self.logger.info(f"Pré-classificador: {CLASSIFIER_DECISIONS.value(result='local'):.0f} chamada(s) à LLM evitada(s) e "
+                                 f"{CLASSIFIER_DECISIONS.value(result='llm'):.0f} enviada(s) ao Ollama desde o início.")
+            if incremental and watermark.value:
+                self.store.set_meta("watermark", watermark.value)
+                self.logger.info(f"Watermark da busca incremental atualizado para {watermark.value}.")
         except Exception as e:
-            self.logger.error(f"Erro crítico durante o ciclo de análise: {e}", exc_info=True)
+            self.logger.error(f"Erro crítico durante o ciclo de análise: {e}", exc_info=True); cycle_error = str(e)
         finally:
+            if self.writer: self.writer.flush()
+            self.store.flush()
+            elapsed = time.monotonic() - cycle_start
+            self.health.record(cycle_error is None, elapsed, cycle_error)
+            rate = processed_count / (elapsed / 60) if elapsed > 0 else 0.0
+            if not self.work_queue: self.logger.info(f"Vazão do ciclo: {processed_count} chamados atualizados em {elapsed:.1f}s ({rate:.2f} chamados/min).")
+            self.llm_service.router.log_state(); log_limits()
+            if self.llm_service.cache: self.llm_service.cache.log_stats()
             self.logger.info("====== CICLO DE ANÁLISE CONCLUÍDO ======")
 
+    def _enqueue_pages(self, pages: Iterable[List[Ticket]], incremental: bool) -> None:
+        """Modo fila: enfileira os pendentes listados; o watermark avança porque a fila já os guarda."""
+        watermark = WatermarkTracker(); enqueued = 0
+        for page in pages:
+            if self.leases: page = [t for t in page if self.leases.owns(t.id)]
+            enqueued += self.work_queue.enqueue({'ticket_id': t.id, 'date_creation': t.date_creation, 'date_mod': t.date_mod,
+                                                 'due_date': t.due_date, 'entity': t.entity} for t in page)
+            for ticket in page: watermark.observe(ticket, True)
+        self.work_queue.compact(self.app_config.processed_retention_days)
+        stats = self.work_queue.stats(); BACKLOG.set(stats["ready"] + stats["waiting"])
+        self.logger.info(f"{enqueued} chamado(s) pendente(s) enfileirado(s). Fila: {stats['ready']} pronto(s), "
+                         f"{stats['waiting']} aguardando nova tentativa, {stats['failed']} desistido(s).")
+        if incremental and watermark.value:
+            self.store.set_meta("watermark", watermark.value)
+            self.logger.info(f"Watermark da busca incremental atualizado para {watermark.value}.")
+
+    def start_draining(self) -> Optional[threading.Thread]:
+        """Inicia a thread que drena a fila de trabalho (sem WORK_QUEUE_ENABLED, não faz nada)."""
+        if not self.work_queue: return None
+        thread = threading.Thread(target=self._drain_forever, name="work-queue", daemon=True); thread.start()
+        self.logger.info(f"Fila de trabalho ativa (ordem: {', '.join(self.work_queue.config.order)}; "
+                         f"até {self.work_queue.config.max_attempts} tentativa(s) por chamado).")
+        return thread
+
+    def _drain_forever(self) -> None:
+        """Drena enquanto houver trabalho; com a fila vazia (ou o GLPI fora), espera com backoff exponencial."""
+        config = self.work_queue.config; idle = config.idle_min_seconds
+        while True:
+            try: worked = self._drain_once()
+            except Exception as e:
+                self.logger.error(f"Erro inesperado ao drenar a fila de trabalho: {e}", exc_info=True); worked = False
+            if worked: idle = config.idle_min_seconds; continue
+            self.work_queue.wait(idle); idle = min(idle * 2, config.idle_max_seconds)
+
+    def _drain_once(self) -> bool:
+        """
+        Processa o próximo lote da fila, na ordem configurada. O conteúdo é buscado de novo no
+        GLPI; chamados que deixaram de estar ativos ou já foram processados saem da fila e as
+        falhas voltam com espera exponencial. Retorna False quando não havia o que fazer.
+        """
+        ticket_ids = self.work_queue.take(max(self.work_queue.config.take_size, self.app_config.max_workers * 2))
+        if not ticket_ids: return False
+        fetched = self.glpi_service.get_active_tickets_by_ids(ticket_ids)
+        if fetched is None:
+            self.logger.warning("Não foi possível buscar os chamados da fila no GLPI; nova tentativa após o intervalo de espera."); return False
+        by_id = {ticket.id: ticket for ticket in fetched}; tickets = []
+        for ticket_id in ticket_ids:
+            ticket = by_id.get(ticket_id)
+            if ticket is None or self._is_processed(ticket.id, ticket.content): self.work_queue.discard(ticket_id)
+            else: tickets.append(ticket)
+        if self.leases:
+            # Chamados com lease de outra instância (ou já concluídos por ela) saem da fila local
+            claimed = self.leases.claim({t.id: content_hash(t.content) for t in tickets})
+            for ticket in tickets:
+                if ticket.id not in claimed: self.work_queue.discard(ticket.id)
+            tickets = [t for t in tickets if t.id in claimed]
+        processed_count = 0
+        try:
+            for ticket, analysis in self._settled(self._process_stream(self._batch_units(self._group_pages([tickets] if tickets else [])))):
+                if analysis is None: self.work_queue.retry(ticket.id, "análise da LLM ou gravação no GLPI falhou"); continue
+                processed_count += 1; notified_at = self.work_queue.complete(ticket.id)
+                if notified_at: EVENT_LATENCY.observe(time.time() - notified_at)
+        finally:
+            self.store.flush()
+        stats = self.work_queue.stats(); BACKLOG.set(stats["ready"] + stats["waiting"])
+        self.logger.info(f"Fila de trabalho: {processed_count} de {len(tickets)} chamado(s) atualizado(s) "
+                         f"({len(ticket_ids) - len(tickets)} fora da fila por não estarem mais pendentes); restam {stats['ready']} pronto(s).")
+        return True
+
+    def _claimed_pages(self, pages: Iterable[List[Ticket]]) -> Iterator[List[Ticket]]:
+        """Modo multi-worker: de cada página, só os chamados desta instância pelo anel e cujo lease ela obteve."""
+        for page in pages:
+            owned = [t for t in page if self.leases.owns(t.id)]
+            claimed = self.leases.claim({t.id: content_hash(t.content) for t in owned})
+            if len(claimed) < len(owned): self.logger.info(f"{len(owned) - len(claimed)} chamado(s) da página em processamento ou já concluído(s) por outra instância.")
+            tickets = [t for t in owned if t.id in claimed]
+            if tickets: yield tickets
+
+    def _group_pages(self, pages: Iterable[List[Ticket]]) -> Iterator[DuplicateGroup]:
+        """Pré-análise: agrupa quase duplicados de cada página (ou gera grupos unitários sem DEDUP_ENABLED)."""
+        for page in pages:
+            if not self.dedup:
+                yield from (DuplicateGroup(representative=ticket, members=[], signature=()) for ticket in page); continue
+            groups = self.dedup.group(page)
+            grouped = sum(len(g.members) for g in groups if g.representative is not None)
+            from_history = sum(1 for g in groups if g.history_result is not None)
+            if grouped or from_history:
+                self.logger.info(f"Página com {len(page)} chamados: {grouped} agrupados como quase duplicados e {from_history} reconhecidos no histórico recente.")
+            yield from groups
+
+    def _batch_units(self, groups: Iterable[DuplicateGroup]) -> Iterator[List[DuplicateGroup]]:
+        """Junta até OLLAMA_BATCH_SIZE grupos que precisam da LLM numa mesma unidade de trabalho."""
+        batch: List[DuplicateGroup] = []; batch_size = self.llm_service.config.batch_size
+        for group in groups:
+            if group.representative is None: yield [group]; continue
+            batch.append(group)
+            if len(batch) >= batch_size: yield batch; batch = []
+        if batch: yield batch
+
+    def _process_unit(self, unit: List[DuplicateGroup]) -> List[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        """Processa uma unidade; com vários representantes, analisa-os num único prompt em lote.
+        Os que faltarem ou vierem inválidos no lote são analisados individualmente."""
+        reps = [group.representative for group in unit if group.representative is not None]
+        precomputed = self.llm_service.analyze_batch(reps) if len(reps) > 1 else {}
+        return [result for group in unit
+                for result in self._process_group(group, precomputed.get(group.representative.id) if group.representative else None)]
+
+    def _process_group(self, group: DuplicateGroup, precomputed: Optional[LLMAnalysisResult] = None) -> List[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        """
+        Analisa o representante do grupo (ou usa o resultado do histórico / do lote) e aplica
+        prioridade, urgência e categoria aos membros, preservando o título de cada um.
+        Retorna a análise aplicada de cada chamado, None onde a atualização não ocorreu ou
+        QUEUED quando ela ficou na fila write-behind.
+        """
+        if group.history_result is not None:
+            analysis = LLMAnalysisResult(**group.history_result); source = f"histórico (#{group.history_source})"
+            results = []
+        else:
+            rep = group.representative
+            self.logger.info(f"Processando chamado #{rep.id}: '{rep.title}'")
+            analysis = precomputed or self.llm_service.analyze_ticket(rep)
+            if not analysis:
+                self.logger.warning(f"Não foi possível obter a análise da LLM para o chamado #{rep.id}.")
+                return [(rep, None)] + [(member, None) for member in group.members]
+            # 4. Atualiza; quem chama marca como processado apenas em caso de sucesso
+            results = [(rep, self._apply(rep, analysis))]
+            if self.dedup and group.signature: self.dedup.history.add(rep.id, group.signature, asdict(analysis))
+            source = f"chamado #{rep.id}"
+        for member in group.members:
+            inherited = replace(analysis, new_title=member.title, source='dedup')
+            self.logger.info(f"Chamado #{member.id} reclassificado com a análise de {source} (quase duplicado).")
+            results.append((member, self._apply(member, inherited)))
+        with self._counter_lock: self._saved_llm_calls += len(group.members)
+        return results
+
+    def _apply(self, ticket: Ticket, analysis: LLMAnalysisResult) -> Any:
+        """Grava a análise no GLPI: direto (análise ou None) ou pela fila write-behind (QUEUED)."""
+        if self.writer:
+            self.writer.submit(dict(GLPIService.ticket_input(analysis), id=int(ticket.id)), (ticket, analysis)); return QUEUED
+        return analysis if self.glpi_service.update_ticket(ticket.id, analysis) else None
+
+    def _on_write_result(self, context: Tuple[Ticket, LLMAnalysisResult], ok: bool) -> None:
+        """Confirmação da fila write-behind: marca o chamado como processado só se o seu item foi aceito."""
+        ticket, analysis = context
+        if ok: self._mark_as_processed(ticket, analysis)
+        self._confirmations.put((ticket, analysis if ok else None))
+
+    def _confirmed(self) -> Iterator[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        while True:
+            try: yield self._confirmations.get_nowait()
+            except queue.Empty: return
+
+    def _settled(self, results: Iterable[Tuple[Ticket, Any]]) -> Iterator[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        """
+        Resultado final de cada chamado (análise aplicada ou None): imediato quando gravado
+        direto (marcado aqui como processado) ou quando a fila write-behind confirma o item.
+        No modo multi-worker, o lease de um chamado que falhou é liberado.
+        """
+        for ticket, analysis in self._final_results(results):
+            if analysis is None and self.leases: self.leases.release([ticket.id])
+            yield ticket, analysis
+
+    def _final_results(self, results: Iterable[Tuple[Ticket, Any]]) -> Iterator[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        for ticket, analysis in results:
+            if analysis is not QUEUED:
+                if analysis is not None: self._mark_as_processed(ticket, analysis)
+                yield ticket, analysis
+            yield from self._confirmed()
+        if self.writer:
+            self.writer.flush(); yield from self._confirmed()
+
+    def _process_stream(self, units: Iterable[List[DuplicateGroup]]) -> Iterator[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+        """
+        Processa as unidades de trabalho à medida que chegam e gera (chamado, análise
+        aplicada ou None) na thread que consome, onde é feita a marcação como processado.
+
+        Com `max_workers` > 1 mantém até N unidades em andamento (o roteador do
+        LLMService as distribui entre as URLs de OLLAMA_API_URLS) e no máximo 2N
+        retidas, para que a memória dependa do tamanho da página e não do backlog.
+        """
+        workers = self.app_config.max_workers
+        if workers <= 1:
+            for unit in units:
+                yield from self._process_unit(unit)
+                # Pausa fixa entre as análises, dispensada quando o limite adaptativo (ADAPTIVE_LIMIT_ENABLED) controla o ritmo
+                if any(group.representative is not None for group in unit) and not self.llm_service.client.limiter.config.enabled: time.sleep(5)
+            return
+
+        self.logger.info(f"Modo concorrente: {workers} workers sobre {len(self.llm_service.config.api_urls)} endpoint(s) Ollama.")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="assessor") as pool:
+            in_flight: Dict[Any, List[DuplicateGroup]] = {}
+
+            def _drain(futures) -> Iterator[Tuple[Ticket, Optional[LLMAnalysisResult]]]:
+                for future in futures:
+                    unit = in_flight.pop(future)
+                    try: yield from future.result()
+                    except Exception as e:
+                        tickets = [t for group in unit for t in ([group.representative] if group.representative else []) + group.members]
+                        self.logger.error(f"Erro inesperado ao processar o(s) chamado(s) {', '.join('#' + t.id for t in tickets)}: {e}", exc_info=True)
+                        yield from ((ticket, None) for ticket in tickets)
+
+            for unit in units:
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    yield from _drain(done)
+                in_flight[pool.submit(self._process_unit, unit)] = unit
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from _drain(done)
+
+
+class WatermarkTracker:
+    """
+    Calcula o próximo watermark da busca incremental a partir dos resultados do ciclo:
+    avança até o maior date_mod visto, mas nunca além de um chamado que falhou
+    (nesse caso para 1s antes dele, para que seja listado de novo no próximo ciclo).
+    """
+    def __init__(self):
+        self.latest: Optional[str] = None; self.earliest_failed: Optional[str] = None
+
+    def observe(self, ticket: Ticket, success: bool) -> None:
+        if not ticket.date_mod: return
+        if self.latest is None or ticket.date_mod > self.latest: self.latest = ticket.date_mod
+        if not success and (self.earliest_failed is None or ticket.date_mod < self.earliest_failed): self.earliest_failed = ticket.date_mod
+
+    @property
+    def value(self) -> Optional[str]:
+        if self.earliest_failed is None: return self.latest
+        earliest = datetime.strptime(self.earliest_failed, "%Y-%m-%d %H:%M:%S")
+        return datetime.fromtimestamp(earliest.timestamp() - 1).strftime("%Y-%m-%d %H:%M:%S")
+
 # =============================================================================
 # APPLICATION ENTRY POINT
 # =============================================================================
 if __name__ == "__main__":
     app = TicketAssessorApp()
-    config = AppConfig.from_env()
+    if "--train-classifier" in sys.argv or "--evaluate-classifier" in sys.argv:
+        try: print(json.dumps(app.train_classifier(save="--train-classifier" in sys.argv), indent=2, ensure_ascii=False))
+        except ValueError as e: logging.critical(e); sys.exit(1)
+        sys.exit(0)
+    config = AppConfig.from_env(); webhook_config = WebhookConfig.from_env()
+    server = create_server(app.health); metrics_config = MetricsConfig.from_env(); interval = config.assessment_interval_minutes
+    if webhook_config.enabled:
+        # Modo push: eventos processados na hora; o ciclo agendado vira reconciliação de eventos perdidos
+        enable_push_mode(server, webhook_config, app.process_events, "assessor")
+        metrics_config = replace(metrics_config, enabled=True); interval = webhook_config.reconcile_minutes
+    start_server(server, metrics_config); app.llm_service.warm_up(); app.start_draining()
     scheduler = BlockingScheduler(timezone="America/Sao_Paulo")
-    scheduler.add_job(app.run_assessment_cycle, 'interval', minutes=config.assessment_interval_minutes, next_run_time=datetime.now())
-    logging.info(f"Serviço de Análise de Chamados iniciado. Ciclos a cada {config.assessment_interval_minutes} minutos.")
+    scheduler.add_job(app.run_assessment_cycle, 'interval', minutes=interval, next_run_time=datetime.now())
+    logging.info(f"Serviço de Análise de Chamados iniciado. Ciclos a cada {interval} minutos.")
     try: scheduler.start()
     except (KeyboardInterrupt, SystemExit): logging.info("Serviço de Análise de Chamados encerrado.")
+    finally:
+        if app.leases: app.leases.stop()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline dos ciclos de app.py e intelligent_agent.py.
+
+Sobe, num processo separado, um emulador da API REST do GLPI (initSession,
+search/Ticket, search/KnowbaseItem, PUT Ticket, TicketFollowup) e um emulador do
+Ollama (/api/generate e /api/chat) com latência log-normal, taxa de erros, JSON
+pronto e, opcionalmente, capacidade limitada (acima dela a latência cresce com a
+carga e, além do dobro, responde 503 como a fila cheia do Ollama) e tempo de
+carga do modelo, pago quando o keep_alive da última requisição expirou.
+Cada cenário (alvo x tamanho do backlog) roda num processo próprio, para que o
+pico de memória (RSS) seja medido isoladamente, e o resultado sai em JSON:
+chamados/min, p50/p99 por etapa e RSS máximo.
+
+Exemplo:
+    python benchmark.py --target assessor,agent --tickets 100,1000,50000 --output bench.json
+    python benchmark.py --tickets 5000 --llm-latency-ms 800 --llm-error-rate 0.02 --env OLLAMA_STREAMING=true
+    python benchmark.py --target assessor --tickets 2000 --workers 16 --llm-capacity 4 --env ADAPTIVE_LIMIT_ENABLED=true
+    python benchmark.py --target assessor --tickets 200 --llm-load-ms 3000 --env OLLAMA_API_MODE=chat --env OLLAMA_WARMUP=false
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+_TITLES = ["Impressora não imprime", "Erro ao acessar o ERP", "VPN desconectando", "Lentidão no servidor de arquivos",
+           "Solicitação de acesso à pasta", "Computador não liga", "E-mail não sincroniza", "Certificado SSL expirado"]
+_WORDS = ("usuário relata falha sistema rede servidor acesso senha impressora setor financeiro lentidão erro tela "
+          "travando reinício atualização permissão pasta arquivo conexão wifi cabo monitor teclado").split()
+
+
+# =============================================================================
+# EMULADORES (GLPI + OLLAMA)
+# =============================================================================
+def synthetic_tickets(active: int, seed: int = 42) -> Dict[int, Dict[str, Any]]:
+    """Backlog sintético: `active` chamados ativos (status 1-4) e ~10% de solucionados/fechados com solução."""
+    rng = random.Random(seed); base = datetime(2026, 1, 1); rows: Dict[int, Dict[str, Any]] = {}
+    solved = max(50, active // 10)
+    for ticket_id in range(1, active + solved + 1):
+        is_solved = ticket_id > active
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 120)))
+        rows[ticket_id] = {"2": ticket_id, "1": f"{rng.choice(_TITLES)} #{ticket_id}",
+                           "24": f"&lt;p&gt;{words} (ref. {ticket_id})&lt;/p&gt;&lt;p&gt;Atenciosamente,&lt;br&gt;Fulano&lt;/p&gt;",
+                           "12": rng.choice([5, 6]) if is_solved else rng.choice([1, 2, 3, 4]),
+                           "15": (base + timedelta(minutes=ticket_id)).strftime("%Y-%m-%d %H:%M:%S"),
+                           "19": (base + timedelta(minutes=ticket_id, seconds=30)).strftime("%Y-%m-%d %H:%M:%S"),
+                           "71": f"Solução aplicada: {' '.join(rng.choice(_WORDS) for _ in range(15))}" if is_solved else None}
+    return rows
+
+
+def _keep_alive_seconds(value: Any) -> float:
+    """keep_alive do Ollama: segundos (negativo = sempre) ou duração ("30s", "35m", "2h"); padrão de 5 minutos."""
+    if value is None or value == "": return 300.0
+    if isinstance(value, (int, float)): return math.inf if value < 0 else float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value).strip())
+    if not match: return 300.0
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return math.inf if seconds < 0 else seconds
+
+
+def _matches(row: Dict[str, Any], criteria: List[Dict]) -> bool:
+    result: Optional[bool] = None
+    for criterion in criteria:
+        if "criteria" in criterion: value = _matches(row, criterion["criteria"])
+        else:
+            field, expected = str(criterion.get("field")), criterion.get("value"); actual = row.get(field)
+            if criterion.get("searchtype") == "equals": value = str(actual) == str(expected)
+            elif criterion.get("searchtype") == "morethan": value = str(actual or "") > str(expected)
+            else: value = True
+        link = criterion.get("link", "AND").upper()
+        result = value if result is None else (result or value) if link == "OR" else (result and value)
+    return True if result is None else result
+
+
+def _id_lookup(criteria: List[Dict]) -> Optional[List[int]]:
+    """Atalho para o critério "ID em (...)" usado na busca de conteúdo em lotes."""
+    if criteria and all("criteria" not in c and str(c.get("field")) == "2" and c.get("searchtype") == "equals" for c in criteria):
+        return [int(c["value"]) for c in criteria]
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_EmulatorServer"
+
+    def log_message(self, *args) -> None: pass
+
+    def _reply(self, code: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8"); self.send_response(code)
+        self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers(); self.wfile.write(data)
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def do_GET(self) -> None:
+        if self.path.endswith("/initSession"): return self._reply(200, {"session_token": "benchmark"})
+        self._reply(404, {})
+
+    def do_PUT(self) -> None: self._dispatch()
+    def do_POST(self) -> None: self._dispatch()
+
+    def _dispatch(self) -> None:
+        body = self._body(); path = self.path.split("?")[0]
+        if path.endswith("/api/generate") or path.endswith("/api/chat"): return self._ollama(body)
+        self.server.glpi_delay()
+        if path.endswith("/initSession"): return self._reply(200, {"session_token": "benchmark"})
+        if "/search/" in path: return self._search(path.rsplit("/", 1)[1], body)
+        inputs = body.get("input"); items = inputs if isinstance(inputs, list) else [inputs]
+        if self.command == "PUT":
+            ticket_id = path.rsplit("/", 1)[1]
+            if isinstance(inputs, list): return self._reply(200, [{str(item.get("id")): True, "message": ""} for item in items])
+            return self._reply(200, [{ticket_id: True, "message": ""}])
+        if path.endswith("/TicketFollowup"):
+            created = [{"id": self.server.next_id(), "message": ""} for _ in items]
+            return self._reply(201, created if isinstance(inputs, list) else created[0])
+        self._reply(404, {})
+
+    def _search(self, itemtype: str, body: Dict[str, Any]) -> None:
+        rows = self.server.kb if itemtype == "KnowbaseItem" else self.server.filtered(body.get("criteria") or [])
+        start, end = (int(x) for x in str(body.get("range", "0-49")).split("-"))
+        page = rows[start:end + 1]; display = [str(f) for f in body.get("forcedisplay") or []]
+        if display: page = [{k: row.get(k) for k in display} for row in page]
+        self._reply(200, {"totalcount": len(rows), "count": len(page), "data": page},
+                    {"Content-Range": f"{start}-{start + max(len(page) - 1, 0)}/{len(rows)}"})
+
+    def _ollama(self, body: Dict[str, Any]) -> None:
+        server = self.server; load_seconds = server.load_model(body.get("keep_alive"))
+        if "format" not in body:  # aquecimento: só carrega o modelo
+            return self._reply(200, {"done": True, "load_duration": int(load_seconds * 1e9), "done_reason": "load"})
+        try:
+            load = server.llm_enter(); delay = server.llm_delay() * load
+            if load > 2: return self._reply(503, {"error": "server busy, please try again. maximum pending requests exceeded"})
+            if server.rng_choice() < server.args.llm_error_rate:
+                time.sleep(delay / 4); return self._reply(500, {"error": "erro simulado"})
+            time.sleep(delay)
+        finally:
+            server.llm_exit()
+        self._ollama_reply(body, delay, load_seconds)
+
+    def _ollama_reply(self, body: Dict[str, Any], delay: float, load_seconds: float) -> None:
+        chat = "messages" in body
+        prompt = "\n\n".join(m.get("content", "") for m in body["messages"]) if chat else body.get("prompt") or ""
+        ids = re.findall(r"ticket_id=(\d+)", prompt) if "MODO LOTE" in prompt else []
+        item = {"new_title": "Título revisado", "priority": 3, "urgency": 3, "new_category_id": 0,
+                "sintese_problema": "Problema simulado.", "hipotese_causa_raiz": "Causa simulada.",
+                "plano_de_acao": ["Verificar", "Reiniciar"], "solucao_recomendada": {"descricao_passos": "Passos.", "fonte_chamado": "N/A"}}
+        response = json.dumps({"resultados": [dict(item, ticket_id=i) for i in ids]} if ids else item)
+        eval_count = max(1, len(response) // 4)
+        stats = {"eval_count": eval_count, "eval_duration": int(delay * 1e9), "prompt_eval_count": len(prompt) // 4, "load_duration": int(load_seconds * 1e9)}
+        text = lambda piece: {"message": {"role": "assistant", "content": piece}} if chat else {"response": piece}
+        if not body.get("stream"): return self._reply(200, dict(stats, done=True, **text(response)))
+        self.send_response(200); self.send_header("Content-Type", "application/x-ndjson"); self.send_header("Connection", "close"); self.end_headers()
+        try:
+            for i in range(0, len(response), 16):
+                self.wfile.write((json.dumps(dict(text(response[i:i + 16]), done=False)) + "\n").encode("utf-8"))
+            self.wfile.write((json.dumps(dict(stats, done=True, **text(""))) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+class _EmulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, args: argparse.Namespace, tickets: int):
+        super().__init__(address, _Handler)
+        self.args = args; self.rows = synthetic_tickets(tickets, args.seed); self._rng = random.Random(args.seed); self._lock = threading.Lock()
+        self.kb = [{"2": i, "1": f"Artigo {i}: {_TITLES[i % len(_TITLES)]}", "7": f"Procedimento {i}", "19": "2026-01-01 00:00:00"}
+                   for i in range(1, max(20, tickets // 50) + 1)]
+        self._cache: Dict[str, List[Dict[str, Any]]] = {}; self._ids = 0; self._llm_in_flight = 0
+        self._load_lock = threading.Lock(); self._loaded_until = 0.0
+
+    def load_model(self, keep_alive: Any) -> float:
+        """Emula a carga do modelo (--llm-load-ms) se o keep_alive anterior expirou; devolve o tempo de carga."""
+        with self._load_lock:
+            load = 0.0
+            if self.args.llm_load_ms > 0 and time.monotonic() >= self._loaded_until:
+                load = self.args.llm_load_ms / 1000; time.sleep(load)
+            self._loaded_until = time.monotonic() + _keep_alive_seconds(keep_alive)
+            return load
+
+    def llm_enter(self) -> float:
+        """Registra uma geração; devolve o fator de carga (em andamento / capacidade, mínimo 1; 1 sem --llm-capacity)."""
+        with self._lock:
+            self._llm_in_flight += 1
+            return max(1.0, self._llm_in_flight / self.args.llm_capacity) if self.args.llm_capacity > 0 else 1.0
+
+    def llm_exit(self) -> None:
+        with self._lock: self._llm_in_flight -= 1
+
+    def filtered(self, criteria: List[Dict]) -> List[Dict[str, Any]]:
+        ids = _id_lookup(criteria)
+        if ids is not None: return [self.rows[i] for i in ids if i in self.rows]
+        key = json.dumps(criteria, sort_keys=True)
+        with self._lock:
+            if key not in self._cache: self._cache[key] = [row for row in self.rows.values() if _matches(row, criteria)]
+            return self._cache[key]
+
+    def next_id(self) -> int:
+        with self._lock: self._ids += 1; return self._ids
+
+    def rng_choice(self) -> float:
+        with self._lock: return self._rng.random()
+
+    def llm_delay(self) -> float:
+        with self._lock: return self._rng.lognormvariate(math.log(max(self.args.llm_latency_ms, 0.1) / 1000), self.args.llm_latency_sigma)
+
+    def glpi_delay(self) -> None:
+        if self.args.glpi_latency_ms > 0: time.sleep(self.args.glpi_latency_ms / 1000)
+
+
+def _serve(args: argparse.Namespace, tickets: int, ready) -> None:
+    server = _EmulatorServer(("127.0.0.1", 0), args, tickets); ready.put(server.server_address[1]); server.serve_forever()
+
+
+# =============================================================================
+# CENÁRIOS
+# =============================================================================
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples: return None
+    ordered = sorted(samples); return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _scenario_env(args: argparse.Namespace, url: str, workdir: str) -> Dict[str, str]:
+    env = {"GLPI_URL": url, "GLPI_APP_TOKEN": "benchmark", "GLPI_USER_TOKEN": "benchmark", "LOG_LEVEL": args.log_level,
+           "OLLAMA_API_URLS": url, "OLLAMA_API_URL": url, "OLLAMA_MODEL": "benchmark",
+           "OLLAMA_ANALYSIS_PROMPT": "Classifique o chamado em JSON.", "OLLAMA_PROMPT_BASE_N1": "Gere o roteiro em JSON.",
+           "GLPI_SESSION_CACHE_PATH": os.path.join(workdir, "session.json"), "STATE_DB_PATH": os.path.join(workdir, "state.db"),
+           "LLM_CACHE_PATH": "", "RETRIEVAL_INDEX_PATH": os.path.join(workdir, "retrieval.db"), "METRICS_ENABLED": "false",
+           # Caminhos dentro do diretório do cenário: nada do host (watermark, históricos antigos em /tmp) entra no ciclo
+           "GLPI_WATERMARK_PATH": os.path.join(workdir, "watermark.txt"), "PROCESSED_LEGACY_PATH": os.path.join(workdir, "processed_ids.txt"),
+           "AGENT_PROCESSED_LEGACY_PATH": os.path.join(workdir, "agent_processed_ids.txt"), "LEASE_DB_PATH": os.path.join(workdir, "leases.db"),
+           "CLASSIFIER_MODEL_PATH": "",
+           "ASSESSMENT_MAX_WORKERS": str(args.workers), "AGENT_PIPELINE_ENABLED": "true", "AGENT_LLM_WORKERS": str(args.workers)}
+    env.update(dict(item.split("=", 1) for item in args.env))
+    return env
+
+
+def _run_scenario(target: str, tickets: int, url: str, args: argparse.Namespace, results) -> None:
+    """Executado num processo próprio: um ciclo completo do alvo contra os emuladores."""
+    with tempfile.TemporaryDirectory(prefix="glpi-bench-") as workdir:
+        os.environ.update(_scenario_env(args, url, workdir)); os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import adaptive_limit, metrics
+        samples: Dict[str, List[float]] = {}; observe = metrics.STAGE_SECONDS.observe
+
+        def _observe(value: float, **labels) -> None:
+            samples.setdefault(labels.get("stage", ""), []).append(value); observe(value, **labels)
+        metrics.STAGE_SECONDS.observe = _observe
+
+        if target == "assessor":
+            import app; service = app.TicketAssessorApp(); run = service.run_assessment_cycle
+        else:
+            import intelligent_agent; service = intelligent_agent.TicketAgentApp(); run = service.run_agent_cycle
+        started = time.monotonic(); run(); elapsed = time.monotonic() - started
+        processed = metrics.TICKETS_PROCESSED.value()
+        results.put({"target": target, "tickets": tickets, "processed": int(processed), "cycle_seconds": round(elapsed, 3),
+                     "tickets_per_min": round(processed / (elapsed / 60), 2) if elapsed > 0 else None,
+                     "cycle_success": bool(metrics.LAST_CYCLE_SUCCESS.value()),
+                     "stages": {stage: {"count": len(values), "p50": _percentile(values, 0.5), "p99": _percentile(values, 0.99)}
+                                for stage, values in sorted(samples.items())},
+                     "adaptive_limits": adaptive_limit.snapshots(),
+                     "ollama_start": [{k: ep[k] for k in ("url", "cold_starts", "p50_cold_latency", "p50_warm_latency")}
+                                      for ep in service.llm_service.router.snapshot()],
+                     "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+
+
+def run_benchmark(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    ctx = multiprocessing.get_context("spawn"); report = []
+    for tickets in args.tickets:
+        ready = ctx.Queue(); emulator = ctx.Process(target=_serve, args=(args, tickets, ready), daemon=True); emulator.start()
+        url = f"http://127.0.0.1:{ready.get(timeout=120)}"
+        try:
+            for target in args.target:
+                results = ctx.Queue(); worker = ctx.Process(target=_run_scenario, args=(target, tickets, url, args, results)); worker.start()
+                try: result = results.get(timeout=args.timeout)
+                except Exception: result = {"target": target, "tickets": tickets, "error": f"sem resultado em {args.timeout}s"}
+                worker.join(timeout=10)
+                if worker.is_alive(): worker.terminate()
+                report.append(result)
+                print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        finally:
+            emulator.terminate(); emulator.join()
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark offline dos ciclos com emuladores de GLPI e Ollama.")
+    as_list = lambda cast: (lambda value: [cast(v.strip()) for v in value.split(",") if v.strip()])
+    parser.add_argument("--target", type=as_list(str), default=["assessor", "agent"], help="assessor, agent ou ambos (separados por vírgula)")
+    parser.add_argument("--tickets", type=as_list(int), default=[100, 1000], help="tamanhos de backlog, ex.: 100,1000,50000")
+    parser.add_argument("--workers", type=int, default=8, help="ASSESSMENT_MAX_WORKERS / AGENT_LLM_WORKERS")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="mediana da latência do Ollama emulado")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.5, help="dispersão (sigma) da latência log-normal")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fração de respostas HTTP 500 do Ollama emulado")
+    parser.add_argument("--llm-capacity", type=int, default=0, help="gerações simultâneas do Ollama emulado antes de degradar (0 = ilimitado)")
+    parser.add_argument("--llm-load-ms", type=float, default=0.0, help="tempo de carga do modelo no Ollama emulado após expirar o keep_alive (0 = sempre carregado)")
+    parser.add_argument("--glpi-latency-ms", type=float, default=5.0, help="latência fixa por requisição ao GLPI emulado")
+    parser.add_argument("--env", action="append", default=[], help="variável extra para o cenário (CHAVE=VALOR), repetível")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=3600.0, help="tempo máximo por cenário, em segundos")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    scenarios = run_benchmark(arguments)
+    document = json.dumps({"generated_at": datetime.now().isoformat(timespec="seconds"),
+                           "parameters": {k: v for k, v in vars(arguments).items() if k != "output"}, "results": scenarios},
+                          indent=2, ensure_ascii=False)
+    if arguments.output:
+        with open(arguments.output, "w") as f: f.write(document + "\n")
+    else:
+        print(document)
@@ -0,0 +1,212 @@
+"""
+Agrupamento de chamados quase duplicados (MinHash + LSH).
+
+Chamados que diferem apenas em hostnames, horários, números ou assinatura
+("impressora 3º andar não imprime") recebem a mesma impressão digital. Apenas
+um representante por grupo vai para a LLM; a classificação dele é aplicada aos
+demais. Representantes analisados ficam num histórico recente persistido em
+SQLite, para que duplicados de ciclos seguintes também sejam aproveitados.
+"""
+import hashlib
+import html
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Trechos variáveis substituídos por marcadores antes da comparação
+_VARIABLE_PATTERNS = [
+    (re.compile(r"<[^>]+>"), " "),
+    (re.compile(r"&[a-z#0-9]+;"), " "),
+    (re.compile(r"\S+@\S+"), " <email> "),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b"), " <ip> "),
+    (re.compile(r"\b\d{1,4}[/-]\d{1,2}[/-]\d{1,4}\b"), " <data> "),
+    (re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?\b"), " <hora> "),
+    (re.compile(r"\b(?=\w*\d)[\w.-]+\b"), " <id> "),  # hostnames, patrimônios, números
+]
+# Assinatura: linha curta que começa com uma despedida, entre as últimas linhas do conteúdo (nunca a primeira)
+_SIGNATURE = re.compile(r"^\s*(atenciosamente|att\.?|grato|obrigad[oa]|enviado do meu)\b", re.IGNORECASE)
+_SIGNATURE_LINES = 6; _SIGNATURE_MAX_CHARS = 40
+_LINE_BREAK = re.compile(r"<br\s*/?>|</(?:p|div|li|tr)>", re.IGNORECASE); _TAG = re.compile(r"<[^>]+>")
+_WORD = re.compile(r"<\w+>|\w+")
+
+
+@dataclass
+class DedupConfig:
+    enabled: bool; similarity_threshold: float; num_perm: int; history_hours: float; history_max_entries: int
+    @classmethod
+    def from_env(cls) -> 'DedupConfig':
+        return cls(enabled=os.getenv('DEDUP_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   similarity_threshold=float(os.getenv('DEDUP_SIMILARITY_THRESHOLD', '0.85')),
+                   num_perm=int(os.getenv('DEDUP_NUM_PERM', '64')),
+                   history_hours=float(os.getenv('DEDUP_HISTORY_HOURS', '24')),
+                   history_max_entries=int(os.getenv('DEDUP_HISTORY_MAX_ENTRIES', '20000')))
+
+
+def strip_signature(content: str) -> str:
+    """Remove o bloco de assinatura ("Atenciosamente,\nFulano") do fim do conteúdo, sem tocar no corpo."""
+    text = _TAG.sub(" ", _LINE_BREAK.sub("\n", html.unescape(content)))
+    lines = [line for line in text.split("\n") if line.strip()]
+    for i in range(max(1, len(lines) - _SIGNATURE_LINES), len(lines)):
+        if len(lines[i].strip()) <= _SIGNATURE_MAX_CHARS and _SIGNATURE.match(lines[i]): return "\n".join(lines[:i])
+    return "\n".join(lines)
+
+
+def normalize_for_fingerprint(title: Optional[str], content: Optional[str]) -> str:
+    text = f"{title or ''}\n{strip_signature(content or '')}".lower()
+    for pattern, replacement in _VARIABLE_PATTERNS: text = pattern.sub(replacement, text)
+    return " ".join(text.split())
+
+
+def shingles(text: str, size: int = 2) -> Set[str]:
+    """Palavras isoladas + n-gramas de `size` palavras (textos curtos ainda geram conjunto útil)."""
+    words = _WORD.findall(text)
+    result = set(words)
+    result.update(" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+    return result
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)  # semente fixa: assinaturas persistidas continuam comparáveis entre execuções
+        self.perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+
+    def signature(self, items: Iterable[str]) -> Tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in items] or [0]
+        return tuple(min(((a * h + b) % _MERSENNE) & _MAX_HASH for h in hashes) for a, b in self.perms)
+
+
+def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """Estimativa de Jaccard: fração de posições iguais nas assinaturas."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class LSHIndex:
+    """Índice por bandas: só compara assinaturas que colidem em pelo menos uma banda."""
+    def __init__(self, num_perm: int, rows_per_band: int = 4):
+        self.rows = rows_per_band; self.bands = max(1, num_perm // rows_per_band)
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+
+    def _band_keys(self, sig: Tuple[int, ...]):
+        return [(b, sig[b * self.rows:(b + 1) * self.rows]) for b in range(self.bands)]
+
+    def add(self, key: str, sig: Tuple[int, ...]) -> None:
+        if key in self.signatures: self.remove(key)
+        self.signatures[key] = sig
+        for band_key in self._band_keys(sig): self.buckets.setdefault(band_key, []).append(key)
+
+    def remove(self, key: str) -> None:
+        sig = self.signatures.pop(key, None)
+        if sig is None: return
+        for band_key in self._band_keys(sig):
+            bucket = self.buckets.get(band_key)
+            if bucket and key in bucket:
+                bucket.remove(key)
+                if not bucket: del self.buckets[band_key]
+
+    def best_match(self, sig: Tuple[int, ...], threshold: float) -> Optional[Tuple[str, float]]:
+        candidates = {key for band_key in self._band_keys(sig) for key in self.buckets.get(band_key, ())}
+        best = None
+        for key in candidates:
+            score = similarity(sig, self.signatures[key])
+            if score >= threshold and (best is None or score > best[1]): best = (key, score)
+        return best
+
+
+class SimilarityHistory:
+    """
+    Representantes analisados recentemente (assinatura + resultado), mantidos num
+    índice LSH em memória e persistidos na tabela `dedup_history` do banco de estado.
+    """
+    def __init__(self, path: str, namespace: str, config: DedupConfig):
+        self.config = config; self.namespace = namespace; self.logger = logging.getLogger(__name__)
+        self.index = LSHIndex(config.num_perm); self.results: Dict[str, Dict[str, Any]] = {}; self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS dedup_history (
+            namespace TEXT NOT NULL, ticket_id TEXT NOT NULL, signature BLOB NOT NULL, result TEXT NOT NULL,
+            created_at REAL NOT NULL, PRIMARY KEY (namespace, ticket_id)) WITHOUT ROWID""")
+        self._load()
+
+    def _cutoff(self) -> float:
+        return time.time() - self.config.history_hours * 3600
+
+    def _load(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM dedup_history WHERE namespace = ? AND created_at < ?", (self.namespace, self._cutoff()))
+        rows = self._conn.execute("SELECT ticket_id, signature, result FROM dedup_history WHERE namespace = ? ORDER BY created_at DESC LIMIT ?",
+                                  (self.namespace, self.config.history_max_entries)).fetchall()
+        # Os mais recentes são selecionados, mas inseridos do mais antigo ao mais novo: `add` descarta o primeiro da ordem de inserção
+        for ticket_id, blob, result in reversed(rows):
+            sig = tuple(array("I", blob))
+            if len(sig) != self.config.num_perm: continue  # DEDUP_NUM_PERM mudou
+            self.index.add(ticket_id, sig); self.results[ticket_id] = json.loads(result)
+        if rows: self.logger.info(f"Histórico de similaridade carregado com {len(self.results)} representantes recentes.")
+
+    def match(self, sig: Tuple[int, ...]) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        with self._lock:
+            found = self.index.best_match(sig, self.config.similarity_threshold)
+            return (found[0], found[1], self.results[found[0]]) if found else None
+
+    def add(self, ticket_id: str, sig: Tuple[int, ...], result: Dict[str, Any]) -> None:
+        with self._lock:
+            self.index.add(ticket_id, sig); self.results[ticket_id] = result
+            if len(self.results) > self.config.history_max_entries:
+                oldest = next(iter(self.results)); self.index.remove(oldest); del self.results[oldest]
+            try:
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO dedup_history VALUES (?, ?, ?, ?, ?)",
+                                       (self.namespace, ticket_id, array("I", sig).tobytes(), json.dumps(result, ensure_ascii=False), time.time()))
+            except sqlite3.Error as e:
+                self.logger.warning(f"Falha ao gravar o histórico de similaridade: {e}")
+
+
+@dataclass
+class DuplicateGroup:
+    """Representante que vai para a LLM e os membros que herdam sua classificação.
+    Quando `history_result` está definido, o grupo já tem resultado e não há representante."""
+    representative: Any
+    members: List[Any]
+    signature: Tuple[int, ...]
+    history_result: Optional[Dict[str, Any]] = None
+    history_source: Optional[str] = None
+
+
+class NearDuplicateGrouper:
+    def __init__(self, config: DedupConfig, history: Optional[SimilarityHistory] = None):
+        self.config = config; self.history = history; self.hasher = MinHasher(config.num_perm)
+
+    def signature_of(self, title: Optional[str], content: Optional[str]) -> Tuple[int, ...]:
+        return self.hasher.signature(shingles(normalize_for_fingerprint(title, content)))
+
+    def group(self, tickets: List[Any]) -> List[DuplicateGroup]:
+        """
+        Agrupa os chamados de uma página. Quem casa com o histórico recebe o resultado
+        já conhecido; os demais são agrupados entre si em torno do primeiro de cada grupo.
+        """
+        groups: List[DuplicateGroup] = []; page_index = LSHIndex(self.config.num_perm)
+        for ticket in tickets:
+            sig = self.signature_of(ticket.title, ticket.content)
+            known = self.history.match(sig) if self.history else None
+            if known:
+                groups.append(DuplicateGroup(representative=None, members=[ticket], signature=sig, history_result=known[2], history_source=known[0]))
+                continue
+            found = page_index.best_match(sig, self.config.similarity_threshold)
+            if found:
+                groups[int(found[0])].members.append(ticket)
+            else:
+                page_index.add(str(len(groups)), sig)
+                groups.append(DuplicateGroup(representative=ticket, members=[], signature=sig))
+        return groups
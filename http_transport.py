@@ -0,0 +1,104 @@
+"""
+Camada de transporte HTTP compartilhada.
+
+Mantém sessões `requests` com pool de conexões keep-alive (uma para o GLPI e
+outra para o Ollama) e guarda em disco o session_token do GLPI, para que ele
+seja reaproveitado entre reinicializações enquanto não expirar.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+@dataclass
+class TransportConfig:
+    glpi_pool_size: int; ollama_pool_size: int; connect_timeout: float; glpi_read_timeout: float
+    session_cache_path: str; session_ttl_seconds: int
+    @classmethod
+    def from_env(cls) -> 'TransportConfig':
+        return cls(glpi_pool_size=int(os.getenv('GLPI_POOL_SIZE', '10')), ollama_pool_size=int(os.getenv('OLLAMA_POOL_SIZE', '10')),
+                   connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')), glpi_read_timeout=float(os.getenv('GLPI_READ_TIMEOUT', '20')),
+                   session_cache_path=os.path.expanduser(os.getenv('GLPI_SESSION_CACHE_PATH', '~/.cache/glpi_reclassificacao/session.json')),
+                   session_ttl_seconds=int(os.getenv('GLPI_SESSION_TTL_SECONDS', '1440')))
+
+    def glpi_timeout(self, read_timeout: Optional[float] = None) -> Tuple[float, float]:
+        return (self.connect_timeout, read_timeout if read_timeout is not None else self.glpi_read_timeout)
+
+    def ollama_timeout(self, read_timeout: float) -> Tuple[float, float]:
+        return (self.connect_timeout, read_timeout)
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """Cria uma sessão com pool de conexões persistentes (sem retries automáticos)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    return session
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def get_session(name: str, pool_size: int) -> requests.Session:
+    """Retorna a sessão compartilhada `name` ('glpi', 'ollama'), criando-a na primeira chamada."""
+    with _sessions_lock:
+        if name not in _sessions: _sessions[name] = build_session(pool_size)
+        return _sessions[name]
+
+
+class SessionTokenCache:
+    """
+    Cache em disco do session_token do GLPI. O GLPI expira sessões por inatividade,
+    então a validade é contada a partir do último uso (gravado no máximo a cada
+    `touch_interval` segundos para não escrever no disco a cada requisição).
+    """
+    def __init__(self, path: str, ttl_seconds: int, glpi_url: str, user_token: str, touch_interval: int = 60):
+        self.path = path; self.ttl_seconds = ttl_seconds; self.touch_interval = touch_interval
+        self.key = hashlib.sha256(f"{glpi_url}|{user_token}".encode()).hexdigest()
+        self._last_touch = 0.0; self._lock = threading.Lock(); self.logger = logging.getLogger(__name__)
+
+    def load(self) -> Optional[str]:
+        try:
+            with open(self.path, 'r') as f: data = json.load(f)
+        except (IOError, ValueError): return None
+        if data.get("key") != self.key or time.time() - data.get("last_used", 0) >= self.ttl_seconds: return None
+        self._last_touch = data.get("last_used", 0)
+        return data.get("session_token")
+
+    def save(self, session_token: str) -> None:
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as f: json.dump({"key": self.key, "session_token": session_token, "last_used": time.time()}, f)
+                os.replace(tmp_path, self.path); self._last_touch = time.time()
+            except OSError as e:
+                self.logger.warning(f"Não foi possível gravar o cache da sessão GLPI em {self.path}: {e}")
+
+    def touch(self, session_token: str) -> None:
+        if time.time() - self._last_touch >= self.touch_interval: self.save(session_token)
+
+    def clear(self) -> None:
+        with self._lock:
+            try: os.remove(self.path)
+            except FileNotFoundError: pass
+            except OSError as e: self.logger.warning(f"Não foi possível remover o cache da sessão GLPI: {e}")
+
+
+class GLPISession:
+    """
+    Estado de sessão do GLPI compartilhável entre serviços (ex.: reclassificação e agente no
+    daemon combinado): o session_token atual, o cache em disco e a trava que serializa as
+    reinicializações. Quem compartilha a instância vê sempre o mesmo token, inclusive após um 401.
+    """
+    def __init__(self, token_cache: SessionTokenCache):
+        self.token: Optional[str] = None; self.token_cache = token_cache; self.lock = threading.Lock()
@@ -5,18 +5,36 @@ GLPI Intelligent Agent v7.2 - Formatação Robusta e Prompt com Exemplo
 Versão final que refina o prompt com um exemplo explícito e torna o código
 de renderização de HTML mais robusto a variações na resposta da IA.
 """
+import hashlib
 import os
+import sys
 import logging
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, replace
 import requests
 from dotenv import load_dotenv
 from apscheduler.schedulers.blocking import BlockingScheduler
 
+from adaptive_limit import get_limiter, log_state as log_limits
+from http_transport import GLPISession, TransportConfig, SessionTokenCache, get_session
+from llm_cache import CacheConfig, LLMResultCache
+from metrics import (BACKLOG, EVENT_LATENCY, REGISTRY, SESSION_REINITS, STAGE_ERRORS, STAGE_SECONDS, TICKETS_PROCESSED, CycleHealth,
+                     MetricsConfig, cache_collector, create_server, router_collector, start_server)
+from ollama_client import OllamaClient
+from ollama_router import EndpointRouter
+from preprocessing import PreprocessConfig, TicketPreprocessor
+from processed_store import ProcessedStore, content_hash
+from retrieval_index import RetrievalConfig, RetrievalIndex
+from streaming import Stage, pipeline, prefetch
+from webhook import WebhookConfig, enable_push_mode
+from write_behind import WriteBehindConfig, WriteBehindQueue
+
 load_dotenv()
 
 # =============================================================================
@@ -53,49 +71,111 @@ def setup_logging(log_level: str = 'INFO') -> None:
 # SERVIÇO DO GLPI
 # =============================================================================
 class GLPIService:
-    def __init__(self, config: GLPIConfig):
-        self.config = config; self.session_token: Optional[str] = None; self.logger = logging.getLogger(__name__)
+    def __init__(self, config: GLPIConfig, transport: Optional[TransportConfig] = None, session: Optional[GLPISession] = None):
+        self.config = config; self.logger = logging.getLogger(__name__)
         requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-        self.init_session()
-
-    def init_session(self) -> bool:
+        self.transport = transport or TransportConfig.from_env()
+        self.http = get_session("glpi", self.transport.glpi_pool_size); self.limiter = get_limiter("glpi")
+        # Sessão própria ou a do app.py no daemon combinado (mesmo token, cache e trava de reinicialização)
+        self.session = session or GLPISession(SessionTokenCache(self.transport.session_cache_path, self.transport.session_ttl_seconds,
+                                                                config.url, config.user_token))
+        if not self.session.token: self.init_session()
+
+    @property
+    def session_token(self) -> Optional[str]: return self.session.token
+    @session_token.setter
+    def session_token(self, value: Optional[str]) -> None: self.session.token = value
+    @property
+    def token_cache(self) -> SessionTokenCache: return self.session.token_cache
+
+    def init_session(self, force: bool = False) -> bool:
+        if not force:
+            cached_token = self.token_cache.load()
+            if cached_token: self.session_token = cached_token; self.logger.info("Sessão GLPI reaproveitada do cache local."); return True
         try:
             headers = {"App-Token": self.config.app_token, "Content-Type": "application/json"}
             payload = {"user_token": self.config.user_token}
-            response = requests.post(f"{self.config.url}/initSession", headers=headers, json=payload, verify=False, timeout=10)
+            response = self.http.post(f"{self.config.url}/initSession", headers=headers, json=payload, verify=False, timeout=self.transport.glpi_timeout(10))
             response.raise_for_status()
             self.session_token = response.json().get("session_token")
-            if self.session_token: self.logger.info("Sessão GLPI inicializada com sucesso."); return True
+            if self.session_token: self.token_cache.save(self.session_token); self.logger.info("Sessão GLPI inicializada com sucesso."); return True
             self.logger.error(f"Falha ao obter session_token do GLPI. Resposta: {response.text}"); return False
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Erro de conexão ao inicializar sessão: {e}"); self.session_token = None; return False
 
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
+        response = self._send(method, endpoint, **kwargs)
+        if response is None: return None
+        try: return response.json() if response.text else {}
+        except ValueError as e: self.logger.error(f"Resposta inválida da API para {method} {endpoint}: {e}"); return None
+
+    def _send(self, method: str, endpoint: str, **kwargs) -> Optional[requests.Response]:
         if not self.session_token and not self.init_session(): return None
         headers = {"App-Token": self.config.app_token, "Session-Token": self.session_token, "Content-Type": "application/json"}
+        timeout = self.transport.glpi_timeout()
         try:
-            response = requests.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=20, **kwargs)
-            if response.status_code == 401:
-                self.logger.warning("Sessão GLPI expirada. Reinicializando...");
-                if self.init_session():
-                    headers["Session-Token"] = self.session_token
-                    response = requests.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=20, **kwargs)
-            response.raise_for_status()
-            return response.json() if response.text else {}
+            with self.limiter.request(f"{method} {endpoint.split('/')[0]}"):  # 429/5xx, timeouts e picos de latência reduzem o limite adaptativo
+                response = self.http.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=timeout, **kwargs)
+                if response.status_code == 401:
+                    # Só o primeiro worker que recebe o 401 reinicializa; os demais reusam o token novo
+                    expired_token = headers["Session-Token"]
+                    with self.session.lock:
+                        if self.session_token == expired_token:
+                            self.logger.warning("Sessão GLPI expirada. Reinicializando...")
+                            self.token_cache.clear(); SESSION_REINITS.inc(); self.init_session(force=True)
+                    if self.session_token and self.session_token != expired_token:
+                        headers["Session-Token"] = self.session_token
+                        response = self.http.request(method, f"{self.config.url}/{endpoint}", headers=headers, verify=False, timeout=timeout, **kwargs)
+                response.raise_for_status()
+            self.token_cache.touch(headers["Session-Token"])
+            return response
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Erro na requisição API para {method} {endpoint}: {e}"); return None
 
+    def iter_search(self, itemtype: str, payload: Dict, page_size: int = 500) -> Iterator[List[Dict]]:
+        """Gera as páginas de search/<itemtype> seguindo o Content-Range/totalcount do GLPI."""
+        start = 0
+        while True:
+            with STAGE_SECONDS.time(stage="fetch"): response = self._send("POST", f"search/{itemtype}", json=dict(payload, range=f"{start}-{start + page_size - 1}"))
+            if response is None:
+                self.logger.warning(f"Busca em search/{itemtype} interrompida na linha {start}; o restante fica para o próximo ciclo."); return
+            try: body = response.json() if response.text else {}
+            except ValueError as e: self.logger.error(f"Resposta inválida de search/{itemtype}: {e}"); return
+            page = (body.get('data') or []) if isinstance(body, dict) else (body if isinstance(body, list) else [])
+            content_range = response.headers.get("Content-Range", ""); total = None
+            if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit(): total = int(content_range.rsplit("/", 1)[1])
+            elif isinstance(body, dict) and body.get('totalcount') is not None: total = int(body['totalcount'])
+            if page: yield page
+            start += page_size
+            if not page or len(page) < page_size or (total is not None and start >= total): return
+
+    def iter_active_tickets_from_api(self, active_status_ids: List[int], page_size: int = 500) -> Iterator[List[Dict]]:
+        """Gera, página a página, os chamados com status ativos (mais recentes primeiro)."""
+        self.logger.info("Buscando chamados ativos página a página...")
+        criteria = [{'link': 'OR', 'field': 12, 'searchtype': 'equals', 'value': sid} for sid in active_status_ids]
+        payload = {"is_deleted": 0, "criteria": criteria, "forcedisplay": [2, 1, 24, 12], "sort": 15, "order": "DESC"}
+        listed = 0
+        for page in self.iter_search("Ticket", payload, page_size):
+            listed += len(page)
+            active = [item for item in page if item.get('12') in active_status_ids]
+            if active: yield active
+        self.logger.info(f"Busca concluída: {listed} chamados ativos listados pela API.")
+
     def get_all_active_tickets_from_api(self, active_status_ids: List[int]) -> List[Dict]:
-        self.logger.info("Buscando chamados mais recentes para filtragem (Estratégia Validada)...")
-        payload = {"is_deleted": 0, "forcedisplay": [2, 1, 24, 12], "range": "0-1000", "sort": 15, "order": "DESC"}
-        response_data = self._make_request("POST", "search/Ticket", json=payload)
-        full_ticket_list = []
-        if isinstance(response_data, dict) and 'data' in response_data: full_ticket_list = response_data['data']
-        elif isinstance(response_data, list): full_ticket_list = response_data
-        if not full_ticket_list: self.logger.info("Nenhum chamado foi retornado pela API."); return []
-        self.logger.info(f"API retornou {len(full_ticket_list)} chamados. Filtrando localmente por status...")
-        active_tickets_data = [item for item in full_ticket_list if item.get('12') in active_status_ids]
-        self.logger.info(f"Encontrados {len(active_tickets_data)} chamados com status ativos."); return active_tickets_data
+        return [item for page in self.iter_active_tickets_from_api(active_status_ids) for item in page]
+
+    def get_active_tickets_by_ids(self, ticket_ids: List[str], active_status_ids: List[int], batch_size: int = 50) -> List[Dict]:
+        """Busca pelo ID os chamados notificados pelo webhook que ainda estão ativos."""
+        tickets: List[Dict] = []
+        for i in range(0, len(ticket_ids), batch_size):
+            batch = ticket_ids[i:i + batch_size]
+            criteria = [{'criteria': [{'link': 'OR', 'field': 2, 'searchtype': 'equals', 'value': tid} for tid in batch]},
+                        {'link': 'AND', 'criteria': [{'link': 'OR', 'field': 12, 'searchtype': 'equals', 'value': sid} for sid in active_status_ids]}]
+            payload = {"is_deleted": 0, "criteria": criteria, "forcedisplay": [2, 1, 24, 12], "range": f"0-{len(batch) - 1}"}
+            with STAGE_SECONDS.time(stage="fetch"): response_data = self._make_request("POST", "search/Ticket", json=payload)
+            rows = response_data.get('data', []) if isinstance(response_data, dict) else (response_data or [])
+            tickets += [row for row in rows if row.get('12') in active_status_ids]
+        return tickets
 
     def search_solved_tickets(self, ticket_title: str, ticket_content: Optional[str]) -> List[Dict]:
         if not ticket_content: ticket_content = ""
@@ -113,42 +193,86 @@ class GLPIService:
         results = self._make_request("POST", "search/KnowbaseItem", json=payload)
         return [{"id": r.get('id'), "name": r.get('1'), "answer": r.get('2')} for r in results] if results and isinstance(results, list) else []
 
+    @staticmethod
+    def followup_input(ticket_id: str, content: str) -> Dict[str, Any]:
+        return {"tickets_id": int(ticket_id), "content": content, "is_private": 1}
+
     def add_followup(self, ticket_id: str, content: str) -> bool:
-        payload = {"input": {"tickets_id": int(ticket_id), "content": content, "is_private": 1}}
-        response = self._make_request("POST", "TicketFollowup", json=payload)
+        payload = {"input": self.followup_input(ticket_id, content)}
+        with STAGE_SECONDS.time(stage="followup"): response = self._make_request("POST", "TicketFollowup", json=payload)
         if response:
             self.logger.info(f"Acompanhamento adicionado com sucesso ao chamado #{ticket_id}.")
             return True
-        self.logger.error(f"Falha ao adicionar acompanhamento ao chamado #{ticket_id}. A API rejeitou o payload.")
+        self.logger.error(f"Falha ao adicionar acompanhamento ao chamado #{ticket_id}. A API rejeitou o payload."); STAGE_ERRORS.inc(stage="followup")
         return False
 
+    def add_followups(self, inputs: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Criação em massa (POST TicketFollowup com uma lista em `input`). O GLPI responde,
+        na mesma ordem, {"id": <novo id ou false>, "message": ...} por item.
+        """
+        with STAGE_SECONDS.time(stage="followup"): response = self._make_request("POST", "TicketFollowup", json={"input": inputs})
+        if isinstance(response, dict): response = [response]
+        if not isinstance(response, list):
+            self.logger.error(f"Falha ao adicionar {len(inputs)} acompanhamento(s) em lote. A API rejeitou o payload."); return [False] * len(inputs)
+        results = [isinstance(item, dict) and bool(item.get("id")) for item in response[:len(inputs)]]
+        results += [False] * (len(inputs) - len(results))
+        for item_input, ok in zip(inputs, results):
+            if not ok: self.logger.error(f"Falha ao adicionar acompanhamento ao chamado #{item_input['tickets_id']} (lote)."); STAGE_ERRORS.inc(stage="followup")
+        return results
+
 # =============================================================================
 # SERVIÇO DO LLM
 # =============================================================================
 class LLMService:
-    def __init__(self, config: LLMConfig): self.config = config; self.logger = logging.getLogger(__name__)
+    def __init__(self, config: LLMConfig, transport: Optional[TransportConfig] = None, cache: Optional[LLMResultCache] = None,
+                 preprocessor: Optional[TicketPreprocessor] = None, router: Optional[EndpointRouter] = None):
+        self.config = config; self.logger = logging.getLogger(__name__); self.cache = cache
+        self.preprocessor = preprocessor or TicketPreprocessor(PreprocessConfig.from_env())
+        self.transport = transport or TransportConfig.from_env(); self.http = get_session("ollama", self.transport.ollama_pool_size)
+        # OLLAMA_API_URL aceita uma lista separada por vírgulas, balanceada pelo roteador (ou o roteador compartilhado do daemon)
+        self.router = router or EndpointRouter.from_env(config.api_url.split(','))
+        self.client = OllamaClient(self.http, self.router, self.transport, config.model)
+    def warm_up(self) -> None:
+        self.client.warm_up(self.config.analysis_prompt)
     def generate_guidance(self, ticket_data: Dict, user_history: List[Dict], global_solutions: List[Dict], kb_articles: List[Dict]) -> Optional[LLMAgentResponse]:
+        # O contexto de pesquisa entra na chave: o mesmo chamado com outro contexto gera outro roteiro.
+        cache_key = None
+        if self.cache:
+            category = [ticket_data['itilcategories_id']] if ticket_data.get('itilcategories_id') else []
+            context = json.dumps([global_solutions, kb_articles] + category, sort_keys=True, ensure_ascii=False)
+            cache_key = self.cache.key(ticket_data.get('1'), ticket_data.get('24'), hashlib.sha256(context.encode("utf-8")).hexdigest())
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Análise do chamado #{ticket_data.get('2')} obtida do cache.")
+                return LLMAgentResponse(**dict(cached, solucao_recomendada=Solution(**cached["solucao_recomendada"])))
+        guidance = self._request_guidance(ticket_data, global_solutions, kb_articles)
+        if guidance and cache_key: self.cache.put(cache_key, asdict(guidance))
+        return guidance
+
+    def _request_guidance(self, ticket_data: Dict, global_solutions: List[Dict], kb_articles: List[Dict]) -> Optional[LLMAgentResponse]:
         self.logger.info(f"Gerando análise sênior para o chamado #{ticket_data.get('2')}...");
-        ticket = TicketDetails(id=str(ticket_data.get('2')), title=ticket_data.get('1'), content=ticket_data.get('24'))
-        prompt = f"""{self.config.analysis_prompt} **## Chamado Atual ##** ID:{ticket.id}, Título:{ticket.title}, Descrição:{ticket.content} **## Contexto de Pesquisa ##** **Soluções Globais:** {json.dumps(global_solutions, indent=2, ensure_ascii=False)} **Base de Conhecimento:** {json.dumps(kb_articles, indent=2, ensure_ascii=False)} **## Resposta JSON ##**""";
-        try:
-            payload = {"model": self.config.model, "prompt": prompt, "stream": False, "format": "json"};
-            response = requests.post(f"{self.config.api_url.strip()}/api/generate", json=payload, timeout=120);
-            response.raise_for_status();
-            response_json = json.loads(response.json().get("response", "{}").strip());
-
-            solucao = response_json.get('solucao_recomendada', {})
-            return LLMAgentResponse(
-                sintese_problema=response_json.get("sintese_problema", "Não foi possível sintetizar o problema."),
-                hipotese_causa_raiz=response_json.get("hipotese_causa_raiz", "Nenhuma hipótese clara pôde ser formada."),
-                plano_de_acao=response_json.get("plano_de_acao", []),
-                solucao_recomendada=Solution(
-                    descricao_passos=solucao.get("descricao_passos", "Nenhuma solução específica encontrada nos dados."),
-                    fonte_chamado=solucao.get("fonte_chamado", "N/A")
-                )
+        ticket = TicketDetails(id=str(ticket_data.get('2')), title=ticket_data.get('1'), content=self.preprocessor.clean(str(ticket_data.get('2')), ticket_data.get('24')))
+        # No daemon combinado, o chamado chega com o título corrigido e a categoria definida pela reclassificação
+        category = f", Categoria (ID):{ticket_data['itilcategories_id']}" if ticket_data.get('itilcategories_id') else ""
+        prompt = f"""**## Chamado Atual ##** ID:{ticket.id}, Título:{ticket.title}{category}, Descrição:{ticket.content} **## Contexto de Pesquisa ##** **Soluções Globais:** {json.dumps(global_solutions, indent=2, ensure_ascii=False)} **Base de Conhecimento:** {json.dumps(kb_articles, indent=2, ensure_ascii=False)} **## Resposta JSON ##**""";
+        generated = self.client.generate_json(prompt, 120, self._parse_guidance, f"o chamado #{ticket.id}", system=self.config.analysis_prompt,
+                                              kind="guidance")
+        if generated is None: self.logger.error(f"Falha ao gerar relatório para o chamado #{ticket.id}.")
+        return generated[0] if generated else None
+
+    @staticmethod
+    def _parse_guidance(response_json: Dict[str, Any]) -> LLMAgentResponse:
+        solucao = response_json.get('solucao_recomendada', {})
+        return LLMAgentResponse(
+            sintese_problema=response_json.get("sintese_problema", "Não foi possível sintetizar o problema."),
+            hipotese_causa_raiz=response_json.get("hipotese_causa_raiz", "Nenhuma hipótese clara pôde ser formada."),
+            plano_de_acao=response_json.get("plano_de_acao", []),
+            solucao_recomendada=Solution(
+                descricao_passos=solucao.get("descricao_passos", "Nenhuma solução específica encontrada nos dados."),
+                fonte_chamado=solucao.get("fonte_chamado", "N/A")
             )
-        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
-            self.logger.error(f"Falha ao gerar relatório para o chamado #{ticket.id}. Erro: {e}"); return None
+        )
 
 # =============================================================================
 # APLICAÇÃO PRINCIPAL
@@ -166,94 +290,196 @@ def build_html_list(items: List[Any], item_type: str = 'disc') -> str:
     return html_items
 
 class TicketAgentApp:
-    def __init__(self):
+    def __init__(self, glpi_session: Optional[GLPISession] = None, router: Optional[EndpointRouter] = None,
+                 store: Optional[ProcessedStore] = None):
+        """Os parâmetros opcionais permitem ao daemon combinado (pipeline_daemon.py) compartilhar sessão GLPI, roteador e histórico."""
         log_level = os.getenv('LOG_LEVEL', 'INFO');
         self.assessment_interval_minutes = int(os.getenv('ASSESSMENT_INTERVAL_MINUTES', '30'));
         setup_logging(log_level);
         self.logger = logging.getLogger(__name__);
         glpi_config = GLPIConfig(url=os.getenv('GLPI_URL'), app_token=os.getenv('GLPI_APP_TOKEN'), user_token=os.getenv('GLPI_USER_TOKEN'));
-        llm_config = LLMConfig(api_url=os.getenv('OLLAMA_API_URL'), model=os.getenv('OLLAMA_MODEL'), analysis_prompt=os.getenv('OLLAMA_PROMPT_BASE_N1'));
+        llm_config = LLMConfig(api_url=os.getenv('OLLAMA_API_URL') or (','.join(router.endpoints) if router else None), model=os.getenv('OLLAMA_MODEL'), analysis_prompt=os.getenv('OLLAMA_PROMPT_BASE_N1'));
         status_ids_str = os.getenv('GLPI_ACTIVE_STATUS_IDS', '1,2,3,4');
         self.active_status_ids = [int(sid.strip()) for sid in status_ids_str.split(',')];
+        self.search_page_size = int(os.getenv('GLPI_SEARCH_PAGE_SIZE', '500'));
         if not all(vars(glpi_config).values()) or not all(vars(llm_config).values()):
             raise ValueError("Erro Crítico: Verifique se TODAS as variáveis de ambiente estão definidas no .env")
-        self.glpi_service = GLPIService(glpi_config);
-        self.llm_service = LLMService(llm_config);
-        self.processed_ids_path = "/tmp/glpi_agent_processed_ids.txt";
-        self.logger.info(f"Agente Inteligente inicializado. Rastreando em: {self.processed_ids_path}")
+        transport = TransportConfig.from_env();
+        self.glpi_service = GLPIService(glpi_config, transport, session=glpi_session);
+        cache_config = CacheConfig.from_env();
+        cache = LLMResultCache(cache_config, "agent", llm_config.model, llm_config.analysis_prompt) if cache_config.path else None;
+        self.llm_service = LLMService(llm_config, transport, cache, router=router);
+        self.store = store or ProcessedStore(os.getenv('STATE_DB_PATH', 'glpi_state.db'), "agent",
+                                             batch_size=int(os.getenv('PROCESSED_STORE_BATCH_SIZE', '20')),
+                                             retention_days=int(os.getenv('PROCESSED_RETENTION_DAYS', '90')));
+        self.store.import_text_file(os.getenv('AGENT_PROCESSED_LEGACY_PATH', '/tmp/glpi_agent_processed_ids.txt'));
+        # Modo pipeline (AGENT_PIPELINE_ENABLED): concorrência por etapa e tamanho das filas entre etapas
+        self.pipeline_mode = os.getenv('AGENT_PIPELINE_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim');
+        self.retrieval_workers = max(1, int(os.getenv('AGENT_RETRIEVAL_WORKERS', '2')));
+        self.llm_workers = max(1, int(os.getenv('AGENT_LLM_WORKERS', '1')));
+        self.followup_workers = max(1, int(os.getenv('AGENT_FOLLOWUP_WORKERS', '1')));
+        self.pipeline_queue_size = max(1, int(os.getenv('AGENT_PIPELINE_QUEUE_SIZE', '4')));
+        # Índice local (BM25) de chamados solucionados e artigos da base, no lugar das buscas searchText no GLPI
+        retrieval_config = RetrievalConfig.from_env();
+        self.retrieval_index = RetrievalIndex(retrieval_config) if retrieval_config.path else None;
+        write_config = WriteBehindConfig.from_env();
+        self.writer = WriteBehindQueue("TicketFollowup", self.glpi_service.add_followups, self._on_followup_result, write_config) if write_config.enabled else None;
+        self._search_pool = ThreadPoolExecutor(max_workers=self.retrieval_workers, thread_name_prefix="agent-kb") if self.pipeline_mode else None;
+        self._run_lock = threading.Lock();
+        # Métricas (/metrics) e saúde do último ciclo (/healthz); o servidor HTTP é iniciado no __main__
+        self.health = CycleHealth();
+        if router is None: REGISTRY.add_collector(router_collector(self.llm_service.router));
+        if cache: REGISTRY.add_collector(cache_collector(cache));
+        self.logger.info(f"Agente Inteligente inicializado. Rastreando em: {self.store.path}")
+
+    def _is_processed(self, ticket_data: Dict) -> bool:
+        return self.store.is_processed(str(ticket_data.get('2')), content_hash(ticket_data.get('24')))
+    def _mark_as_processed(self, ticket_data: Dict, guidance: LLMAgentResponse) -> None:
+        ticket_id = str(ticket_data.get('2'))
+        self.store.mark(ticket_id, content_hash(ticket_data.get('24')), self.llm_service.config.model, asdict(guidance))
+        TICKETS_PROCESSED.inc(); self.logger.info(f"Chamado #{ticket_id} marcado como processado.")
+
+    def _retrieve_context(self, ticket_data: Dict) -> Tuple[Dict, List[Dict], List[Dict]]:
+        """
+        Pesquisa chamados solucionados e base de conhecimento: no índice local quando ativo,
+        senão no GLPI (com as duas buscas em paralelo no modo pipeline).
+        """
+        ticket_title = ticket_data.get('1', 'N/A'); ticket_content = ticket_data.get('24', '')
+        self.logger.info(f"--- Processando chamado #{ticket_data.get('2')}: '{ticket_title}' ---")
+        with STAGE_SECONDS.time(stage="retrieval"): return self._search_context(ticket_data, ticket_title, ticket_content)
+
+    def _search_context(self, ticket_data: Dict, ticket_title: str, ticket_content: str) -> Tuple[Dict, List[Dict], List[Dict]]:
+        if self.retrieval_index is not None or self._search_pool is None:
+            searcher = self.retrieval_index or self.glpi_service
+            return ticket_data, searcher.search_solved_tickets(ticket_title, ticket_content), searcher.search_knowledge_base(ticket_title)
+        kb_future = self._search_pool.submit(self.glpi_service.search_knowledge_base, ticket_title)
+        global_solutions = self.glpi_service.search_solved_tickets(ticket_title, ticket_content)
+        return ticket_data, global_solutions, kb_future.result()
+
+    def _generate_guidance(self, context: Tuple[Dict, List[Dict], List[Dict]]) -> Optional[Tuple[Dict, LLMAgentResponse]]:
+        ticket_data, global_solutions, kb_articles = context
+        guidance = self.llm_service.generate_guidance(ticket_data, [], global_solutions, kb_articles)
+        if guidance is None:
+            self.logger.warning(f"Não foi possível gerar relatório para o chamado #{ticket_data.get('2')}.")
+            return None
+        return ticket_data, guidance
+
+    def _publish_guidance(self, generated: Tuple[Dict, LLMAgentResponse]) -> bool:
+        """Publica o acompanhamento (direto ou pela fila write-behind, confirmado depois)."""
+        ticket_data, guidance = generated; ticket_id = str(ticket_data.get('2'))
+        # Usa a nova função robusta para construir a lista HTML
+        plano_acao_html = build_html_list(guidance.plano_de_acao)
+
+        final_html = f"""
+        <div style="max-width: 700px; margin: auto; font-family: 'Segoe UI', Arial, sans-serif; background: #fdfdfd; border: 1px solid #cfd8dc; padding: 24px; border-radius: 8px; color: #263238; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.05);">
+            <div style="display: flex; align-items: center; margin-bottom: 20px; border-bottom: 1px solid #eceff1; padding-bottom: 16px;">
+                <div style="font-size: 28px; margin-right: 15px;">🤖</div>
+                <h2 style="margin: 0; font-size: 20px; color: #37474f;">Análise (IA)</h2>
+            </div>
+            <h3 style="font-size: 16px; color: #37474f;">📄 Síntese do Problema</h3>
+            <p style="font-size: 15px; line-height: 1.6;">{guidance.sintese_problema}</p>
+            <h3 style="font-size: 16px; color: #37474f; margin-top: 24px;">💡 Hipótese de Causa Raiz</h3>
+            <p style="font-size: 15px; line-height: 1.6;">{guidance.hipotese_causa_raiz}</p>
+            <h3 style="font-size: 16px; color: #37474f; margin-top: 24px;">📋 Plano de Ação Tático</h3>
+            <ul style="font-size: 15px; line-height: 1.6; list-style-type: '☑️ '; padding-left: 20px;">{plano_acao_html}</ul>
+            <div style="margin-top: 28px; background-color: #eceff1; padding: 14px 18px; border-left: 4px solid #37474f; border-radius: 6px;">
+                <h3 style="margin-top: 0; font-size: 16px; color: #37474f;">⭐ Solução Recomendada (Baseado em Casos Anteriores)</h3>
+                <p style="font-size: 15px; line-height: 1.6; margin-bottom: 5px;"><strong>Passos:</strong> {guidance.solucao_recomendada.descricao_passos}</p>
+                <p style="font-size: 13px; color: #546e7a; margin-top: 5px;"><em><strong>Fonte:</strong> {guidance.solucao_recomendada.fonte_chamado}</em></p>
+            </div>
+        </div>
+        """
+
+        if self.writer:
+            self.writer.submit(GLPIService.followup_input(ticket_id, final_html), (ticket_data, guidance)); return True
+        if self.glpi_service.add_followup(ticket_id, final_html):
+            self._mark_as_processed(ticket_data, guidance); return True
+        return False
 
-    def _load_processed_ids(self) -> Set[str]:
-        if not os.path.exists(self.processed_ids_path): return set()
-        try:
-            with open(self.processed_ids_path, 'r') as f: return {line.strip() for line in f if line.strip()}
-        except IOError as e: self.logger.error(f"Não foi possível ler o arquivo de IDs: {e}"); return set()
-    def _mark_as_processed(self, ticket_id: str) -> None:
-        try:
-            with open(self.processed_ids_path, 'a') as f: f.write(f"{ticket_id}\n")
-            self.logger.info(f"Chamado #{ticket_id} marcado como processado.")
-        except IOError as e: self.logger.error(f"Não foi possível escrever no arquivo de IDs: {e}")
+    def _on_followup_result(self, context: Tuple[Dict, LLMAgentResponse], ok: bool) -> None:
+        """Confirmação da fila write-behind: só o acompanhamento aceito marca o chamado como processado."""
+        if ok: self._mark_as_processed(*context)
+
+    def guide(self, tickets: Iterable[Dict]) -> int:
+        """Pesquisa, gera e publica a orientação de cada chamado (em pipeline ou sequencialmente); retorna quantos recebeu."""
+        if not self.pipeline_mode:
+            seen = 0
+            for ticket_data in tickets:
+                seen += 1
+                generated = self._generate_guidance(self._retrieve_context(ticket_data))
+                if generated: self._publish_guidance(generated)
+                if not self.llm_service.client.limiter.config.enabled: time.sleep(5)  # com o limite adaptativo, ele controla o ritmo
+            return seen
+        # Pesquisa, geração e publicação em etapas paralelas ligadas por filas limitadas
+        stages = [Stage("pesquisa", self._retrieve_context, self.retrieval_workers),
+                  Stage("llm", self._generate_guidance, self.llm_workers),
+                  Stage("acompanhamento", self._publish_guidance, self.followup_workers)]
+        for _ in pipeline(tickets, stages, self.pipeline_queue_size): pass
+        for stage in stages:
+            self.logger.info(f"Etapa '{stage.name}': {stage.processed} chamado(s), {stage.busy_seconds:.1f}s ocupada ({stage.workers} thread(s)).")
+        return stages[0].processed
+
+    def process_events(self, events: Dict[str, float]) -> None:
+        """Gera na hora a orientação dos chamados notificados pelo webhook ({id: instante da notificação})."""
+        with self._run_lock:
+            started = time.monotonic(); published: List[str] = []
+            try:
+                tickets = [t for t in self.glpi_service.get_active_tickets_by_ids(list(events), self.active_status_ids) if not self._is_processed(t)]
+                self.logger.info(f"Webhook: {len(events)} chamado(s) notificado(s), {len(tickets)} ativo(s) a processar.")
+                for ticket_data in tickets:
+                    generated = self._generate_guidance(self._retrieve_context(ticket_data))
+                    if generated and self._publish_guidance(generated): published.append(str(ticket_data.get('2')))
+                if self.writer: self.writer.flush()
+                for ticket_id in published: EVENT_LATENCY.observe(time.monotonic() - events[ticket_id])
+            finally:
+                self.store.flush()
+                self.logger.info(f"Webhook: {len(published)} acompanhamento(s) publicado(s) em {time.monotonic() - started:.1f}s.")
 
     def run_agent_cycle(self):
+        # Ciclos (reconciliação, no modo push) e eventos do webhook não rodam ao mesmo tempo
+        with self._run_lock: self._run_agent_cycle()
+
+    def _run_agent_cycle(self):
         self.logger.info("====== INICIANDO CICLO DE ANÁLISE DE CHAMADOS ======")
+        self.llm_service.warm_up()
+        cycle_start = time.monotonic(); cycle_error: Optional[str] = None
         try:
-            processed_ids = self._load_processed_ids()
-            active_tickets = self.glpi_service.get_all_active_tickets_from_api(self.active_status_ids)
-            tickets_to_process = [ticket for ticket in active_tickets if str(ticket.get('2')) not in processed_ids]
-
-            if not tickets_to_process: self.logger.info("Nenhum chamado novo para processar encontrado neste ciclo."); return
-
-            self.logger.info(f"Encontrados {len(tickets_to_process)} chamados para processar.")
-            for ticket_data in tickets_to_process:
-                ticket_id = str(ticket_data.get('2'))
-                ticket_title = ticket_data.get('1', 'N/A')
-                ticket_content = ticket_data.get('24', '')
-                self.logger.info(f"--- Processando chamado #{ticket_id}: '{ticket_title}' ---");
-
-                global_solutions = self.glpi_service.search_solved_tickets(ticket_title, ticket_content)
-                kb_articles = self.glpi_service.search_knowledge_base(ticket_title)
-
-                guidance = self.llm_service.generate_guidance(ticket_data, [], global_solutions, kb_articles);
-
-                if guidance:
-                    # Usa a nova função robusta para construir a lista HTML
-                    plano_acao_html = build_html_list(guidance.plano_de_acao)
-
-                    final_html = f"""
-                    <div style="max-width: 700px; margin: auto; font-family: 'Segoe UI', Arial, sans-serif; background: #fdfdfd; border: 1px solid #cfd8dc; padding: 24px; border-radius: 8px; color: #263238; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.05);">
-                        <div style="display: flex; align-items: center; margin-bottom: 20px; border-bottom: 1px solid #eceff1; padding-bottom: 16px;">
-                            <div style="font-size: 28px; margin-right: 15px;">🤖</div>
-                            <h2 style="margin: 0; font-size: 20px; color: #37474f;">Análise (IA)</h2>
-                        </div>
-                        <h3 style="font-size: 16px; color: #37474f;">📄 Síntese do Problema</h3>
-                        <p style="font-size: 15px; line-height: 1.6;">{guidance.sintese_problema}</p>
-                        <h3 style="font-size: 16px; color: #37474f; margin-top: 24px;">💡 Hipótese de Causa Raiz</h3>
-                        <p style="font-size: 15px; line-height: 1.6;">{guidance.hipotese_causa_raiz}</p>
-                        <h3 style="font-size: 16px; color: #37474f; margin-top: 24px;">📋 Plano de Ação Tático</h3>
-                        <ul style="font-size: 15px; line-height: 1.6; list-style-type: '☑️ '; padding-left: 20px;">{plano_acao_html}</ul>
-                        <div style="margin-top: 28px; background-color: #eceff1; padding: 14px 18px; border-left: 4px solid #37474f; border-radius: 6px;">
-                            <h3 style="margin-top: 0; font-size: 16px; color: #37474f;">⭐ Solução Recomendada (Baseado em Casos Anteriores)</h3>
-                            <p style="font-size: 15px; line-height: 1.6; margin-bottom: 5px;"><strong>Passos:</strong> {guidance.solucao_recomendada.descricao_passos}</p>
-                            <p style="font-size: 13px; color: #546e7a; margin-top: 5px;"><em><strong>Fonte:</strong> {guidance.solucao_recomendada.fonte_chamado}</em></p>
-                        </div>
-                    </div>
-                    """
-
-                    if self.glpi_service.add_followup(ticket_id, final_html):
-                        self._mark_as_processed(ticket_id)
-                else:
-                    self.logger.warning(f"Não foi possível gerar relatório para o chamado #{ticket_id}.");
-                time.sleep(5)
+            self.store.compact()
+            if self.retrieval_index:
+                try: self.retrieval_index.refresh(self.glpi_service.iter_search)
+                except Exception as e: self.logger.error(f"Falha ao atualizar o índice de recuperação; usando o índice atual: {e}", exc_info=True)
+            # Páginas chegam sob demanda; a próxima é baixada enquanto a atual é processada.
+            pages = prefetch(self.glpi_service.iter_active_tickets_from_api(self.active_status_ids, self.search_page_size))
+            tickets_to_process = (ticket for page in pages for ticket in page if not self._is_processed(ticket))
+
+            seen = self.guide(tickets_to_process)
+            BACKLOG.set(seen)
+            if not seen: self.logger.info("Nenhum chamado novo para processar encontrado neste ciclo.")
         except Exception as e:
-            self.logger.critical(f"Erro inesperado no ciclo do agente: {e}", exc_info=True)
+            self.logger.critical(f"Erro inesperado no ciclo do agente: {e}", exc_info=True); cycle_error = str(e)
         finally:
+            if self.writer: self.writer.flush()
+            self.health.record(cycle_error is None, time.monotonic() - cycle_start, cycle_error)
+            self.store.flush()
+            self.llm_service.router.log_state(); log_limits()
+            if self.llm_service.cache: self.llm_service.cache.log_stats()
             self.logger.info("====== CICLO DE ANÁLISE CONCLUÍDO ======")
 
 if __name__ == "__main__":
     try:
         app = TicketAgentApp()
+        if "--rebuild-index" in sys.argv:
+            if not app.retrieval_index: raise ValueError("RETRIEVAL_INDEX_PATH não definido: o índice de recuperação está desativado.")
+            app.retrieval_index.rebuild(app.glpi_service.iter_search); sys.exit(0)
+        server = create_server(app.health); metrics_config = MetricsConfig.from_env('AGENT_PORT', 5001)
+        webhook_config = WebhookConfig.from_env(); interval = app.assessment_interval_minutes
+        if webhook_config.enabled:
+            enable_push_mode(server, webhook_config, app.process_events, "agent")
+            metrics_config = replace(metrics_config, enabled=True); interval = webhook_config.reconcile_minutes
+        start_server(server, metrics_config); app.llm_service.warm_up()
         scheduler = BlockingScheduler(timezone="America/Sao_Paulo")
-        scheduler.add_job(app.run_agent_cycle, 'interval', minutes=app.assessment_interval_minutes, next_run_time=datetime.now())
-        logging.info(f"Agente agendado para rodar a cada {app.assessment_interval_minutes} minutos. Pressione Ctrl+C para sair.")
+        scheduler.add_job(app.run_agent_cycle, 'interval', minutes=interval, next_run_time=datetime.now())
+        logging.info(f"Agente agendado para rodar a cada {interval} minutos. Pressione Ctrl+C para sair.")
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         logging.info("Serviço do Agente encerrado.")
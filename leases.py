@@ -0,0 +1,217 @@
+"""
+Coordenação entre várias instâncias do app.py (modo multi-worker).
+
+Cada instância se registra num armazenamento compartilhado e reivindica os
+chamados antes de analisá-los, com um lease de LEASE_TTL_SECONDS renovado
+periodicamente enquanto o processamento dura. Leases de uma instância que caiu
+expiram e são reivindicados por outra; chamados concluídos ficam registrados
+(com o hash do conteúdo) para não serem reprocessados por nenhuma instância
+até serem editados. A posse preferencial de cada chamado é dada por hashing
+consistente do ID sobre as instâncias vivas, de modo que cada uma lista e
+enfileira só a sua parte e a redistribuição ao entrar/sair uma instância é mínima.
+
+Backend padrão: SQLite num volume compartilhado (LEASE_DB_PATH), em modo de
+journal DELETE, pois o WAL não funciona em sistemas de arquivos de rede.
+Outros backends podem ser registrados com `register_backend`.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from metrics import CLUSTER_WORKERS, LEASE_CLAIMS
+
+
+@dataclass
+class LeaseConfig:
+    enabled: bool; backend: str; location: str; worker_id: str; ttl_seconds: float; heartbeat_seconds: float
+    worker_ttl_seconds: float; consistent_hashing: bool; virtual_nodes: int; retention_days: int
+    @classmethod
+    def from_env(cls) -> 'LeaseConfig':
+        heartbeat = float(os.getenv('LEASE_HEARTBEAT_SECONDS', '30'))
+        return cls(enabled=os.getenv('LEASE_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   backend=os.getenv('LEASE_BACKEND', 'sqlite').strip().lower(),
+                   location=os.getenv('LEASE_DB_PATH', 'glpi_leases.db'),
+                   worker_id=os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}",
+                   ttl_seconds=float(os.getenv('LEASE_TTL_SECONDS', '300')), heartbeat_seconds=heartbeat,
+                   worker_ttl_seconds=float(os.getenv('LEASE_WORKER_TTL_SECONDS', str(heartbeat * 3))),
+                   consistent_hashing=os.getenv('LEASE_CONSISTENT_HASHING', 'true').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   virtual_nodes=int(os.getenv('LEASE_VIRTUAL_NODES', '64')),
+                   retention_days=int(os.getenv('PROCESSED_RETENTION_DAYS', '90')))
+
+
+class LeaseBackend:
+    """Interface do armazenamento compartilhado de leases e de instâncias vivas."""
+    def heartbeat(self, namespace: str, worker_id: str) -> None: raise NotImplementedError
+    def live_workers(self, namespace: str, max_age_seconds: float) -> List[str]: raise NotImplementedError
+    def unregister(self, namespace: str, worker_id: str) -> None: raise NotImplementedError
+    def claim(self, namespace: str, owner: str, hashes: Dict[str, Optional[str]], ttl_seconds: float) -> Set[str]:
+        """Reivindica os chamados livres, com lease vencido ou concluídos com outro conteúdo; devolve os obtidos."""
+        raise NotImplementedError
+    def renew(self, namespace: str, owner: str, ttl_seconds: float) -> int: raise NotImplementedError
+    def complete(self, namespace: str, owner: str, ticket_id: str, content_hash: Optional[str]) -> None: raise NotImplementedError
+    def release(self, namespace: str, owner: str, ticket_ids: Optional[Iterable[str]] = None) -> None: raise NotImplementedError
+    def compact(self, namespace: str, retention_days: int) -> int: raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    def __init__(self, path: str):
+        self.path = path; self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ticket_leases (
+                namespace TEXT NOT NULL, ticket_id TEXT NOT NULL, owner TEXT NOT NULL, state TEXT NOT NULL,
+                content_hash TEXT, expires_at REAL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, ticket_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_ticket_leases_owner ON ticket_leases (namespace, owner, state);
+            CREATE TABLE IF NOT EXISTS cluster_workers (
+                namespace TEXT NOT NULL, worker_id TEXT NOT NULL, last_seen REAL NOT NULL, PRIMARY KEY (namespace, worker_id)
+            ) WITHOUT ROWID;
+        """)
+
+    def _write(self, func: Callable[[sqlite3.Connection], object]):
+        """Executa `func` numa transação IMMEDIATE (trava de escrita do arquivo enquanto decide)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try: result = func(self._conn); self._conn.execute("COMMIT"); return result
+            except BaseException: self._conn.execute("ROLLBACK"); raise
+
+    def heartbeat(self, namespace: str, worker_id: str) -> None:
+        self._write(lambda c: c.execute("INSERT OR REPLACE INTO cluster_workers VALUES (?, ?, ?)", (namespace, worker_id, time.time())))
+
+    def live_workers(self, namespace: str, max_age_seconds: float) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT worker_id FROM cluster_workers WHERE namespace = ? AND last_seen >= ? ORDER BY worker_id",
+                                                         (namespace, time.time() - max_age_seconds))]
+
+    def unregister(self, namespace: str, worker_id: str) -> None:
+        self._write(lambda c: c.execute("DELETE FROM cluster_workers WHERE namespace = ? AND worker_id = ?", (namespace, worker_id)))
+
+    def claim(self, namespace: str, owner: str, hashes: Dict[str, Optional[str]], ttl_seconds: float) -> Set[str]:
+        if not hashes: return set()
+        now = time.time()
+
+        def _claim(c: sqlite3.Connection) -> Set[str]:
+            c.executemany("""INSERT INTO ticket_leases VALUES (?, ?, ?, 'leased', ?, ?, ?)
+                ON CONFLICT (namespace, ticket_id) DO UPDATE SET owner = excluded.owner, state = 'leased', content_hash = excluded.content_hash,
+                    expires_at = excluded.expires_at, updated_at = excluded.updated_at
+                WHERE (ticket_leases.state = 'leased' AND (ticket_leases.expires_at < excluded.updated_at OR ticket_leases.owner = excluded.owner))
+                   OR (ticket_leases.state = 'done' AND ticket_leases.content_hash IS NOT excluded.content_hash)""",
+                          [(namespace, ticket_id, owner, content, now + ttl_seconds, now) for ticket_id, content in hashes.items()])
+            placeholders = ",".join("?" * len(hashes))
+            return {row[0] for row in c.execute(f"""SELECT ticket_id FROM ticket_leases WHERE namespace = ? AND owner = ? AND state = 'leased'
+                AND updated_at = ? AND ticket_id IN ({placeholders})""", [namespace, owner, now] + list(hashes))}
+        return self._write(_claim)
+
+    def renew(self, namespace: str, owner: str, ttl_seconds: float) -> int:
+        return self._write(lambda c: c.execute("UPDATE ticket_leases SET expires_at = ? WHERE namespace = ? AND owner = ? AND state = 'leased'",
+                                               (time.time() + ttl_seconds, namespace, owner)).rowcount)
+
+    def complete(self, namespace: str, owner: str, ticket_id: str, content_hash: Optional[str]) -> None:
+        self._write(lambda c: c.execute("""INSERT INTO ticket_leases VALUES (?, ?, ?, 'done', ?, NULL, ?)
+            ON CONFLICT (namespace, ticket_id) DO UPDATE SET owner = excluded.owner, state = 'done', content_hash = excluded.content_hash,
+                expires_at = NULL, updated_at = excluded.updated_at""", (namespace, ticket_id, owner, content_hash, time.time())))
+
+    def release(self, namespace: str, owner: str, ticket_ids: Optional[Iterable[str]] = None) -> None:
+        if ticket_ids is None:
+            self._write(lambda c: c.execute("DELETE FROM ticket_leases WHERE namespace = ? AND owner = ? AND state = 'leased'", (namespace, owner)))
+            return
+        rows = [(namespace, owner, ticket_id) for ticket_id in ticket_ids]
+        self._write(lambda c: c.executemany("DELETE FROM ticket_leases WHERE namespace = ? AND owner = ? AND ticket_id = ? AND state = 'leased'", rows))
+
+    def compact(self, namespace: str, retention_days: int) -> int:
+        if retention_days <= 0: return 0
+        return self._write(lambda c: c.execute("DELETE FROM ticket_leases WHERE namespace = ? AND state = 'done' AND updated_at < ?",
+                                               (namespace, time.time() - retention_days * 86400)).rowcount)
+
+
+BACKENDS: Dict[str, Callable[[str], LeaseBackend]] = {"sqlite": SQLiteLeaseBackend}
+
+
+def register_backend(name: str, factory: Callable[[str], LeaseBackend]) -> None:
+    """Registra um backend (ex.: Redis, PostgreSQL) selecionável por LEASE_BACKEND; recebe LEASE_DB_PATH."""
+    BACKENDS[name.lower()] = factory
+
+
+class HashRing:
+    """Anel de hashing consistente com `virtual_nodes` pontos por instância."""
+    def __init__(self, workers: Iterable[str], virtual_nodes: int = 64):
+        points = sorted((self._hash(f"{worker}#{i}"), worker) for worker in set(workers) for i in range(virtual_nodes))
+        self._keys = [p[0] for p in points]; self._workers = [p[1] for p in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._keys: return None
+        return self._workers[bisect.bisect(self._keys, self._hash(key)) % len(self._keys)]
+
+
+class LeaseManager:
+    """Lease e posse dos chamados desta instância, com heartbeat em segundo plano."""
+    def __init__(self, config: LeaseConfig, namespace: str):
+        if config.backend not in BACKENDS: raise ValueError(f"LEASE_BACKEND desconhecido: '{config.backend}' (disponíveis: {', '.join(BACKENDS)}).")
+        self.config = config; self.namespace = namespace; self.worker_id = config.worker_id
+        self.backend = BACKENDS[config.backend](config.location); self.logger = logging.getLogger(__name__)
+        self._ring = HashRing([self.worker_id], config.virtual_nodes); self._workers = [self.worker_id]
+        self._stop = threading.Event(); self._thread: Optional[threading.Thread] = None
+        self.heartbeat()
+
+    def heartbeat(self) -> None:
+        """Registra esta instância como viva, renova os leases em andamento e recalcula o anel."""
+        try:
+            self.backend.heartbeat(self.namespace, self.worker_id)
+            self.backend.renew(self.namespace, self.worker_id, self.config.ttl_seconds)
+            workers = self.backend.live_workers(self.namespace, self.config.worker_ttl_seconds)
+        except Exception as e:
+            self.logger.error(f"Falha no heartbeat do armazenamento de leases ({self.config.location}): {e}"); return
+        if self.worker_id not in workers: workers.append(self.worker_id)
+        if sorted(workers) != sorted(self._workers):
+            self.logger.info(f"Instâncias ativas: {', '.join(sorted(workers))} (esta: {self.worker_id}).")
+            self._ring = HashRing(workers, self.config.virtual_nodes); self._workers = workers
+        CLUSTER_WORKERS.set(len(workers))
+
+    def start(self) -> None:
+        def _run() -> None:
+            while not self._stop.wait(self.config.heartbeat_seconds): self.heartbeat()
+        self._thread = threading.Thread(target=_run, name="lease-heartbeat", daemon=True); self._thread.start()
+        self.logger.info(f"Modo multi-worker ativo como '{self.worker_id}' (leases de {self.config.ttl_seconds:.0f}s em {self.config.location}).")
+
+    def owns(self, ticket_id: str) -> bool:
+        """Se esta instância é a dona preferencial do chamado pelo anel (sempre True sem hashing consistente)."""
+        return not self.config.consistent_hashing or self._ring.owner(str(ticket_id)) == self.worker_id
+
+    def claim(self, hashes: Dict[str, Optional[str]]) -> Set[str]:
+        """Reivindica os chamados {id: hash do conteúdo}; devolve os IDs cujo lease é desta instância."""
+        try: claimed = self.backend.claim(self.namespace, self.worker_id, hashes, self.config.ttl_seconds)
+        except Exception as e:
+            self.logger.error(f"Falha ao reivindicar {len(hashes)} chamado(s) no armazenamento de leases: {e}"); return set()
+        LEASE_CLAIMS.inc(len(claimed), result="claimed"); LEASE_CLAIMS.inc(len(hashes) - len(claimed), result="unavailable")
+        return claimed
+
+    def complete(self, ticket_id: str, content_hash: Optional[str]) -> None:
+        try: self.backend.complete(self.namespace, self.worker_id, str(ticket_id), content_hash)
+        except Exception as e: self.logger.error(f"Falha ao registrar a conclusão do chamado #{ticket_id} no armazenamento de leases: {e}")
+
+    def release(self, ticket_ids: Optional[Iterable[str]] = None) -> None:
+        try: self.backend.release(self.namespace, self.worker_id, list(ticket_ids) if ticket_ids is not None else None)
+        except Exception as e: self.logger.error(f"Falha ao liberar leases no armazenamento compartilhado: {e}")
+
+    def compact(self) -> int:
+        try: return self.backend.compact(self.namespace, self.config.retention_days)
+        except Exception as e: self.logger.error(f"Falha ao compactar o armazenamento de leases: {e}"); return 0
+
+    def stop(self) -> None:
+        """Para o heartbeat, libera os leases em andamento e sai do anel."""
+        self._stop.set(); self.release()
+        try: self.backend.unregister(self.namespace, self.worker_id)
+        except Exception as e: self.logger.error(f"Falha ao remover a instância do armazenamento de leases: {e}")
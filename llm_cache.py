@@ -0,0 +1,124 @@
+"""
+Cache persistente de respostas da LLM, endereçado por conteúdo.
+
+A chave combina o modelo, o hash do prompt base e o título+descrição
+normalizados do chamado, de modo que chamados idênticos (ex.: enxurradas do
+monitoramento) custem uma única geração no Ollama. Entradas expiram por TTL e
+o tamanho é limitado com despejo LRU (os acessos são gravados em lote, não a
+cada acerto). Uma mudança de OLLAMA_MODEL ou do prompt
+invalida automaticamente o cache daquele namespace.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+# Acertos acumulados antes de gravar last_access (também gravados antes de cada despejo)
+_ACCESS_FLUSH_SIZE = 100
+
+
+@dataclass
+class CacheConfig:
+    path: str; max_entries: int; ttl_seconds: int
+    @classmethod
+    def from_env(cls) -> 'CacheConfig':
+        # LLM_CACHE_PATH vazio desativa o cache
+        return cls(path=os.getenv('LLM_CACHE_PATH', 'llm_cache.db'), max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000')),
+                   ttl_seconds=int(float(os.getenv('LLM_CACHE_TTL_HOURS', '168')) * 3600))
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return " ".join((text or "").lower().split())
+
+
+class LLMResultCache:
+    def __init__(self, config: CacheConfig, namespace: str, model: str, prompt: str):
+        self.config = config; self.namespace = namespace; self.logger = logging.getLogger(__name__)
+        self.fingerprint = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+        self.hits = 0; self.misses = 0; self._lock = threading.Lock(); self._accessed: Dict[str, float] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(config.path)), exist_ok=True)
+        self._conn = sqlite3.connect(config.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,
+                created_at REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (namespace, last_access);
+            CREATE TABLE IF NOT EXISTS llm_cache_meta (namespace TEXT PRIMARY KEY, fingerprint TEXT NOT NULL) WITHOUT ROWID;
+        """)
+        self._invalidate_if_changed()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM llm_cache WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def _invalidate_if_changed(self) -> None:
+        row = self._conn.execute("SELECT fingerprint FROM llm_cache_meta WHERE namespace = ?", (self.namespace,)).fetchone()
+        if row and row[0] == self.fingerprint: return
+        with self._conn:
+            removed = self._conn.execute("DELETE FROM llm_cache WHERE namespace = ?", (self.namespace,)).rowcount
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache_meta VALUES (?, ?)", (self.namespace, self.fingerprint))
+        if row: self.logger.info(f"Modelo ou prompt alterado: cache '{self.namespace}' invalidado ({removed} entradas removidas).")
+
+    def key(self, title: Optional[str], content: Optional[str], extra: str = "") -> str:
+        """Chave do chamado: fingerprint (modelo+prompt), título+descrição normalizados e contexto extra opcional."""
+        material = f"{self.fingerprint}\0{normalize_text(title)}\0{normalize_text(content)}\0{extra}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()
+            if row is None or now - row[1] > self.config.ttl_seconds:
+                self.misses += 1; return None
+            self._accessed[key] = now; self.hits += 1
+            if len(self._accessed) >= _ACCESS_FLUSH_SIZE: self._flush_access_locked()
+        return json.loads(row[0])
+
+    def _flush_access_locked(self) -> None:
+        if not self._accessed: return
+        try:
+            with self._conn:
+                self._conn.executemany("UPDATE llm_cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                                       [(at, self.namespace, key) for key, at in self._accessed.items()])
+            self._accessed.clear()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Falha ao gravar os acessos ao cache da LLM: {e}")
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                data = json.dumps(value, ensure_ascii=False)
+                with self._conn:
+                    inserted = self._conn.execute("INSERT OR IGNORE INTO llm_cache VALUES (?, ?, ?, ?, ?)", (self.namespace, key, data, now, now)).rowcount
+                    if not inserted:
+                        self._conn.execute("UPDATE llm_cache SET value = ?, created_at = ?, last_access = ? WHERE namespace = ? AND key = ?",
+                                           (data, now, now, self.namespace, key))
+                self._accessed.pop(key, None); self._size += inserted
+                if self._size > self.config.max_entries: self._evict_locked(now)
+            except sqlite3.Error as e:
+                self.logger.warning(f"Falha ao gravar no cache da LLM: {e}")
+
+    def _evict_locked(self, now: float) -> None:
+        """Remove expiradas e, se ainda acima do limite, as menos usadas recentemente (deixa 10% de folga)."""
+        self._flush_access_locked()
+        with self._conn:
+            self._conn.execute("DELETE FROM llm_cache WHERE namespace = ? AND created_at < ?", (self.namespace, now - self.config.ttl_seconds))
+            self._size = self._conn.execute("SELECT COUNT(*) FROM llm_cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+            excess = self._size - int(self.config.max_entries * 0.9)
+            if excess > 0:
+                self._conn.execute("""DELETE FROM llm_cache WHERE namespace = ? AND key IN (
+                    SELECT key FROM llm_cache WHERE namespace = ? ORDER BY last_access LIMIT ?)""", (self.namespace, self.namespace, excess))
+                self._size -= excess
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / lookups if lookups else 0.0, "entries": self._size}
+
+    def log_stats(self) -> None:
+        s = self.stats()
+        self.logger.info(f"Cache da LLM ({self.namespace}): {s['hits']} acertos, {s['misses']} falhas, taxa de acerto {s['hit_ratio']:.1%}, {s['entries']} entradas.")
@@ -0,0 +1,261 @@
+"""
+Métricas no formato texto do Prometheus e endpoint HTTP embutido (Flask).
+
+Cada processo (app.py, intelligent_agent.py) mantém seu próprio registro em
+memória e o expõe em /metrics, junto com /healthz, que informa se o último
+ciclo terminou bem. Valores que já existem em outros objetos (estado do
+roteador Ollama, estatísticas do cache) entram por coletores avaliados no
+momento da leitura.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool; host: str; port: int
+    @classmethod
+    def from_env(cls, port_var: str = 'PORT', default_port: int = 5000) -> 'MetricsConfig':
+        return cls(enabled=os.getenv('METRICS_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   host=os.getenv('METRICS_HOST', '0.0.0.0'), port=int(os.getenv(port_var, str(default_port))))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+class _Metric:
+    kind = "untyped"
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name; self.help = help_text; self.labelnames = tuple(labelnames); self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._lines()
+
+    def _lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs); self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames: self._values[()] = 0.0  # sem rótulos: exporta 0 desde o início
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock: return self._values.get(self._key(labels), 0.0)
+
+    def _lines(self) -> List[str]:
+        with self._lock: return [f"{self.name}{_format_labels(self._labels(k))} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+    def set(self, value: float, **labels) -> None:
+        with self._lock: self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames); self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, List[float]] = {}  # contagens por bucket + [soma, total]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets): data[index] += 1
+            data[-2] += value; data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.monotonic()
+        try: yield
+        finally: self.observe(time.monotonic() - started, **labels)
+
+    def _lines(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, data in self._values.items():
+                labels = self._labels(key); cumulative = 0.0
+                for bound, count in zip(self.buckets, data):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=repr(float(bound))))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le='+Inf'))} {data[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {data[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []; self._collectors: List[Callable[[], List[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric); return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """Coletor avaliado a cada leitura; devolve [(nome, tipo, ajuda, [(rótulos, valor)])]."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics: lines += metric.render()
+        # Famílias de mesmo nome vindas de coletores diferentes (ex.: dois caches no daemon combinado) saem juntas
+        families: Dict[str, Tuple[str, str, List[Sample]]] = {}
+        for collector in self._collectors:
+            try: collected = collector()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Falha num coletor de métricas: {e}"); continue
+            for name, kind, help_text, samples in collected:
+                families.setdefault(name, (kind, help_text, []))[2].extend(samples)
+        for name, (kind, help_text, samples) in families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in samples if value is not None]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram("glpi_llm_stage_seconds", "Duração de cada etapa por chamado/página (fetch, llm, update, followup, retrieval).", ["stage"]))
+STAGE_ERRORS = REGISTRY.register(Counter("glpi_llm_stage_errors_total", "Falhas por etapa.", ["stage"]))
+CYCLE_SECONDS = REGISTRY.register(Histogram("glpi_llm_cycle_seconds", "Duração dos ciclos de processamento.", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)))
+LAST_CYCLE_SECONDS = REGISTRY.register(Gauge("glpi_llm_last_cycle_duration_seconds", "Duração do último ciclo."))
+LAST_CYCLE_SUCCESS = REGISTRY.register(Gauge("glpi_llm_last_cycle_success", "1 se o último ciclo terminou sem erro."))
+BACKLOG = REGISTRY.register(Gauge("glpi_llm_backlog_tickets", "Chamados pendentes (não processados) encontrados no último ciclo."))
+TICKETS_PROCESSED = REGISTRY.register(Counter("glpi_llm_tickets_processed_total", "Chamados processados com sucesso."))
+SESSION_REINITS = REGISTRY.register(Counter("glpi_llm_glpi_session_reinit_total", "Reinicializações da sessão GLPI (initSession)."))
+WEBHOOK_EVENTS = REGISTRY.register(Counter("glpi_llm_webhook_requests_total", "Requisições recebidas no webhook por resultado.", ["result"]))
+WEBHOOK_QUEUE = REGISTRY.register(Gauge("glpi_llm_webhook_queue_tickets", "Chamados notificados pelo webhook aguardando processamento."))
+EVENT_LATENCY = REGISTRY.register(Histogram("glpi_llm_event_to_update_seconds", "Tempo entre a notificação do webhook e a gravação no GLPI.",
+                                            buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600)))
+LEASE_CLAIMS = REGISTRY.register(Counter("glpi_llm_lease_claims_total", "Reivindicações de chamados no modo multi-worker (claimed/unavailable).", ["result"]))
+CLASSIFIER_DECISIONS = REGISTRY.register(Counter("glpi_llm_classifier_decisions_total", "Decisões do pré-classificador local (local = chamada à LLM evitada, llm = enviado ao Ollama).", ["result"]))
+OLLAMA_REQUEST_SECONDS = REGISTRY.register(Histogram("glpi_llm_ollama_request_seconds", "Latência das gerações no Ollama por partida (cold = modelo recarregado, warm = já em memória).", ["start"]))
+CLUSTER_WORKERS = REGISTRY.register(Gauge("glpi_llm_cluster_workers", "Instâncias vivas no armazenamento de leases."))
+
+
+class CycleHealth:
+    """Resultado do último ciclo, exposto em /healthz e nas métricas de ciclo."""
+    def __init__(self):
+        self._lock = threading.Lock(); self.last_success: Optional[bool] = None; self.last_finished: Optional[float] = None
+        self.last_duration: Optional[float] = None; self.last_error: Optional[str] = None
+
+    def record(self, success: bool, duration: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.last_success = success; self.last_finished = time.time(); self.last_duration = duration; self.last_error = error
+        CYCLE_SECONDS.observe(duration); LAST_CYCLE_SECONDS.set(duration); LAST_CYCLE_SUCCESS.set(1 if success else 0)
+
+    def status(self) -> Tuple[int, Dict]:
+        with self._lock:
+            body = {"status": "starting" if self.last_success is None else ("ok" if self.last_success else "failing"),
+                    "last_cycle_success": self.last_success, "last_cycle_finished_at": self.last_finished,
+                    "last_cycle_duration_seconds": self.last_duration, "last_error": self.last_error}
+        return (503 if self.last_success is False else 200), body
+
+
+def router_collector(router) -> Callable[[], List[Tuple[str, str, str, List[Sample]]]]:
+    """Métricas por endpoint Ollama a partir do `EndpointRouter.snapshot()`."""
+    def collect():
+        snapshot = router.snapshot()
+        return [("glpi_llm_ollama_tokens_per_second", "gauge", "Taxa de geração (EWMA) por endpoint Ollama.",
+                 [({"endpoint": ep["url"]}, ep["tokens_per_second"]) for ep in snapshot]),
+                ("glpi_llm_ollama_requests_total", "counter", "Requisições ao Ollama por endpoint e resultado.",
+                 [({"endpoint": ep["url"], "result": "success"}, ep["successes"]) for ep in snapshot]
+                 + [({"endpoint": ep["url"], "result": "error"}, ep["failures"]) for ep in snapshot]),
+                ("glpi_llm_ollama_latency_ewma_seconds", "gauge", "Latência média móvel por endpoint Ollama.",
+                 [({"endpoint": ep["url"]}, ep["ewma_latency"]) for ep in snapshot]),
+                ("glpi_llm_ollama_in_flight", "gauge", "Requisições em andamento por endpoint Ollama.",
+                 [({"endpoint": ep["url"]}, ep["in_flight"]) for ep in snapshot]),
+                ("glpi_llm_ollama_circuit_open", "gauge", "1 se o circuito do endpoint não está fechado.",
+                 [({"endpoint": ep["url"]}, 0 if ep["circuit"] == "closed" else 1) for ep in snapshot])]
+    return collect
+
+
+def cache_collector(cache) -> Callable[[], List[Tuple[str, str, str, List[Sample]]]]:
+    """Acertos, falhas e taxa de acerto do `LLMResultCache`."""
+    def collect():
+        stats = cache.stats(); labels = {"cache": cache.namespace}
+        return [("glpi_llm_cache_hits_total", "counter", "Acertos no cache da LLM.", [(labels, stats["hits"])]),
+                ("glpi_llm_cache_misses_total", "counter", "Falhas no cache da LLM.", [(labels, stats["misses"])]),
+                ("glpi_llm_cache_hit_ratio", "gauge", "Taxa de acerto do cache da LLM.", [(labels, stats["hit_ratio"])]),
+                ("glpi_llm_cache_entries", "gauge", "Entradas no cache da LLM.", [(labels, stats["entries"])])]
+    return collect
+
+
+def work_queue_collector(work_queue) -> Callable[[], List[Tuple[str, str, str, List[Sample]]]]:
+    """Itens da `WorkQueue` por estado (pronto, aguardando nova tentativa, desistido)."""
+    def collect():
+        stats = work_queue.stats()
+        return [("glpi_llm_work_queue_items", "gauge", "Chamados na fila de trabalho por estado.",
+                 [({"state": state}, count) for state, count in stats.items()])]
+    return collect
+
+
+def limiter_collector(snapshots: Callable[[], List[Dict]]) -> Callable[[], List[Tuple[str, str, str, List[Sample]]]]:
+    """Limite, carga e vazão dos limitadores adaptativos (`adaptive_limit.snapshots`)."""
+    def collect():
+        states = snapshots()
+        return [("glpi_llm_adaptive_limit", "gauge", "Limite atual de requisições simultâneas por backend.",
+                 [({"backend": s["backend"]}, s["limit"]) for s in states]),
+                ("glpi_llm_adaptive_in_flight", "gauge", "Requisições em andamento por backend.",
+                 [({"backend": s["backend"]}, s["in_flight"]) for s in states]),
+                ("glpi_llm_adaptive_throughput", "gauge", "Respostas bem-sucedidas por segundo (último minuto) por backend.",
+                 [({"backend": s["backend"]}, s["throughput"]) for s in states]),
+                ("glpi_llm_adaptive_decreases_total", "counter", "Reduções do limite (sobrecarga ou pico de latência) por backend.",
+                 [({"backend": s["backend"]}, s["decreases"]) for s in states])]
+    return collect
+
+
+def create_server(health: CycleHealth, registry: Registry = REGISTRY):
+    """Aplicação Flask com /metrics e /healthz (outras rotas podem ser acrescentadas por quem chama)."""
+    from flask import Flask, Response
+    server = Flask(__name__)
+
+    @server.route("/metrics")
+    def metrics_view():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    @server.route("/healthz")
+    def healthz_view():
+        code, body = health.status()
+        return Response(json.dumps(body), status=code, mimetype="application/json")
+
+    return server
+
+
+def start_server(server, config: MetricsConfig) -> Optional[threading.Thread]:
+    """Sobe o servidor HTTP numa thread daemon (não bloqueia o agendador)."""
+    if not config.enabled: return None
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    thread = threading.Thread(target=lambda: server.run(host=config.host, port=config.port, threaded=True, use_reloader=False),
+                              name="metrics-http", daemon=True)
+    thread.start()
+    logging.getLogger(__name__).info(f"Métricas em http://{config.host}:{config.port}/metrics e saúde em /healthz.")
+    return thread
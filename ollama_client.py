@@ -0,0 +1,265 @@
+"""
+Cliente de geração JSON no Ollama (/api/generate ou /api/chat).
+
+Centraliza o laço de roteamento/failover entre endpoints e acrescenta:
+  * modo streaming: lê os tokens à medida que chegam e encerra a leitura assim
+    que um valor JSON completo e válido foi recebido, sem esperar o fim da geração;
+  * timeouts adaptativos por endpoint, derivados dos percentis de latência
+    observados (com o valor fixo de cada chamada como teto e ponto de partida);
+  * métricas por requisição: eval_count/eval_duration (tokens/s), tempo até o
+    primeiro token e latência total, repassadas ao roteador;
+  * limite adaptativo (AIMD) de gerações simultâneas, compartilhado no processo
+    (adaptive_limit, com ADAPTIVE_LIMIT_ENABLED);
+  * modo chat (OLLAMA_API_MODE=chat): as regras fixas vão como mensagem de sistema,
+    um prefixo estável que o cache de prefixo (KV) do servidor reaproveita entre chamados;
+  * keep_alive cobrindo o intervalo entre ciclos e aquecimento (warm-up) dos
+    endpoints, com a latência de partidas a frio (modelo recarregado) separada da quente.
+"""
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
+
+import requests
+
+from adaptive_limit import IGNORED, AdaptiveLimiter, get_limiter
+from http_transport import TransportConfig
+from metrics import OLLAMA_REQUEST_SECONDS, STAGE_ERRORS, STAGE_SECONDS
+from ollama_router import EndpointRouter
+
+T = TypeVar("T")
+
+API_MODES = ("generate", "chat")
+
+
+def _keep_alive(value: str, interval_minutes: int) -> Union[int, str]:
+    """OLLAMA_KEEP_ALIVE em segundos (-1 = sempre) ou duração ("45m"); vazio = intervalo entre ciclos + 5 minutos."""
+    value = value.strip()
+    if not value: return f"{interval_minutes + 5}m"
+    try: return int(value)
+    except ValueError: return value
+
+
+@dataclass
+class OllamaClientConfig:
+    streaming: bool; adaptive_timeouts: bool; timeout_percentile: float; timeout_multiplier: float
+    min_timeout: float; min_samples: int
+    api_mode: str = "generate"; keep_alive: Union[int, str, None] = None; warmup: bool = False; cold_load_seconds: float = 1.0
+    @classmethod
+    def from_env(cls) -> 'OllamaClientConfig':
+        flag = lambda name, default: os.getenv(name, default).strip().lower() in ('1', 'true', 'yes', 'sim')
+        api_mode = os.getenv('OLLAMA_API_MODE', 'generate').strip().lower()
+        if api_mode not in API_MODES: raise ValueError(f"OLLAMA_API_MODE inválido: {api_mode} (use {', '.join(API_MODES)}).")
+        return cls(streaming=flag('OLLAMA_STREAMING', 'false'), adaptive_timeouts=flag('OLLAMA_ADAPTIVE_TIMEOUTS', 'true'),
+                   timeout_percentile=float(os.getenv('OLLAMA_TIMEOUT_PERCENTILE', '0.95')),
+                   timeout_multiplier=float(os.getenv('OLLAMA_TIMEOUT_MULTIPLIER', '2.0')),
+                   min_timeout=float(os.getenv('OLLAMA_MIN_TIMEOUT', '10')),
+                   min_samples=int(os.getenv('OLLAMA_TIMEOUT_MIN_SAMPLES', '10')), api_mode=api_mode,
+                   keep_alive=_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE', ''), int(os.getenv('ASSESSMENT_INTERVAL_MINUTES', '30'))),
+                   warmup=flag('OLLAMA_WARMUP', 'true'), cold_load_seconds=float(os.getenv('OLLAMA_COLD_LOAD_SECONDS', '1.0')))
+
+
+class JsonCompletionDetector:
+    """
+    Acompanha o texto gerado e indica quando um valor JSON de nível superior foi
+    fechado (profundidade de chaves/colchetes de volta a zero, fora de strings).
+    """
+    def __init__(self):
+        self.text = ""; self._depth = 0; self._in_string = False; self._escaped = False; self._started = False
+
+    def feed(self, chunk: str) -> Optional[Any]:
+        """Acrescenta um trecho; retorna o valor decodificado quando o JSON estiver completo."""
+        start = len(self.text); self.text += chunk
+        for i in range(start, len(self.text)):
+            ch = self.text[i]
+            if self._in_string:
+                if self._escaped: self._escaped = False
+                elif ch == "\\": self._escaped = True
+                elif ch == '"': self._in_string = False
+            elif ch == '"': self._in_string = True
+            elif ch in "{[": self._depth += 1; self._started = True
+            elif ch in "}]":
+                self._depth -= 1
+                if self._started and self._depth == 0:
+                    try:
+                        return json.loads(self.text[:i + 1])
+                    except json.JSONDecodeError:
+                        return None
+        return None
+
+
+class OllamaClient:
+    def __init__(self, http: requests.Session, router: EndpointRouter, transport: TransportConfig, model: str,
+                 config: Optional[OllamaClientConfig] = None, limiter: Optional[AdaptiveLimiter] = None):
+        self.http = http; self.router = router; self.transport = transport; self.model = model
+        self.config = config or OllamaClientConfig.from_env(); self.logger = logging.getLogger(__name__)
+        self.limiter = limiter or get_limiter("ollama")
+
+    def timeout_for(self, api_url: str, default: float, kind: str = "") -> float:
+        """
+        Timeout de leitura do endpoint para requisições do tipo `kind`: percentil configurado das
+        latências desse tipo x multiplicador, limitado a [min_timeout, default]. Sem amostras
+        suficientes, usa o valor fixo da chamada.
+        """
+        if not self.config.adaptive_timeouts: return default
+        observed = self.router.percentile(api_url, self.config.timeout_percentile, min_samples=self.config.min_samples, request_kind=kind)
+        if observed is None: return default
+        return max(self.config.min_timeout, min(default, observed * self.config.timeout_multiplier))
+
+    def _payload(self, prompt: str, system: Optional[str], options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Corpo da requisição. No modo chat, `system` (as regras fixas) vai como mensagem de sistema
+        e o chamado como mensagem do usuário; no modo generate, ambos formam um único prompt.
+        """
+        payload: Dict[str, Any] = {"model": self.model, "stream": self.config.streaming, "format": "json"}
+        if self.config.api_mode == "chat":
+            messages: List[Dict[str, str]] = [{"role": "system", "content": system}] if system else []
+            payload["messages"] = messages + [{"role": "user", "content": prompt}]
+        else:
+            payload["prompt"] = f"{system}\n\n{prompt}" if system else prompt
+        if self.config.keep_alive is not None: payload["keep_alive"] = self.config.keep_alive
+        if options is not None: payload["options"] = options
+        return payload
+
+    @property
+    def _path(self) -> str:
+        return "/api/chat" if self.config.api_mode == "chat" else "/api/generate"
+
+    @staticmethod
+    def _text(body: Dict[str, Any]) -> str:
+        """Texto gerado de uma resposta (ou trecho) de /api/generate ou /api/chat."""
+        if "message" in body: return (body.get("message") or {}).get("content", "")
+        return body.get("response", "")
+
+    @staticmethod
+    def _stats(body: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in body.items() if k not in ("response", "message", "context")}
+
+    def generate_json(self, prompt: str, read_timeout: float, parse: Callable[[Any], T], label: str,
+                      options: Optional[Dict[str, Any]] = None, system: Optional[str] = None, kind: str = "",
+                      adaptive: bool = True) -> Optional[Tuple[T, Dict[str, Any]]]:
+        """
+        Envia o prompt (com as regras fixas em `system`) ao Ollama e converte o JSON gerado com
+        `parse`. O roteador escolhe o endpoint menos carregado; os demais (com circuito fechado)
+        são usados como failover, inclusive quando a resposta vem vazia ou inválida. `kind`
+        separa as latências (e o timeout adaptativo) de chamadas de custo diferente. Um
+        timeout adaptativo estourado não conta como falha do endpoint: a chamada é repetida
+        nele com o timeout fixo. Com `adaptive=False` (ex.: lotes, cujo custo varia com o
+        tamanho), vale sempre `read_timeout`. Retorna (resultado, métricas).
+        """
+        tried: Set[str] = set(); relaxed: Set[str] = set(); generation_started = time.monotonic()
+        while True:
+            slot = self.limiter.acquire()  # espera uma vaga antes de escolher o endpoint, para não inflar a carga vista pelo roteador
+            api_url = self.router.acquire(exclude=tried)
+            if api_url is None:
+                self.limiter.release(slot, IGNORED)
+                if not tried: self.logger.error(f"Nenhum endpoint Ollama disponível (circuitos abertos) para {label}.")
+                STAGE_ERRORS.inc(stage="llm")
+                return None
+            tried.add(api_url); started = time.monotonic(); reachable = False; error: Optional[BaseException] = None; self_imposed = False
+            timeout = read_timeout if not adaptive or api_url in relaxed else self.timeout_for(api_url, read_timeout, kind)
+            try:
+                payload = self._payload(prompt, system, options)
+                if self.config.streaming: data, stats = self._post_streaming(api_url, payload, timeout)
+                else: data, stats = self._post(api_url, payload, timeout)
+                reachable = True
+                if data is None: continue
+                stats["latency"] = time.monotonic() - started
+                self._record(api_url, stats, label)
+                result = parse(data)
+                STAGE_SECONDS.observe(time.monotonic() - generation_started, stage="llm")
+                return result, stats
+            except (requests.exceptions.RequestException, json.JSONDecodeError, TypeError, ValueError, AttributeError) as e:
+                self_imposed = (timeout < read_timeout and isinstance(e, requests.exceptions.Timeout)
+                                and not isinstance(e, requests.exceptions.ConnectTimeout))
+                if self_imposed:
+                    self.logger.warning(f"Timeout adaptativo de {timeout:.0f}s atingido para {label} em {api_url}; "
+                                        f"nova tentativa com o timeout fixo de {read_timeout:.0f}s.")
+                    relaxed.add(api_url); tried.discard(api_url)
+                else:
+                    self.logger.error(f"Falha ao analisar {label} com a LLM em {api_url} (timeout {timeout:.0f}s). Erro: {e}"); error = e
+            finally:
+                # Respostas inválidas da LLM não derrubam o circuito nem reduzem o limite: o endpoint respondeu.
+                # O timeout adaptativo é uma estimativa do cliente: estourá-lo não conta contra o endpoint nem o limite.
+                if self_imposed: self.router.abandon(api_url); self.limiter.release(slot, IGNORED)
+                else:
+                    self.router.release(api_url, time.monotonic() - started, success=reachable, kind=kind)
+                    self.limiter.done(slot, error, kind)
+
+    def _post(self, api_url: str, payload: Dict[str, Any], timeout: float) -> Tuple[Optional[Any], Dict[str, Any]]:
+        response = self.http.post(f"{api_url}{self._path}", json=payload, timeout=self.transport.ollama_timeout(timeout))
+        response.raise_for_status(); body = response.json(); response_str = self._text(body).strip()
+        return (json.loads(response_str) if response_str else None), self._stats(body)
+
+    def _post_streaming(self, api_url: str, payload: Dict[str, Any], timeout: float) -> Tuple[Optional[Any], Dict[str, Any]]:
+        """
+        Lê o NDJSON do Ollama trecho a trecho e para assim que o JSON gerado fecha. O
+        timeout de leitura vale entre trechos; o prazo total da geração também é `timeout`.
+        """
+        started = time.monotonic(); deadline = started + timeout
+        detector = JsonCompletionDetector(); stats: Dict[str, Any] = {}; chunks = 0
+        with self.http.post(f"{api_url}{self._path}", json=payload, stream=True, timeout=self.transport.ollama_timeout(timeout)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line: continue
+                body = json.loads(line)
+                if body.get("error"): raise ValueError(body["error"])
+                piece = self._text(body)
+                if piece:
+                    if chunks == 0: stats["ttft"] = time.monotonic() - started
+                    chunks += 1
+                    data = detector.feed(piece)
+                    if data is not None:
+                        # Geração interrompida: sem eval_count do Ollama, estima pelos trechos recebidos (~1 token cada)
+                        stats.update(early_stop=not body.get("done", False), eval_count=chunks,
+                                     eval_duration=int((time.monotonic() - started - stats["ttft"]) * 1e9))
+                        if body.get("done"): stats.update(self._stats(body))
+                        return data, stats
+                if body.get("done"):
+                    stats.update(self._stats(body))
+                    break
+                if time.monotonic() > deadline: raise requests.exceptions.Timeout(f"geração excedeu {timeout:.0f}s")
+        text = detector.text.strip()
+        return (json.loads(text) if text else None), stats
+
+    def _record(self, api_url: str, stats: Dict[str, Any], label: str) -> None:
+        eval_count = stats.get("eval_count") or 0; eval_seconds = (stats.get("eval_duration") or 0) / 1e9
+        stats["tokens_per_second"] = eval_count / eval_seconds if eval_seconds > 0 else None
+        # Partida a frio: o Ollama precisou (re)carregar o modelo. Sem load_duration (geração interrompida no streaming), não classifica.
+        load = stats["load_duration"] / 1e9 if stats.get("load_duration") is not None else None
+        stats["cold_start"] = load >= self.config.cold_load_seconds if load is not None else None
+        self.router.record_generation(api_url, stats.get("ttft"), eval_count, eval_seconds, stats["latency"], stats["cold_start"])
+        if stats["cold_start"] is not None: OLLAMA_REQUEST_SECONDS.observe(stats["latency"], start="cold" if stats["cold_start"] else "warm")
+        rate = f"{stats['tokens_per_second']:.1f} tokens/s" if stats["tokens_per_second"] else "n/d"
+        ttft = f", 1º token em {stats['ttft']:.2f}s" if stats.get("ttft") is not None else ""
+        prompt = f", {stats['prompt_eval_count']} token(s) de prompt avaliado(s)" if stats.get("prompt_eval_count") is not None else ""
+        self.logger.debug(f"Geração para {label} em {api_url}: {stats['latency']:.2f}s, {eval_count} tokens ({rate}){ttft}{prompt}"
+                          f"{f' [partida a frio: modelo carregado em {load:.1f}s]' if stats['cold_start'] else ''}"
+                          f"{' [encerrada ao completar o JSON]' if stats.get('early_stop') else ''}.")
+
+    def warm_up(self, system: Optional[str] = None, read_timeout: float = 120) -> None:
+        """
+        Carrega o modelo (com o keep_alive configurado) em cada endpoint com circuito fechado, para
+        que a partida a frio não caia no primeiro chamado do ciclo. Com `system`, avalia também as
+        regras fixas (uma geração de 1 token), deixando o prefixo no cache do servidor.
+        """
+        if not self.config.warmup: return
+        for api_url in self.router.available():
+            payload: Dict[str, Any] = {"model": self.model, "stream": False}
+            if self.config.api_mode == "chat": payload["messages"] = [{"role": "system", "content": system}] if system else []
+            else: payload["prompt"] = system or ""
+            if system: payload["options"] = {"num_predict": 1}
+            if self.config.keep_alive is not None: payload["keep_alive"] = self.config.keep_alive
+            started = time.monotonic()
+            try:
+                response = self.http.post(f"{api_url}{self._path}", json=payload, timeout=self.transport.ollama_timeout(read_timeout))
+                response.raise_for_status(); body = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.warning(f"Falha no aquecimento do modelo {self.model} em {api_url}: {e}"); continue
+            elapsed = time.monotonic() - started; load = (body.get("load_duration") or 0) / 1e9
+            if load >= self.config.cold_load_seconds:
+                self.logger.info(f"Aquecimento: modelo {self.model} carregado em {api_url} em {load:.1f}s ({elapsed:.1f}s no total).")
+            else:
+                self.logger.debug(f"Aquecimento: modelo {self.model} já estava em memória em {api_url} ({elapsed:.2f}s).")
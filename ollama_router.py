@@ -0,0 +1,157 @@
+"""
+Roteador de endpoints Ollama.
+
+Distribui as chamadas entre as URLs configuradas escolhendo o endpoint menos
+carregado (requisições em andamento x latência média móvel - EWMA) e isola
+nós com falha através de um circuit breaker com sondagem half-open. Também
+guarda amostras recentes de latência e de tempo até o primeiro token, usadas
+para timeouts adaptativos, a taxa de geração (tokens/s) de cada endpoint e a
+latência separada por partida a frio (modelo recarregado) ou quente.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Iterable
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+@dataclass
+class EndpointState:
+    url: str
+    ewma_latency: Optional[float] = None
+    in_flight: int = 0
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    circuit: str = CLOSED
+    opened_at: float = 0.0
+    tokens_per_second: Optional[float] = None
+    tokens_generated: int = 0
+    latency_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200), repr=False)
+    # Latências por tipo de requisição (ex.: análise, lote, orientação), base dos timeouts adaptativos
+    kind_samples: Dict[str, Deque[float]] = field(default_factory=dict, repr=False)
+    ttft_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200), repr=False)
+    cold_starts: int = 0
+    cold_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200), repr=False)
+    warm_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200), repr=False)
+
+
+def _percentile(samples: Iterable[float], q: float) -> Optional[float]:
+    ordered = sorted(samples)
+    if not ordered: return None
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class EndpointRouter:
+    def __init__(self, urls: Iterable[str], alpha: float = 0.3, failure_threshold: int = 3, open_seconds: float = 60.0):
+        self.endpoints: Dict[str, EndpointState] = {u.strip(): EndpointState(url=u.strip()) for u in urls if u.strip()}
+        self.alpha = alpha; self.failure_threshold = failure_threshold; self.open_seconds = open_seconds
+        self._lock = threading.Lock(); self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_env(cls, urls: Iterable[str]) -> 'EndpointRouter':
+        return cls(urls, alpha=float(os.getenv('OLLAMA_LATENCY_EWMA_ALPHA', '0.3')),
+                   failure_threshold=int(os.getenv('OLLAMA_CIRCUIT_FAILURE_THRESHOLD', '3')),
+                   open_seconds=float(os.getenv('OLLAMA_CIRCUIT_OPEN_SECONDS', '60')))
+
+    def _score(self, ep: EndpointState, default_latency: float) -> float:
+        latency = ep.ewma_latency if ep.ewma_latency is not None else default_latency
+        return (ep.in_flight + 1) * latency
+
+    def acquire(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Reserva o endpoint mais adequado (fora de `exclude`) e incrementa seu contador
+        de requisições em andamento. Retorna None se nenhum estiver disponível.
+        Todo acquire bem-sucedido deve ser seguido de um `release`.
+        """
+        excluded = set(exclude)
+        with self._lock:
+            now = time.monotonic(); candidates = []
+            for ep in self.endpoints.values():
+                if ep.url in excluded: continue
+                if ep.circuit == OPEN and now - ep.opened_at >= self.open_seconds:
+                    ep.circuit = HALF_OPEN
+                    self.logger.info(f"Circuito do endpoint {ep.url} em half-open. Enviando requisição de sondagem.")
+                if ep.circuit == CLOSED or (ep.circuit == HALF_OPEN and ep.in_flight == 0):
+                    candidates.append(ep)
+            if not candidates: return None
+            known = [ep.ewma_latency for ep in candidates if ep.ewma_latency is not None]
+            default_latency = min(known) if known else 1.0
+            chosen = min(candidates, key=lambda ep: (self._score(ep, default_latency), ep.in_flight))
+            chosen.in_flight += 1
+            return chosen.url
+
+    def available(self) -> List[str]:
+        """Endpoints cujo circuito não está aberto (usado no aquecimento, fora da contagem de carga)."""
+        with self._lock: return [ep.url for ep in self.endpoints.values() if ep.circuit != OPEN]
+
+    def release(self, url: str, latency: float, success: bool, kind: str = "") -> None:
+        """Registra o resultado de uma requisição (do tipo `kind`) e atualiza EWMA e circuit breaker."""
+        with self._lock:
+            ep = self.endpoints[url]; ep.in_flight = max(0, ep.in_flight - 1)
+            if success:
+                ep.successes += 1; ep.consecutive_failures = 0
+                ep.ewma_latency = latency if ep.ewma_latency is None else self.alpha * latency + (1 - self.alpha) * ep.ewma_latency
+                ep.latency_samples.append(latency); ep.kind_samples.setdefault(kind, deque(maxlen=200)).append(latency)
+                if ep.circuit != CLOSED: self.logger.info(f"Endpoint {url} respondeu à sondagem. Circuito fechado.")
+                ep.circuit = CLOSED
+                return
+            ep.failures += 1; ep.consecutive_failures += 1
+            if ep.circuit == HALF_OPEN or ep.consecutive_failures >= self.failure_threshold:
+                if ep.circuit != OPEN:
+                    self.logger.warning(f"Circuito aberto para o endpoint {url} após {ep.consecutive_failures} falha(s) consecutiva(s). Nova tentativa em {self.open_seconds:.0f}s.")
+                ep.circuit = OPEN; ep.opened_at = time.monotonic()
+
+    def abandon(self, url: str) -> None:
+        """Encerra uma requisição sem veredito sobre o endpoint (ex.: timeout adaptativo do próprio cliente)."""
+        with self._lock: ep = self.endpoints[url]; ep.in_flight = max(0, ep.in_flight - 1)
+
+    def record_generation(self, url: str, ttft: Optional[float], tokens: int, eval_seconds: float,
+                          latency: Optional[float] = None, cold: Optional[bool] = None) -> None:
+        """Registra tempo até o primeiro token, taxa de geração (tokens/s) e a latência como partida a frio ou quente."""
+        with self._lock:
+            ep = self.endpoints[url]
+            if ttft is not None: ep.ttft_samples.append(ttft)
+            if latency is not None and cold is not None:
+                (ep.cold_samples if cold else ep.warm_samples).append(latency); ep.cold_starts += cold
+            if tokens and eval_seconds > 0:
+                rate = tokens / eval_seconds; ep.tokens_generated += tokens
+                ep.tokens_per_second = rate if ep.tokens_per_second is None else self.alpha * rate + (1 - self.alpha) * ep.tokens_per_second
+
+    def percentile(self, url: str, q: float, kind: str = "latency", min_samples: int = 10, request_kind: Optional[str] = None) -> Optional[float]:
+        """
+        Percentil `q` das amostras recentes ('latency' ou 'ttft'); None se houver poucas amostras.
+        Com `request_kind`, usa só as latências daquele tipo de requisição.
+        """
+        with self._lock:
+            ep = self.endpoints[url]
+            if request_kind is not None and kind == "latency": samples = list(ep.kind_samples.get(request_kind, ()))
+            else: samples = list(ep.latency_samples if kind == "latency" else ep.ttft_samples)
+        return _percentile(samples, q) if len(samples) >= min_samples else None
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Estado atual de cada endpoint (latência, carga, falhas, circuito e taxa de geração)."""
+        with self._lock:
+            return [{"url": ep.url, "ewma_latency": ep.ewma_latency, "p50_latency": _percentile(ep.latency_samples, 0.5),
+                     "p95_latency": _percentile(ep.latency_samples, 0.95), "p95_ttft": _percentile(ep.ttft_samples, 0.95),
+                     "in_flight": ep.in_flight, "successes": ep.successes, "failures": ep.failures,
+                     "consecutive_failures": ep.consecutive_failures, "circuit": ep.circuit, "opened_at": ep.opened_at,
+                     "tokens_per_second": ep.tokens_per_second, "tokens_generated": ep.tokens_generated,
+                     "p50_warm_latency": _percentile(ep.warm_samples, 0.5), "p50_cold_latency": _percentile(ep.cold_samples, 0.5),
+                     "cold_starts": ep.cold_starts,
+                     "p95_latency_by_kind": {kind or "-": _percentile(samples, 0.95) for kind, samples in ep.kind_samples.items()}}
+                    for ep in self.endpoints.values()]
+
+    def log_state(self) -> None:
+        fmt = lambda value, unit: f"{value:.2f}{unit}" if value is not None else "n/d"
+        for ep in self.snapshot():
+            self.logger.info(f"Endpoint {ep['url']}: circuito={ep['circuit']}, latência EWMA={fmt(ep['ewma_latency'], 's')}, "
+                             f"p95={fmt(ep['p95_latency'], 's')}, 1º token p95={fmt(ep['p95_ttft'], 's')}, "
+                             f"p50 quente={fmt(ep['p50_warm_latency'], 's')}, p50 a frio={fmt(ep['p50_cold_latency'], 's')} ({ep['cold_starts']} partida(s) a frio), "
+                             f"geração={fmt(ep['tokens_per_second'], ' tokens/s')}, em andamento={ep['in_flight']}, "
+                             f"sucessos={ep['successes']}, falhas={ep['failures']}"
+                             + "".join(f", p95 {kind}={fmt(p95, 's')}" for kind, p95 in sorted(ep['p95_latency_by_kind'].items())))
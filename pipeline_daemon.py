@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+GLPI Pipeline Daemon - reclassificação e orientação num único processo.
+
+Substitui a execução lado a lado de app.py e intelligent_agent.py: os chamados
+ativos são buscados e normalizados uma única vez por ciclo e passam pelas
+etapas configuradas em PIPELINE_STAGES, na ordem:
+  * reclassify: análise e atualização de prioridade/urgência/título/categoria
+    (TicketAssessorApp, com lote, quase duplicados, cache e concorrência);
+  * guidance: pesquisa de contexto, geração da orientação e acompanhamento
+    (TicketAgentApp), já com o título corrigido e a categoria definida.
+As etapas compartilham a sessão e o pool HTTP do GLPI, o roteador do Ollama, o
+histórico de processados (STATE_DB_PATH, um namespace por etapa), o endpoint
+de métricas (PORT) e o agendador. Com LEASE_ENABLED, cada etapa reivindica os
+chamados no armazenamento de leases (reclassify no mesmo namespace do app.py,
+guidance num namespace próprio), para conviver com outras instâncias. A fila de
+trabalho e o modo push (webhook) não são suportados: o daemon recusa iniciar com eles.
+"""
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+import app as assessor_module
+import intelligent_agent as agent_module
+from adaptive_limit import log_state as log_limits
+from leases import LeaseConfig, LeaseManager
+from metrics import BACKLOG, CycleHealth, MetricsConfig, create_server, start_server
+from processed_store import content_hash
+from streaming import prefetch
+from webhook import WebhookConfig
+from work_queue import WorkQueueConfig
+
+STAGES = ("reclassify", "guidance")
+
+
+@dataclass
+class PipelineConfig:
+    stages: List[str]; interval_minutes: int
+    @classmethod
+    def from_env(cls) -> 'PipelineConfig':
+        stages = [s.strip().lower() for s in os.getenv('PIPELINE_STAGES', ','.join(STAGES)).split(',') if s.strip()]
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown or not stages: raise ValueError(f"PIPELINE_STAGES inválido: {', '.join(unknown) or 'vazio'} (use {', '.join(STAGES)}).")
+        if WorkQueueConfig.from_env().enabled or WebhookConfig.from_env().enabled:
+            raise ValueError("WORK_QUEUE_ENABLED e WEBHOOK_ENABLED não são suportados pelo daemon combinado; use app.py e intelligent_agent.py.")
+        return cls(stages=stages, interval_minutes=int(os.getenv('ASSESSMENT_INTERVAL_MINUTES', '30')))
+
+
+class PipelineDaemon:
+    def __init__(self):
+        self.config = PipelineConfig.from_env()
+        self.assessor = assessor_module.TicketAssessorApp()
+        self.logger = logging.getLogger(__name__)
+        self.reclassify = "reclassify" in self.config.stages; self.guidance = "guidance" in self.config.stages
+        self.agent: Optional[agent_module.TicketAgentApp] = None
+        if self.guidance:
+            # Endpoints e circuitos compartilhados; latências e timeouts adaptativos ficam separados por etapa (kind)
+            self.agent = agent_module.TicketAgentApp(glpi_session=self.assessor.glpi_service.session,
+                                                     router=self.assessor.llm_service.router, store=self.assessor.store.namespace_view("agent"))
+        # Multi-worker: a reclassificação usa os leases do app.py (namespace "assessor"); a orientação, um namespace próprio
+        lease_config = LeaseConfig.from_env()
+        self.guidance_leases = LeaseManager(lease_config, "agent") if self.agent and lease_config.enabled else None
+        if self.guidance_leases: self.guidance_leases.start()
+        self.health = CycleHealth()
+        self.logger.info(f"Daemon combinado inicializado com as etapas: {' -> '.join(self.config.stages)}.")
+
+    # -- pendências por etapa ------------------------------------------------------
+    def _needs_reclassify(self, ticket_id: str, content: Optional[str]) -> bool:
+        return self.reclassify and not self.assessor._is_processed(ticket_id, content)
+
+    def _needs_guidance(self, ticket_id: str, content: Optional[str]) -> bool:
+        return self.guidance and not self.agent.store.is_processed(ticket_id, content_hash(content) if content is not None else None)
+
+    def _is_done(self, ticket_id: str, content: Optional[str]) -> bool:
+        """Filtro da busca: o chamado só é baixado se alguma etapa ainda precisa dele."""
+        return not self._needs_reclassify(ticket_id, content) and not self._needs_guidance(ticket_id, content)
+
+    def _modified_after_processing(self, ticket_id: str, modified_at: float) -> bool:
+        """Modificado depois do processamento em alguma etapa: o conteúdo é baixado e conferido pelo hash."""
+        return ((self.reclassify and self.assessor.store.modified_after(ticket_id, modified_at))
+                or (self.guidance and self.agent.store.modified_after(ticket_id, modified_at)))
+
+    def _claim(self, leases: LeaseManager, tickets: List[assessor_module.Ticket]) -> Set[str]:
+        """IDs dos chamados desta instância pelo anel cujo lease ela obteve (todos, sem leases)."""
+        owned = {t.id: content_hash(t.content) for t in tickets if leases.owns(t.id)}
+        claimed = leases.claim(owned)
+        if len(claimed) < len(owned): self.logger.info(f"{len(owned) - len(claimed)} chamado(s) em processamento ou já concluído(s) por outra instância.")
+        return claimed
+
+    # -- etapas ----------------------------------------------------------------------
+    def _reclassified(self, pages: Iterable[List[assessor_module.Ticket]]) -> Iterator[Tuple[assessor_module.Ticket, Optional[Dict]]]:
+        """
+        Etapa de reclassificação: analisa os pendentes de cada página e repassa os demais com o
+        resultado já registrado no histórico. Gera (chamado, análise aplicada ou None). Com leases,
+        pendentes de outra instância ficam fora do ciclo (inclusive da orientação, que espera o título corrigido).
+        """
+        app = self.assessor
+        for page in pages:
+            todo = [t for t in page if self._needs_reclassify(t.id, t.content)]; todo_ids = {t.id for t in todo}
+            if app.leases:
+                claimed = self._claim(app.leases, todo); todo = [t for t in todo if t.id in claimed]
+            for ticket in page:
+                if ticket.id not in todo_ids: yield ticket, (app.store.get(ticket.id) or {}).get("result")
+            if not todo: continue
+            for ticket, analysis in app._settled(app._process_stream(app._batch_units(app._group_pages([todo])))):
+                yield ticket, asdict(analysis) if analysis is not None else None
+
+    def _guidance_items(self, results: Iterable[Tuple[assessor_module.Ticket, Optional[Dict]]],
+                        outcomes: Dict[str, Tuple[assessor_module.Ticket, bool]], claimed: Dict[str, assessor_module.Ticket]) -> Iterator[Dict]:
+        """
+        Converte para o formato do agente os chamados que precisam de orientação, com o título corrigido
+        e a categoria. Com leases, só os reivindicados por esta instância (registrados em `claimed`).
+        """
+        for ticket, result in results:
+            outcomes[ticket.id] = (ticket, result is not None or not self._needs_reclassify(ticket.id, ticket.content))
+            if not self._needs_guidance(ticket.id, ticket.content): continue
+            if self.guidance_leases:
+                if not self._claim(self.guidance_leases, [ticket]): continue
+                claimed[ticket.id] = ticket
+            ticket_data = {'2': ticket.id, '1': (result or {}).get('new_title') or ticket.title, '24': ticket.content}
+            if (result or {}).get('new_category_id'): ticket_data['itilcategories_id'] = result['new_category_id']
+            yield ticket_data
+
+    # -- ciclo -------------------------------------------------------------------------
+    def run_cycle(self):
+        self.logger.info("====== INICIANDO CICLO DO DAEMON COMBINADO ======")
+        app = self.assessor
+        if not app.glpi_service.session_token and not app.glpi_service.init_session():
+            self.logger.error("Ciclo pulado. Não foi possível estabelecer uma sessão com o GLPI.")
+            self.health.record(False, 0.0, "sem sessão GLPI"); return
+        self.warm_up()
+        cycle_start = time.monotonic(); cycle_error: Optional[str] = None
+        outcomes: Dict[str, Tuple[assessor_module.Ticket, bool]] = {}; claimed: Dict[str, assessor_module.Ticket] = {}
+        try:
+            app.store.compact()
+            if app.leases: app.leases.compact()
+            if self.guidance_leases: self.guidance_leases.compact()
+            if self.agent:
+                self.agent.store.compact()
+                if self.agent.retrieval_index:
+                    try: self.agent.retrieval_index.refresh(self.agent.glpi_service.iter_search)
+                    except Exception as e: self.logger.error(f"Falha ao atualizar o índice de recuperação; usando o índice atual: {e}", exc_info=True)
+            # Uma única busca para todas as etapas (janela completa ou incremental, com watermark próprio do daemon)
+            incremental = app.glpi_service.config.fetch_mode == 'incremental'
+            if incremental:
+                pages = app.glpi_service.iter_active_tickets_incremental(app.store.get_meta("pipeline_watermark"), self._is_done,
+                                                                         modified_after_processing=self._modified_after_processing)
+            else:
+                pages = app.glpi_service.iter_active_tickets(self._is_done)
+            results = self._reclassified(prefetch(pages))
+            if self.agent:
+                guided = self.agent.guide(self._guidance_items(results, outcomes, claimed))
+                if self.agent.writer: self.agent.writer.flush()
+            else:
+                guided = sum(1 for _ in self._guidance_items(results, outcomes, claimed))
+            BACKLOG.set(len(outcomes))
+            reclassified = sum(1 for _, ok in outcomes.values() if ok)
+            self.logger.info(f"{len(outcomes)} chamado(s) pendente(s) neste ciclo: {reclassified} com reclassificação em dia, "
+                             f"{guided if self.agent else 0} enviado(s) à etapa de orientação.")
+            if incremental: self._advance_watermark(outcomes)
+        except Exception as e:
+            self.logger.critical(f"Erro inesperado no ciclo do daemon combinado: {e}", exc_info=True); cycle_error = str(e)
+        finally:
+            if app.writer: app.writer.flush()
+            app.store.flush()
+            if self.agent: self.agent.store.flush()
+            self._settle_guidance_leases(claimed)
+            self.health.record(cycle_error is None, time.monotonic() - cycle_start, cycle_error)
+            app.llm_service.router.log_state(); log_limits()
+            for cache in (app.llm_service.cache, self.agent.llm_service.cache if self.agent else None):
+                if cache: cache.log_stats()
+            self.logger.info("====== CICLO DO DAEMON COMBINADO CONCLUÍDO ======")
+
+    def _settle_guidance_leases(self, claimed: Dict[str, assessor_module.Ticket]) -> None:
+        """Conclui os leases de orientação publicados e libera os que falharam, para outra instância tentar."""
+        if not self.guidance_leases: return
+        failed = []
+        for ticket in claimed.values():
+            if self._needs_guidance(ticket.id, ticket.content): failed.append(ticket.id)
+            else: self.guidance_leases.complete(ticket.id, content_hash(ticket.content))
+        if failed: self.guidance_leases.release(failed)
+
+    def stop(self) -> None:
+        """Libera os leases e sai do anel de instâncias (reclassificação e orientação)."""
+        if self.assessor.leases: self.assessor.leases.stop()
+        if self.guidance_leases: self.guidance_leases.stop()
+
+    def warm_up(self) -> None:
+        """Aquece o modelo com as regras da primeira etapa, que recebe o primeiro chamado do ciclo."""
+        if self.reclassify: self.assessor.llm_service.warm_up()
+        else: self.agent.llm_service.warm_up()
+
+    def _advance_watermark(self, outcomes: Dict[str, Tuple[assessor_module.Ticket, bool]]) -> None:
+        """Avança o watermark só até antes do primeiro chamado com alguma etapa pendente (falha)."""
+        watermark = assessor_module.WatermarkTracker()
+        for ticket, reclassified in outcomes.values():
+            watermark.observe(ticket, reclassified and not self._needs_guidance(ticket.id, ticket.content))
+        if watermark.value:
+            self.assessor.store.set_meta("pipeline_watermark", watermark.value)
+            self.logger.info(f"Watermark da busca incremental do daemon atualizado para {watermark.value}.")
+
+
+# =============================================================================
+# APPLICATION ENTRY POINT
+# =============================================================================
+if __name__ == "__main__":
+    daemon: Optional[PipelineDaemon] = None
+    try:
+        daemon = PipelineDaemon()
+        start_server(create_server(daemon.health), MetricsConfig.from_env()); daemon.warm_up()
+        scheduler = BlockingScheduler(timezone="America/Sao_Paulo")
+        scheduler.add_job(daemon.run_cycle, 'interval', minutes=daemon.config.interval_minutes, next_run_time=datetime.now())
+        logging.info(f"Daemon combinado iniciado. Ciclos a cada {daemon.config.interval_minutes} minutos.")
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("Daemon combinado encerrado.")
+    except ValueError as e:
+        logging.critical(e)
+    finally:
+        if daemon: daemon.stop()
@@ -0,0 +1,229 @@
+"""
+Pré-classificador local do app.py: decide prioridade, urgência e categoria sem a LLM.
+
+Modelo linear leve (TF-IDF com hashing de unigramas e bigramas da descrição já
+pré-processada + regressão logística multinomial por alvo), treinado offline a
+partir das decisões da LLM guardadas no histórico de processados. Antes de cada
+análise o chamado passa pelo modelo; se a confiança dos três alvos (a menor
+probabilidade prevista) atinge CLASSIFIER_MIN_CONFIDENCE, o resultado é aplicado
+direto (título mantido) e a chamada ao Ollama é evitada. Os demais seguem para a LLM.
+
+O título fica de fora das features: no GLPI ele já foi reescrito pelo próprio
+assessor, então não corresponde ao que o modelo verá nos chamados novos.
+
+Treino e avaliação (holdout de CLASSIFIER_HOLDOUT, pelo ID do chamado):
+    python app.py --evaluate-classifier
+    python app.py --train-classifier
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+import unicodedata
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+HEADS = ("priority", "urgency", "new_category_id")
+_TOKEN = re.compile(r"[a-z0-9]{2,}")
+
+Example = Tuple[str, str, Dict[str, int]]  # (ID do chamado, texto, rótulos)
+
+
+@dataclass
+class ClassifierConfig:
+    path: str; min_confidence: float; hash_bits: int; epochs: int; learning_rate: float; l2: float
+    holdout: float; min_examples: int
+    @classmethod
+    def from_env(cls) -> 'ClassifierConfig':
+        # CLASSIFIER_MODEL_PATH vazio (ou sem arquivo treinado) desativa o pré-classificador
+        return cls(path=os.getenv('CLASSIFIER_MODEL_PATH', ''), min_confidence=float(os.getenv('CLASSIFIER_MIN_CONFIDENCE', '0.9')),
+                   hash_bits=int(os.getenv('CLASSIFIER_HASH_BITS', '18')), epochs=int(os.getenv('CLASSIFIER_EPOCHS', '8')),
+                   learning_rate=float(os.getenv('CLASSIFIER_LEARNING_RATE', '0.5')), l2=float(os.getenv('CLASSIFIER_L2', '1e-5')),
+                   holdout=float(os.getenv('CLASSIFIER_HOLDOUT', '0.2')), min_examples=int(os.getenv('CLASSIFIER_MIN_EXAMPLES', '200')))
+
+
+def prompt_fingerprint(model: str, prompt: str) -> str:
+    """Mesmo critério do cache da LLM: as decisões aprendidas valem para um modelo e um prompt."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# FEATURES
+# =============================================================================
+def terms(text: str) -> List[str]:
+    """Unigramas e bigramas em minúsculas e sem acentos."""
+    folded = unicodedata.normalize("NFKD", (text or "").lower()).encode("ascii", "ignore").decode("ascii")
+    tokens = _TOKEN.findall(folded)
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class HashedTfidf:
+    def __init__(self, bits: int, idf: Optional[Dict[int, float]] = None, documents: int = 0):
+        self.bits = bits; self.mask = (1 << bits) - 1; self.idf = idf or {}; self.documents = documents
+
+    def counts(self, text: str) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for term in terms(text):
+            index = zlib.crc32(term.encode("utf-8")) & self.mask; counts[index] = counts.get(index, 0) + 1
+        return counts
+
+    def fit(self, texts: Iterable[str]) -> 'HashedTfidf':
+        df: Dict[int, int] = {}; self.documents = 0
+        for text in texts:
+            self.documents += 1
+            for index in self.counts(text): df[index] = df.get(index, 0) + 1
+        self.idf = {index: math.log((1 + self.documents) / (1 + n)) + 1 for index, n in df.items()}
+        return self
+
+    def transform(self, text: str) -> Dict[int, float]:
+        """TF sublinear x IDF, normalizado (L2). Features nunca vistas no treino são descartadas."""
+        vector = {index: (1 + math.log(n)) * self.idf[index] for index, n in self.counts(text).items() if index in self.idf}
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {index: v / norm for index, v in vector.items()} if norm else {}
+
+
+# =============================================================================
+# MODELO
+# =============================================================================
+class SoftmaxHead:
+    """Regressão logística multinomial esparsa (SGD) para um alvo."""
+    def __init__(self, classes: List[int], weights: Optional[Dict[int, Dict[int, float]]] = None, bias: Optional[List[float]] = None):
+        self.classes = classes; self.weights = weights or {}; self.bias = bias or [0.0] * len(classes)
+
+    def probabilities(self, x: Dict[int, float]) -> List[float]:
+        scores = list(self.bias)
+        for index, value in x.items():
+            for c, w in self.weights.get(index, {}).items(): scores[c] += w * value
+        top = max(scores); exps = [math.exp(s - top) for s in scores]; total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, x: Dict[int, float]) -> Tuple[int, float]:
+        probabilities = self.probabilities(x); best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def fit(self, xs: List[Dict[int, float]], ys: List[int], epochs: int, learning_rate: float, l2: float, seed: int = 42) -> 'SoftmaxHead':
+        if len(self.classes) < 2: return self  # alvo constante: probabilidade 1 para a única classe
+        position = {label: c for c, label in enumerate(self.classes)}; order = list(range(len(xs))); rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order); rate = learning_rate / (1 + epoch)
+            for i in order:
+                x, target = xs[i], position[ys[i]]
+                for c, p in enumerate(self.probabilities(x)):
+                    gradient = p - (c == target)
+                    if abs(gradient) < 1e-4: continue  # mantém os pesos esparsos
+                    self.bias[c] -= rate * gradient
+                    for index, value in x.items():
+                        row = self.weights.setdefault(index, {})
+                        row[c] = row.get(c, 0.0) * (1 - rate * l2) - rate * gradient * value
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        weights = {str(index): {str(c): round(w, 5) for c, w in row.items() if abs(w) >= 1e-5} for index, row in self.weights.items()}
+        return {"classes": self.classes, "bias": [round(b, 5) for b in self.bias], "weights": {k: v for k, v in weights.items() if v}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SoftmaxHead':
+        return cls(list(data["classes"]), {int(index): {int(c): w for c, w in row.items()} for index, row in data["weights"].items()}, list(data["bias"]))
+
+
+class PreClassifier:
+    def __init__(self, vectorizer: HashedTfidf, heads: Dict[str, SoftmaxHead], min_confidence: float, meta: Dict[str, Any]):
+        self.vectorizer = vectorizer; self.heads = heads; self.min_confidence = min_confidence; self.meta = meta
+
+    @classmethod
+    def train(cls, examples: List[Example], config: ClassifierConfig, fingerprint: str) -> 'PreClassifier':
+        vectorizer = HashedTfidf(config.hash_bits).fit(text for _, text, _ in examples)
+        xs = [vectorizer.transform(text) for _, text, _ in examples]; heads = {}
+        for head in HEADS:
+            ys = [labels[head] for _, _, labels in examples]
+            heads[head] = SoftmaxHead(sorted(set(ys))).fit(xs, ys, config.epochs, config.learning_rate, config.l2)
+        return cls(vectorizer, heads, config.min_confidence, {"examples": len(examples), "trained_at": time.time(), "fingerprint": fingerprint})
+
+    def predict(self, text: str) -> Tuple[Dict[str, int], float]:
+        """Rótulos previstos e a confiança conjunta (a menor probabilidade entre os alvos)."""
+        x = self.vectorizer.transform(text); labels: Dict[str, int] = {}; confidence = 1.0 if x else 0.0
+        for head, model in self.heads.items():
+            labels[head], probability = model.predict(x); confidence = min(confidence, probability)
+        return labels, confidence
+
+    def classify(self, text: str) -> Optional[Tuple[Dict[str, int], float]]:
+        """(rótulos, confiança) quando a confiança atinge o limiar; None para enviar à LLM."""
+        labels, confidence = self.predict(text)
+        return (labels, confidence) if confidence >= self.min_confidence else None
+
+    def save(self, path: str) -> None:
+        data = {"meta": self.meta, "hash_bits": self.vectorizer.bits, "documents": self.vectorizer.documents,
+                "idf": {str(index): round(v, 5) for index, v in self.vectorizer.idf.items()},
+                "heads": {head: model.to_dict() for head, model in self.heads.items()}}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f: json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, min_confidence: float) -> 'PreClassifier':
+        with open(path) as f: data = json.load(f)
+        vectorizer = HashedTfidf(data["hash_bits"], {int(index): v for index, v in data["idf"].items()}, data["documents"])
+        return cls(vectorizer, {head: SoftmaxHead.from_dict(head_data) for head, head_data in data["heads"].items()}, min_confidence, data["meta"])
+
+
+def load_classifier(config: ClassifierConfig, fingerprint: str) -> Optional[PreClassifier]:
+    """Carrega o modelo treinado; None (com aviso) se desativado, ausente ou treinado com outro modelo/prompt."""
+    logger = logging.getLogger(__name__)
+    if not config.path: return None
+    try: model = PreClassifier.load(config.path, config.min_confidence)
+    except FileNotFoundError:
+        logger.warning(f"Pré-classificador sem modelo em {config.path}; treine com 'python app.py --train-classifier'."); return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Modelo do pré-classificador inválido em {config.path}: {e}"); return None
+    if model.meta.get("fingerprint") != fingerprint:
+        logger.warning("Pré-classificador treinado com outro OLLAMA_MODEL/prompt de análise; desativado até ser retreinado."); return None
+    logger.info(f"Pré-classificador carregado ({model.meta.get('examples')} exemplos, limiar de confiança {config.min_confidence:.2f}).")
+    return model
+
+
+# =============================================================================
+# DADOS DE TREINO E AVALIAÇÃO
+# =============================================================================
+def is_holdout(ticket_id: str, fraction: float) -> bool:
+    return zlib.crc32(str(ticket_id).encode("utf-8")) % 1000 < fraction * 1000
+
+
+def evaluate(model: PreClassifier, examples: List[Example]) -> Dict[str, Any]:
+    """Acurácia por alvo, cobertura no limiar e acurácia (três alvos corretos) do que seria aplicado localmente."""
+    correct = {head: 0 for head in HEADS}; applied = 0; applied_correct = 0
+    for _, text, labels in examples:
+        predicted, confidence = model.predict(text)
+        hits = [predicted[head] == labels[head] for head in HEADS]
+        for head, hit in zip(HEADS, hits): correct[head] += hit
+        if confidence >= model.min_confidence: applied += 1; applied_correct += all(hits)
+    n = len(examples) or 1
+    return {"examples": len(examples), "threshold": model.min_confidence,
+            "accuracy": {head: round(correct[head] / n, 4) for head in HEADS},
+            "coverage": round(applied / n, 4), "applied_accuracy": round(applied_correct / applied, 4) if applied else None,
+            "llm_calls_avoided": applied}
+
+
+def collect_examples(history: Iterable[Tuple[str, Optional[str], Dict[str, Any]]], fetch, clean, content_hash, batch_size: int = 100
+                     ) -> Tuple[List[Example], Dict[str, int]]:
+    """
+    Monta os exemplos a partir do histórico (ID, hash do conteúdo, resultado da LLM): busca a
+    descrição de cada chamado com `fetch(ids)` e descarta os editados depois da análise
+    (hash diferente), que já não correspondem à decisão registrada.
+    """
+    labelled = {ticket_id: (stored_hash, result) for ticket_id, stored_hash, result in history
+                if all(isinstance(result.get(head), int) for head in HEADS)}
+    examples: List[Example] = []; stats = {"history": len(labelled), "missing": 0, "edited": 0}; ids = list(labelled)
+    for i in range(0, len(ids), batch_size):
+        tickets = {t.id: t for t in fetch(ids[i:i + batch_size]) or []}
+        for ticket_id in ids[i:i + batch_size]:
+            ticket = tickets.get(ticket_id); stored_hash, result = labelled[ticket_id]
+            if ticket is None: stats["missing"] += 1; continue
+            if stored_hash and content_hash(ticket.content) != stored_hash: stats["edited"] += 1; continue
+            examples.append((ticket_id, clean(ticket.content), {head: int(result[head]) for head in HEADS}))
+    return examples, stats
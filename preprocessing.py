@@ -0,0 +1,105 @@
+"""
+Pré-processamento do conteúdo dos chamados antes da montagem do prompt.
+
+O campo 24 do GLPI chega como HTML (muitas vezes com as entidades escapadas),
+com imagens em base64, assinaturas de e-mail e histórico de respostas citado.
+Este módulo reduz o texto ao que interessa para a LLM e o limita a um
+orçamento aproximado de tokens.
+"""
+import html
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+_BASE64_IMAGE = re.compile(r"<img[^>]*src=[\"']?data:[^>]*>|data:image/[a-z+.-]+;base64,[A-Za-z0-9+/=\s]+", re.IGNORECASE)
+_DROP_BLOCKS = re.compile(r"<(style|script|head)[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+_BLOCK_BREAKS = re.compile(r"<\s*(br|/p|/div|/li|/tr|/h\d|hr)[^>]*>", re.IGNORECASE)
+_LIST_ITEM = re.compile(r"<\s*li[^>]*>", re.IGNORECASE)
+_TAGS = re.compile(r"<[^>]+>")
+# Início do histórico citado: tudo a partir daqui é descartado. Uma linha "De:"/"From:" só
+# conta quando seguida do cabeçalho da resposta (Enviado/Para/Assunto...), como no Outlook.
+_HISTORY_SEPARATOR = re.compile(
+    r"^\s*(-{2,}\s*(original message|mensagem original|forwarded message|mensagem encaminhada)\s*-{2,}"
+    r"|(em|on)\s.{0,120}(escreveu|wrote)\s*:)\s*$", re.IGNORECASE)
+_HEADER_FROM = re.compile(r"^\s*(de|from)\s*:\s*\S", re.IGNORECASE)
+_HEADER_FIELD = re.compile(r"^\s*(enviad[oa](\s+em)?|sent|data|date|para|to|cc|assunto|subject)\s*:", re.IGNORECASE)
+_HEADER_WINDOW = 4; _HEADER_MIN_FIELDS = 2
+# Assinatura: só no bloco final (últimas linhas, todas curtas), nunca no meio do corpo
+_SIGNATURE = re.compile(r"^\s*(atenciosamente|att\.?|abs\.?|abraços|cordialmente|grato|grata|--|enviado do meu .*|sent from my .*)\s*,?\s*$",
+                        re.IGNORECASE)
+_SIGNATURE_LINES = 6; _SIGNATURE_MAX_CHARS = 60
+
+
+@dataclass
+class PreprocessConfig:
+    enabled: bool; max_tokens: int; chars_per_token: float
+    @classmethod
+    def from_env(cls) -> 'PreprocessConfig':
+        return cls(enabled=os.getenv('PREPROCESS_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   max_tokens=int(os.getenv('PREPROCESS_MAX_TOKENS', '1024')),
+                   chars_per_token=float(os.getenv('PREPROCESS_CHARS_PER_TOKEN', '4')))
+
+
+@dataclass
+class PreprocessResult:
+    text: str; original_chars: int; final_chars: int; truncated: bool
+
+
+def html_to_text(raw: str) -> str:
+    # O GLPI grava o HTML com entidades escapadas (&lt;p&gt;); decodifica até estabilizar.
+    text = raw
+    for _ in range(3):
+        decoded = html.unescape(text)
+        if decoded == text: break
+        text = decoded
+    text = _BASE64_IMAGE.sub(" ", text)
+    text = _DROP_BLOCKS.sub(" ", text)
+    text = _BLOCK_BREAKS.sub("\n", text)
+    text = _LIST_ITEM.sub("\n- ", text)
+    text = _TAGS.sub(" ", text)
+    return html.unescape(text).replace("\xa0", " ")
+
+
+def _is_reply_header(lines: List[str], i: int) -> bool:
+    if not _HEADER_FROM.match(lines[i]): return False
+    following = [line for line in lines[i + 1:i + 1 + 2 * _HEADER_WINDOW] if line.strip()][:_HEADER_WINDOW]
+    return sum(1 for line in following if _HEADER_FIELD.match(line)) >= _HEADER_MIN_FIELDS
+
+
+def strip_history_and_signature(text: str) -> str:
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if (_HISTORY_SEPARATOR.match(line) or _is_reply_header(lines, i)) and any(l.strip() for l in lines[:i]):
+            lines = lines[:i]; break
+    lines = [line for line in lines if not line.lstrip().startswith(">")]
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    tail = filled[1:][-_SIGNATURE_LINES:]
+    for n, i in enumerate(tail):
+        if _SIGNATURE.match(lines[i]) and all(len(lines[j].strip()) <= _SIGNATURE_MAX_CHARS for j in tail[n:]): lines = lines[:i]; break
+    return "\n".join(lines)
+
+
+class TicketPreprocessor:
+    def __init__(self, config: PreprocessConfig):
+        self.config = config; self.logger = logging.getLogger(__name__)
+
+    def process(self, content: str) -> PreprocessResult:
+        raw = content or ""
+        if not self.config.enabled: return PreprocessResult(raw, len(raw), len(raw), False)
+        text = strip_history_and_signature(html_to_text(raw))
+        lines = [" ".join(line.split()) for line in text.splitlines()]
+        text = "\n".join(line for line in lines if line).strip()
+        budget = int(self.config.max_tokens * self.config.chars_per_token); truncated = self.config.max_tokens > 0 and len(text) > budget
+        if truncated: text = text[:budget].rsplit(" ", 1)[0] + " [...]"
+        return PreprocessResult(text, len(raw), len(text), truncated)
+
+    def clean(self, ticket_id: str, content: str) -> str:
+        """Limpa o conteúdo e registra o tamanho antes/depois (em caracteres e tokens aproximados)."""
+        result = self.process(content)
+        if self.config.enabled:
+            tokens = lambda chars: int(chars / self.config.chars_per_token)
+            self.logger.info(f"Chamado #{ticket_id}: conteúdo reduzido de {result.original_chars} para {result.final_chars} caracteres "
+                             f"(~{tokens(result.original_chars)} -> ~{tokens(result.final_chars)} tokens){' [truncado]' if result.truncated else ''}.")
+        return result.text
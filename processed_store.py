@@ -0,0 +1,179 @@
+"""
+Armazenamento persistente dos chamados já processados.
+
+Substitui os arquivos de texto em /tmp por um SQLite (modo WAL) indexado por
+ID do chamado. Cada registro guarda o hash do conteúdo, o modelo, o horário e o
+resultado, permitindo reprocessar chamados editados depois da análise, além do
+último horário em que o chamado foi visto ainda ativo: a retenção só descarta
+chamados que deixaram de aparecer, nunca um chamado aberto há muito tempo.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+def content_hash(content: Optional[str]) -> str:
+    """Hash da descrição do chamado (espaços normalizados). O título fica de fora
+    porque o próprio assessor o reescreve."""
+    normalized = " ".join((content or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ProcessedStore:
+    """
+    Registro de chamados processados por `namespace` ('assessor', 'agent').
+
+    As gravações são acumuladas e confirmadas em lotes de `batch_size` (ou no
+    `flush`); consultas enxergam também os registros ainda não confirmados. Chamados
+    processados consultados de novo têm `seen_at` renovado no próximo `flush`.
+    """
+    def __init__(self, path: str, namespace: str, batch_size: int = 20, retention_days: int = 90):
+        self.path = path; self.namespace = namespace; self.batch_size = max(1, batch_size); self.retention_days = retention_days
+        self.logger = logging.getLogger(__name__); self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple] = {}; self._seen: Set[str] = set()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS processed_tickets (
+                namespace TEXT NOT NULL, ticket_id TEXT NOT NULL, content_hash TEXT, model TEXT,
+                processed_at REAL NOT NULL, result TEXT, PRIMARY KEY (namespace, ticket_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_processed_at ON processed_tickets (namespace, processed_at);
+            CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed_tickets)")}
+        if "seen_at" not in columns: self._conn.execute("ALTER TABLE processed_tickets ADD COLUMN seen_at REAL")
+        self._conn.commit()
+
+    def namespace_view(self, namespace: str) -> 'ProcessedStore':
+        """Outro namespace sobre a mesma conexão SQLite (ex.: 'agent' no daemon combinado)."""
+        view = ProcessedStore.__new__(ProcessedStore)
+        view.path = self.path; view.namespace = namespace; view.batch_size = self.batch_size; view.retention_days = self.retention_days
+        view.logger = self.logger; view._lock = self._lock; view._conn = self._conn; view._pending = {}; view._seen = set()
+        return view
+
+    # -- consultas -------------------------------------------------------------
+    def is_processed(self, ticket_id: str, current_hash: Optional[str] = None) -> bool:
+        """
+        True se o chamado já foi processado. Com `current_hash`, um conteúdo diferente
+        do registrado indica edição posterior e o chamado volta a ser elegível.
+        Registros importados dos arquivos antigos (sem hash) valem para qualquer conteúdo.
+        Um chamado processado consultado aqui segue ativo: o registro é renovado para a retenção.
+        """
+        with self._lock:
+            pending = self._pending.get(str(ticket_id))
+            if pending is not None: return current_hash is None or pending[2] is None or pending[2] == current_hash
+            row = self._conn.execute("SELECT content_hash FROM processed_tickets WHERE namespace = ? AND ticket_id = ?",
+                                     (self.namespace, str(ticket_id))).fetchone()
+            if row is None: return False
+            processed = current_hash is None or row[0] is None or row[0] == current_hash
+            if processed: self._seen.add(str(ticket_id))
+        return processed
+
+    def modified_after(self, ticket_id: str, modified_at: float) -> bool:
+        """
+        True se o chamado foi processado (com hash registrado) antes de `modified_at`: pode ter
+        sido editado depois, e o conteúdo precisa ser conferido pelo hash.
+        """
+        with self._lock:
+            if str(ticket_id) in self._pending: return False
+            row = self._conn.execute("SELECT content_hash, processed_at FROM processed_tickets WHERE namespace = ? AND ticket_id = ?",
+                                     (self.namespace, str(ticket_id))).fetchone()
+        return row is not None and row[0] is not None and modified_at > row[1]
+
+    def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash, model, processed_at, result FROM processed_tickets WHERE namespace = ? AND ticket_id = ?",
+                                     (self.namespace, str(ticket_id))).fetchone()
+        if row is None: return None
+        return {"content_hash": row[0], "model": row[1], "processed_at": row[2], "result": json.loads(row[3]) if row[3] else None}
+
+    def results(self) -> List[Tuple[str, Optional[str], Dict[str, Any]]]:
+        """(ID, hash do conteúdo, resultado) de todos os registros com resultado, para treinar o pré-classificador."""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute("SELECT ticket_id, content_hash, result FROM processed_tickets WHERE namespace = ? AND result IS NOT NULL",
+                                      (self.namespace,)).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_tickets WHERE namespace = ?", (self.namespace,)).fetchone()[0] + len(self._pending)
+
+    # -- gravação --------------------------------------------------------------
+    def mark(self, ticket_id: str, content_hash: Optional[str], model: Optional[str], result: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            now = time.time()
+            self._pending[str(ticket_id)] = (self.namespace, str(ticket_id), content_hash, model, now,
+                                             json.dumps(result, ensure_ascii=False) if result is not None else None, now)
+            if len(self._pending) >= self.batch_size: self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock: self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending and not self._seen: return
+        try:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO processed_tickets (namespace, ticket_id, content_hash, model, processed_at, result, seen_at) "
+                                       "VALUES (?, ?, ?, ?, ?, ?, ?)", list(self._pending.values()))
+                now = time.time()
+                self._conn.executemany("UPDATE processed_tickets SET seen_at = ? WHERE namespace = ? AND ticket_id = ?",
+                                       [(now, self.namespace, ticket_id) for ticket_id in self._seen])
+            self._pending.clear(); self._seen.clear()
+        except sqlite3.Error as e:
+            self.logger.error(f"Falha ao gravar {len(self._pending)} chamado(s) processado(s) em {self.path}: {e}")
+
+    # -- metadados, retenção e importação ----------------------------------------
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = ?", (f"{self.namespace}:{key}",)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO store_meta VALUES (?, ?)", (f"{self.namespace}:{key}", value))
+
+    def compact(self, min_interval_seconds: int = 86400) -> int:
+        """
+        Remove registros de chamados não vistos ativos há mais de `retention_days` (no máximo
+        uma vez por intervalo). Registros sem `seen_at` (anteriores à coluna) usam `processed_at`.
+        """
+        if self.retention_days <= 0: return 0
+        last = float(self.get_meta("last_compaction") or 0)
+        if time.time() - last < min_interval_seconds: return 0
+        self.flush()
+        with self._lock:
+            with self._conn:
+                removed = self._conn.execute("DELETE FROM processed_tickets WHERE namespace = ? AND COALESCE(seen_at, processed_at) < ?",
+                                             (self.namespace, time.time() - self.retention_days * 86400)).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.set_meta("last_compaction", str(time.time()))
+        if removed: self.logger.info(f"Compactação do histórico: {removed} registro(s) sem atividade há mais de {self.retention_days} dias removidos.")
+        return removed
+
+    def import_text_file(self, path: str) -> int:
+        """Importa uma única vez um arquivo legado de IDs (um por linha)."""
+        marker = f"imported:{os.path.abspath(path)}"
+        if self.get_meta(marker) or not os.path.exists(path): return 0
+        try:
+            with open(path, 'r') as f: ids = {line.strip() for line in f if line.strip()}
+        except IOError as e:
+            self.logger.error(f"Não foi possível importar o arquivo legado {path}: {e}"); return 0
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO processed_tickets VALUES (?, ?, NULL, NULL, ?, NULL, NULL)",
+                                   [(self.namespace, ticket_id, now) for ticket_id in ids])
+        self.set_meta(marker, str(now))
+        self.logger.info(f"Importados {len(ids)} IDs do arquivo legado {path}.")
+        return len(ids)
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock: self._conn.close()
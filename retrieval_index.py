@@ -0,0 +1,147 @@
+"""
+Índice local de recuperação (BM25) para o agente.
+
+Mantém em SQLite/FTS5 os chamados solucionados/fechados (status 5/6, com
+solução no campo 71) e os artigos da base de conhecimento, atualizados de forma
+incremental por date_mod. As consultas rodam no próprio processo, ranqueadas
+por BM25, no lugar das buscas `searchText` do GLPI a cada chamado.
+
+Reconstrução completa: python intelligent_agent.py --rebuild-index
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+from preprocessing import html_to_text
+
+SearchFn = Callable[[str, Dict, int], Iterator[List[Dict]]]
+_TOKEN = re.compile(r"\w{3,}", re.UNICODE)
+_SOLVED_STATUS_IDS = (5, 6)
+
+
+@dataclass
+class RetrievalConfig:
+    path: str; top_k: int; max_query_terms: int; max_body_chars: int; page_size: int
+    @classmethod
+    def from_env(cls) -> 'RetrievalConfig':
+        # RETRIEVAL_INDEX_PATH vazio desativa o índice (volta às buscas searchText no GLPI)
+        return cls(path=os.getenv('RETRIEVAL_INDEX_PATH', 'retrieval_index.db'), top_k=int(os.getenv('RETRIEVAL_TOP_K', '5')),
+                   max_query_terms=int(os.getenv('RETRIEVAL_MAX_QUERY_TERMS', '32')),
+                   max_body_chars=int(os.getenv('RETRIEVAL_MAX_BODY_CHARS', '4000')),
+                   page_size=int(os.getenv('GLPI_SEARCH_PAGE_SIZE', '500')))
+
+
+def _plain(text: Optional[str], limit: int) -> str:
+    return " ".join(html_to_text(text or "").split())[:limit]
+
+
+class RetrievalIndex:
+    def __init__(self, config: RetrievalConfig):
+        self.config = config; self.logger = logging.getLogger(__name__); self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(config.path)), exist_ok=True)
+        self._conn = sqlite3.connect(config.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS retrieval_docs (
+                rowid INTEGER PRIMARY KEY, kind TEXT NOT NULL, item_id TEXT NOT NULL, title TEXT, body TEXT,
+                answer TEXT, date_mod TEXT, UNIQUE (kind, item_id));
+            CREATE VIRTUAL TABLE IF NOT EXISTS retrieval_fts USING fts5(
+                title, body, content='retrieval_docs', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2');
+            CREATE TRIGGER IF NOT EXISTS retrieval_docs_ai AFTER INSERT ON retrieval_docs BEGIN
+                INSERT INTO retrieval_fts(rowid, title, body) VALUES (new.rowid, new.title, new.body); END;
+            CREATE TRIGGER IF NOT EXISTS retrieval_docs_ad AFTER DELETE ON retrieval_docs BEGIN
+                INSERT INTO retrieval_fts(retrieval_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body); END;
+            CREATE TRIGGER IF NOT EXISTS retrieval_docs_au AFTER UPDATE ON retrieval_docs BEGIN
+                INSERT INTO retrieval_fts(retrieval_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+                INSERT INTO retrieval_fts(rowid, title, body) VALUES (new.rowid, new.title, new.body); END;
+            CREATE TABLE IF NOT EXISTS retrieval_meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    # -- atualização -------------------------------------------------------------
+    def _watermark(self, kind: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM retrieval_meta WHERE key = ?", (f"watermark:{kind}",)).fetchone()
+        return row[0] if row else None
+
+    def _upsert(self, kind: str, rows: List[tuple]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("""INSERT INTO retrieval_docs (kind, item_id, title, body, answer, date_mod) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_id) DO UPDATE SET title = excluded.title, body = excluded.body,
+                answer = excluded.answer, date_mod = excluded.date_mod""", [(kind,) + row for row in rows])
+            dates = [row[4] for row in rows if row[4]]
+            if dates and max(dates) > (self._watermark(kind) or ""):
+                self._conn.execute("INSERT OR REPLACE INTO retrieval_meta VALUES (?, ?)", (f"watermark:{kind}", max(dates)))
+
+    @staticmethod
+    def _since(watermark: Optional[str]) -> Optional[Dict]:
+        # 'morethan' é estrito: recua 1s para não perder itens gravados no mesmo segundo (o upsert é idempotente)
+        if not watermark: return None
+        try: value = (datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S") - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError: value = watermark
+        return {'link': 'AND', 'field': 19, 'searchtype': 'morethan', 'value': value}
+
+    def refresh(self, search: SearchFn) -> int:
+        """Baixa do GLPI só o que mudou desde a última atualização (date_mod) e atualiza o índice."""
+        started = time.monotonic(); total = 0
+        criteria: List[Dict] = [{'criteria': [{'link': 'OR', 'field': 12, 'searchtype': 'equals', 'value': sid} for sid in _SOLVED_STATUS_IDS]}]
+        since = self._since(self._watermark("ticket"))
+        if since: criteria.append(since)
+        payload = {"is_deleted": 0, "criteria": criteria, "forcedisplay": [2, 1, 24, 71, 19], "sort": 19, "order": "ASC"}
+        for page in search("Ticket", payload, self.config.page_size):
+            rows = [(str(r.get('2')), r.get('1') or "", _plain(f"{r.get('71') or ''} {r.get('24') or ''}", self.config.max_body_chars),
+                     r.get('71'), r.get('19') or "") for r in page if r.get('71')]
+            if rows: self._upsert("ticket", rows); total += len(rows)
+        since = self._since(self._watermark("kb"))
+        payload = {"criteria": [since] if since else [], "forcedisplay": [2, 1, 7, 19], "sort": 19, "order": "ASC"}
+        for page in search("KnowbaseItem", payload, self.config.page_size):
+            rows = [(str(r.get('2') or r.get('id')), r.get('1') or "", _plain(r.get('7'), self.config.max_body_chars), r.get('7'), r.get('19') or "")
+                    for r in page]
+            if rows: self._upsert("kb", rows); total += len(rows)
+        self.logger.info(f"Índice de recuperação atualizado: {total} item(ns) novo(s) ou alterado(s) em {time.monotonic() - started:.1f}s "
+                         f"({self.count('ticket')} chamados solucionados, {self.count('kb')} artigos).")
+        return total
+
+    def rebuild(self, search: SearchFn) -> int:
+        """Apaga o índice e o reconstrói do zero (remove também chamados reabertos desde a indexação)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM retrieval_docs"); self._conn.execute("DELETE FROM retrieval_meta")
+            self._conn.execute("INSERT INTO retrieval_fts(retrieval_fts) VALUES ('rebuild')")
+        total = self.refresh(search)
+        with self._lock: self._conn.execute("INSERT INTO retrieval_fts(retrieval_fts) VALUES ('optimize')"); self._conn.commit()
+        return total
+
+    # -- consultas ---------------------------------------------------------------
+    def count(self, kind: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM retrieval_docs WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def _match_query(self, text: str) -> Optional[str]:
+        terms: List[str] = []
+        for token in _TOKEN.findall(html_to_text(text).lower()):
+            if token not in terms: terms.append(token)
+            if len(terms) >= self.config.max_query_terms: break
+        return " OR ".join(f'"{t}"' for t in terms) or None
+
+    def _query(self, kind: str, text: str) -> List[sqlite3.Row]:
+        query = self._match_query(text)
+        if not query: return []
+        with self._lock:
+            return self._conn.execute("""SELECT d.item_id, d.title, d.answer FROM retrieval_fts f JOIN retrieval_docs d ON d.rowid = f.rowid
+                WHERE retrieval_fts MATCH ? AND d.kind = ? ORDER BY bm25(retrieval_fts, 2.0, 1.0) LIMIT ?""",
+                                      (query, kind, self.config.top_k)).fetchall()
+
+    def search_solved_tickets(self, ticket_title: str, ticket_content: Optional[str]) -> List[Dict]:
+        return [{"id": item_id, "title": title, "solution": answer} for item_id, title, answer in self._query("ticket", f"{ticket_title} {ticket_content or ''}")]
+
+    def search_knowledge_base(self, query: str) -> List[Dict]:
+        return [{"id": item_id, "name": title, "answer": answer} for item_id, title, answer in self._query("kb", query)]
+
+    def close(self) -> None:
+        with self._lock: self._conn.close()
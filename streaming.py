@@ -0,0 +1,116 @@
+"""
+Utilitários de streaming para os ciclos de processamento.
+"""
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+_END = object()
+
+
+def prefetch(items: Iterable[T], depth: int = 1) -> Iterator[T]:
+    """
+    Consome `items` numa thread de fundo, mantendo até `depth` itens prontos à frente
+    do consumidor. Usado para baixar a próxima página do GLPI enquanto a atual é
+    analisada. Exceções do produtor são relançadas no consumidor.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=max(1, depth)); stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try: buffer.put(item, timeout=0.5); return True
+            except queue.Full: continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put(item): return
+        except BaseException as e:
+            _put(e); return
+        _put(_END)
+
+    worker = threading.Thread(target=_produce, name="prefetch", daemon=True); worker.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END: return
+            if isinstance(item, BaseException): raise item
+            yield item
+    finally:
+        stop.set()
+
+
+@dataclass
+class Stage:
+    """Etapa do pipeline: `func` recebe o item da etapa anterior e devolve o da próxima
+    (None descarta o item). `workers` threads atendem a etapa em paralelo."""
+    name: str
+    func: Callable[[Any], Optional[Any]]
+    workers: int = 1
+    processed: int = field(default=0, init=False)
+    busy_seconds: float = field(default=0.0, init=False)
+
+
+def pipeline(items: Iterable[Any], stages: List[Stage], queue_size: int = 4) -> Iterator[Any]:
+    """
+    Encadeia as etapas por filas limitadas a `queue_size`, de modo que a etapa de um
+    item se sobreponha às etapas de outros (ex.: pesquisa no GLPI do chamado N+1
+    enquanto o N está na LLM). Entrega ao consumidor a saída da última etapa, fora de
+    ordem. Falhas numa etapa descartam apenas o item; exceções de `items` são
+    relançadas no consumidor.
+    """
+    logger = logging.getLogger(__name__); stop = threading.Event(); errors: List[BaseException] = []
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+
+    def _put(q: "queue.Queue", item) -> bool:
+        while not stop.is_set():
+            try: q.put(item, timeout=0.5); return True
+            except queue.Full: continue
+        return False
+
+    def _feed() -> None:
+        try:
+            for item in items:
+                if not _put(queues[0], item): return
+        except BaseException as e:
+            errors.append(e)
+        _put(queues[0], _END)
+
+    def _work(index: int, stage: Stage, remaining: List[int], lock: threading.Lock) -> None:
+        inbox, outbox = queues[index], queues[index + 1]
+        while not stop.is_set():
+            try: item = inbox.get(timeout=0.5)
+            except queue.Empty: continue
+            if item is _END:
+                _put(inbox, _END)  # devolve o marcador para as demais threads da etapa
+                break
+            started = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logger.error(f"Falha na etapa '{stage.name}' do pipeline: {e}", exc_info=True); result = None
+            with lock: stage.processed += 1; stage.busy_seconds += time.monotonic() - started
+            if result is not None and not _put(outbox, result): return
+        with lock:
+            remaining[0] -= 1; last = remaining[0] == 0
+        if last: _put(outbox, _END)
+
+    threads = [threading.Thread(target=_feed, name="pipeline-feed", daemon=True)]
+    for index, stage in enumerate(stages):
+        remaining, lock = [max(1, stage.workers)], threading.Lock()
+        threads += [threading.Thread(target=_work, args=(index, stage, remaining, lock), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                    for n in range(remaining[0])]
+    for thread in threads: thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _END: break
+            yield item
+        if errors: raise errors[0]
+    finally:
+        stop.set()
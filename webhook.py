@@ -0,0 +1,171 @@
+"""
+Modo push: recebe webhooks/notificações do GLPI e processa os chamados na hora.
+
+O receptor HTTP é uma rota a mais no servidor Flask de métricas (PORT no
+app.py, AGENT_PORT no intelligent_agent.py). Os IDs recebidos entram numa fila
+sem repetição e uma thread os entrega em lotes ao processamento da aplicação;
+com o modo push ativo, o ciclo agendado passa a ser apenas uma reconciliação
+de baixa frequência (WEBHOOK_RECONCILE_MINUTES) para eventos perdidos.
+
+Autenticação (WEBHOOK_SECRET, obrigatório salvo WEBHOOK_ALLOW_UNAUTHENTICATED=true):
+cabeçalho X-Webhook-Token (ou ?token=) igual ao segredo, ou assinatura HMAC-SHA256
+dos webhooks do GLPI 10 (X-GLPI-signature sobre o corpo + X-GLPI-timestamp), com o
+timestamp limitado a WEBHOOK_MAX_SKEW_SECONDS do relógio local contra replay.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from metrics import WEBHOOK_EVENTS, WEBHOOK_QUEUE
+
+EventHandler = Callable[[Dict[str, float]], None]
+
+
+@dataclass
+class WebhookConfig:
+    enabled: bool; path: str; secret: str; debounce_seconds: float; max_batch: int; reconcile_minutes: int
+    allow_unauthenticated: bool = False; max_skew_seconds: float = 300
+    @classmethod
+    def from_env(cls) -> 'WebhookConfig':
+        flag = lambda name, default: os.getenv(name, default).strip().lower() in ('1', 'true', 'yes', 'sim')
+        return cls(enabled=flag('WEBHOOK_ENABLED', 'false'),
+                   path=os.getenv('WEBHOOK_PATH', '/webhook/glpi'), secret=os.getenv('WEBHOOK_SECRET', ''),
+                   debounce_seconds=float(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', '2')),
+                   max_batch=max(1, int(os.getenv('WEBHOOK_MAX_BATCH', '50'))),
+                   reconcile_minutes=max(1, int(os.getenv('WEBHOOK_RECONCILE_MINUTES', '360'))),
+                   allow_unauthenticated=flag('WEBHOOK_ALLOW_UNAUTHENTICATED', 'false'),
+                   max_skew_seconds=float(os.getenv('WEBHOOK_MAX_SKEW_SECONDS', '300')))
+
+
+def _add_id(ids: List[str], value: Any) -> None:
+    if isinstance(value, (list, tuple)):
+        for v in value: _add_id(ids, v)
+    elif isinstance(value, (int, str)) and str(value).strip().isdigit() and str(value).strip() not in ids:
+        ids.append(str(value).strip())
+
+
+def extract_ticket_ids(payload: Any, query_ids: Iterable[str] = ()) -> List[str]:
+    """
+    IDs de chamado de um evento: 'id'/'ids' (no nível superior ou em 'item'/'ticket'),
+    'tickets_id'/'ticket_id', ou 'items_id' com itemtype Ticket (acompanhamentos, tarefas,
+    soluções). Aceita também uma lista de eventos e ?id=1,2 na URL.
+    """
+    ids: List[str] = []
+    for value in query_ids:
+        _add_id(ids, str(value).split(','))
+    for event in (payload if isinstance(payload, list) else [payload]):
+        if not isinstance(event, dict): _add_id(ids, event); continue
+        itemtype = event.get('itemtype')
+        _add_id(ids, event.get('tickets_id')); _add_id(ids, event.get('ticket_id'))
+        if itemtype == 'Ticket': _add_id(ids, event.get('items_id'))
+        if itemtype in (None, 'Ticket'): _add_id(ids, event.get('id')); _add_id(ids, event.get('ids'))
+        for key in ('item', 'ticket'):
+            nested = event.get(key)
+            if isinstance(nested, dict):
+                _add_id(ids, nested.get('tickets_id'))
+                if key == 'ticket' or itemtype in (None, 'Ticket'): _add_id(ids, nested.get('id'))
+    return ids
+
+
+def verify_request(config: WebhookConfig, headers, body: bytes, token: Optional[str]) -> bool:
+    if not config.secret: return config.allow_unauthenticated
+    supplied = headers.get('X-Webhook-Token') or token
+    if supplied and hmac.compare_digest(supplied, config.secret): return True
+    signature = headers.get('X-GLPI-signature')
+    if signature:
+        timestamp = headers.get('X-GLPI-timestamp', '')
+        expected = hmac.new(config.secret.encode(), body + timestamp.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature.lower(), expected): return False
+        # Assinatura válida, mas antiga (ou no futuro): possível reenvio de uma requisição capturada
+        try: return config.max_skew_seconds <= 0 or abs(time.time() - float(timestamp)) <= config.max_skew_seconds
+        except ValueError: return False
+    return False
+
+
+class TicketEventQueue:
+    """Fila de IDs sem repetição: um chamado já pendente não entra de novo e mantém o instante da 1ª notificação."""
+    def __init__(self):
+        self._pending: Dict[str, float] = {}; self._cond = threading.Condition()
+
+    def put(self, ticket_ids: Iterable[str]) -> int:
+        added = 0
+        with self._cond:
+            for ticket_id in ticket_ids:
+                if ticket_id not in self._pending: self._pending[ticket_id] = time.monotonic(); added += 1
+            if added: self._cond.notify()
+            WEBHOOK_QUEUE.set(len(self._pending))
+        return added
+
+    def take(self, max_items: int, debounce_seconds: float) -> Dict[str, float]:
+        """Espera o primeiro evento e mais `debounce_seconds` (juntando rajadas); devolve até `max_items` IDs."""
+        with self._cond:
+            while not self._pending: self._cond.wait()
+        if debounce_seconds > 0: time.sleep(debounce_seconds)
+        with self._cond:
+            batch = dict(list(self._pending.items())[:max_items])
+            for ticket_id in batch: del self._pending[ticket_id]
+            WEBHOOK_QUEUE.set(len(self._pending))
+        return batch
+
+    def __len__(self) -> int:
+        with self._cond: return len(self._pending)
+
+
+def register_webhook(server, config: WebhookConfig, events: TicketEventQueue) -> None:
+    """Acrescenta a rota POST `config.path` ao servidor Flask de métricas."""
+    from flask import Response, request
+    logger = logging.getLogger(__name__)
+
+    def reply(code: int, result: str, **body) -> Response:
+        WEBHOOK_EVENTS.inc(result=result)
+        return Response(json.dumps(dict(body, result=result)), status=code, mimetype="application/json")
+
+    @server.route(config.path, methods=["POST"])
+    def webhook_view():
+        raw = request.get_data(cache=True)
+        if not verify_request(config, request.headers, raw, request.args.get('token')):
+            logger.warning(f"Webhook recusado (token/assinatura inválidos) de {request.remote_addr}.")
+            return reply(401, "unauthorized")
+        payload = request.get_json(silent=True)
+        if payload is None and request.form: payload = request.form.to_dict()
+        ticket_ids = extract_ticket_ids(payload, request.args.getlist('id'))
+        if not ticket_ids: return reply(400, "ignored", error="nenhum ID de chamado no evento")
+        added = events.put(ticket_ids)
+        logger.info(f"Webhook: chamado(s) {', '.join('#' + i for i in ticket_ids)} recebido(s) ({added} novo(s) na fila, {len(events)} pendente(s)).")
+        return reply(202, "accepted", tickets=ticket_ids, queued=len(events))
+
+
+def start_worker(events: TicketEventQueue, handler: EventHandler, config: WebhookConfig, name: str) -> threading.Thread:
+    """Thread que entrega à aplicação os lotes da fila ({id: instante de chegada})."""
+    logger = logging.getLogger(__name__)
+
+    def _run() -> None:
+        while True:
+            batch = events.take(config.max_batch, config.debounce_seconds)
+            try: handler(batch)
+            except Exception as e:
+                logger.error(f"Erro ao processar os chamados do webhook {', '.join('#' + i for i in batch)}: {e}", exc_info=True)
+
+    thread = threading.Thread(target=_run, name=f"webhook-{name}", daemon=True); thread.start()
+    return thread
+
+
+def enable_push_mode(server, config: WebhookConfig, handler: EventHandler, name: str) -> TicketEventQueue:
+    """
+    Registra a rota do webhook e inicia a thread de processamento; devolve a fila de eventos.
+    Sem WEBHOOK_SECRET, recusa iniciar (ValueError) a menos que WEBHOOK_ALLOW_UNAUTHENTICATED=true.
+    """
+    logger = logging.getLogger(__name__)
+    if not config.secret:
+        if not config.allow_unauthenticated:
+            raise ValueError("WEBHOOK_ENABLED sem WEBHOOK_SECRET: defina o segredo (ou WEBHOOK_ALLOW_UNAUTHENTICATED=true para aceitar webhooks sem autenticação).")
+        logger.warning(f"Webhook em {config.path} aceita eventos sem autenticação (WEBHOOK_ALLOW_UNAUTHENTICATED=true).")
+    events = TicketEventQueue(); register_webhook(server, config, events); start_worker(events, handler, config, name)
+    logger.info(f"Modo push ativo: webhooks do GLPI em {config.path}; reconciliação a cada {config.reconcile_minutes} minutos.")
+    return events
@@ -0,0 +1,166 @@
+"""
+Fila de trabalho persistente do app.py (SQLite, no mesmo STATE_DB_PATH do histórico).
+
+Com WORK_QUEUE_ENABLED, o ciclo agendado só lista os chamados pendentes e os
+enfileira; uma thread drena a fila continuamente enquanto houver trabalho e
+espera com backoff quando ela está vazia. A ordem é configurável
+(WORK_QUEUE_ORDER): notificação por webhook, prazo de SLA (time_to_resolve),
+peso da entidade, número de tentativas e idade do chamado. Análises que falham
+voltam para a fila com espera exponencial e, depois de WORK_QUEUE_MAX_ATTEMPTS
+tentativas, ficam marcadas como desistidas até o chamado ser editado.
+
+Apenas o ID e os campos de ordenação ficam na fila: o conteúdo é buscado de
+novo no GLPI no momento do processamento.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# regra -> (coluna, crescente por padrão); '-regra' inverte. Nulos sempre por último.
+_ORDER_RULES = {"event": ("notified_at", True), "sla": ("due_date", True), "entity": ("entity_weight", False),
+                "retries": ("attempts", True), "age": ("date_creation", True)}
+
+
+@dataclass
+class WorkQueueConfig:
+    enabled: bool; order: List[str]; entity_weights: Dict[str, float]; max_attempts: int
+    retry_base_seconds: float; retry_max_seconds: float; idle_min_seconds: float; idle_max_seconds: float; take_size: int
+    @classmethod
+    def from_env(cls) -> 'WorkQueueConfig':
+        # WORK_QUEUE_ENTITY_WEIGHTS: "Raiz > Matriz=10;Raiz > Filial=5" (maior peso primeiro; vale o prefixo mais longo)
+        weights = {}
+        for entry in os.getenv('WORK_QUEUE_ENTITY_WEIGHTS', '').split(';'):
+            if '=' in entry: name, weight = entry.rsplit('=', 1); weights[name.strip()] = float(weight)
+        return cls(enabled=os.getenv('WORK_QUEUE_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   order=[r.strip().lower() for r in os.getenv('WORK_QUEUE_ORDER', 'event,sla,entity,retries,age').split(',') if r.strip()],
+                   entity_weights=weights, max_attempts=max(1, int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', '5'))),
+                   retry_base_seconds=float(os.getenv('WORK_QUEUE_RETRY_BASE_SECONDS', '60')),
+                   retry_max_seconds=float(os.getenv('WORK_QUEUE_RETRY_MAX_SECONDS', '3600')),
+                   idle_min_seconds=float(os.getenv('WORK_QUEUE_IDLE_MIN_SECONDS', '1')),
+                   idle_max_seconds=float(os.getenv('WORK_QUEUE_IDLE_MAX_SECONDS', '60')),
+                   take_size=max(1, int(os.getenv('WORK_QUEUE_TAKE_SIZE', '20'))))
+
+
+def order_by(rules: List[str]) -> str:
+    parts = []
+    for rule in rules:
+        name = rule.lstrip('-')
+        if name not in _ORDER_RULES: raise ValueError(f"Regra de ordenação desconhecida em WORK_QUEUE_ORDER: '{rule}' (use {', '.join(_ORDER_RULES)}).")
+        column, ascending = _ORDER_RULES[name]; ascending ^= rule.startswith('-')
+        parts.append(f"{column} IS NULL, {column} {'ASC' if ascending else 'DESC'}")
+    return ", ".join(parts + ["enqueued_at ASC"])
+
+
+class WorkQueue:
+    def __init__(self, path: str, namespace: str, config: WorkQueueConfig):
+        self.path = path; self.namespace = namespace; self.config = config; self.logger = logging.getLogger(__name__)
+        self._order_by = order_by(config.order); self._lock = threading.Lock(); self._wakeup = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS work_queue (
+                namespace TEXT NOT NULL, ticket_id TEXT NOT NULL, date_creation TEXT, date_mod TEXT, due_date TEXT,
+                entity TEXT, entity_weight REAL, notified_at REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, last_error TEXT,
+                enqueued_at REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, ticket_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_work_queue_due ON work_queue (namespace, failed, next_attempt_at);
+        """)
+        self._conn.commit()
+
+    def _entity_weight(self, entity: Optional[str]) -> Optional[float]:
+        if not entity or not self.config.entity_weights: return None
+        matches = [name for name in self.config.entity_weights if entity == name or entity.startswith(name)]
+        return self.config.entity_weights[max(matches, key=len)] if matches else None
+
+    # -- produção ----------------------------------------------------------------
+    def enqueue(self, items: Iterable[Dict[str, Any]]) -> int:
+        """
+        Enfileira (ou atualiza os campos de ordenação de) chamados: dicts com ticket_id e,
+        opcionalmente, date_creation, date_mod, due_date, entity e notified_at. Tentativas e
+        desistência são preservadas, exceto quando o date_mod mudou (chamado editado).
+        """
+        now = time.time(); rows = []
+        for item in items:
+            entity = item.get('entity') or None
+            rows.append((self.namespace, str(item['ticket_id']), item.get('date_creation') or None, item.get('date_mod') or None,
+                         item.get('due_date') or None, entity, self._entity_weight(entity), item.get('notified_at'), now, now))
+        if not rows: return 0
+        with self._lock, self._conn:
+            self._conn.executemany("""INSERT INTO work_queue (namespace, ticket_id, date_creation, date_mod, due_date, entity, entity_weight,
+                    notified_at, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, ticket_id) DO UPDATE SET
+                    attempts = CASE WHEN excluded.date_mod > work_queue.date_mod THEN 0 ELSE work_queue.attempts END,
+                    failed = CASE WHEN excluded.date_mod > work_queue.date_mod THEN 0 ELSE work_queue.failed END,
+                    next_attempt_at = CASE WHEN excluded.notified_at IS NOT NULL OR excluded.date_mod > work_queue.date_mod
+                                           THEN 0 ELSE work_queue.next_attempt_at END,
+                    date_creation = COALESCE(excluded.date_creation, work_queue.date_creation),
+                    date_mod = COALESCE(excluded.date_mod, work_queue.date_mod),
+                    due_date = COALESCE(excluded.due_date, work_queue.due_date), entity = COALESCE(excluded.entity, work_queue.entity),
+                    entity_weight = COALESCE(excluded.entity_weight, work_queue.entity_weight),
+                    notified_at = COALESCE(work_queue.notified_at, excluded.notified_at), updated_at = excluded.updated_at""", rows)
+        with self._wakeup: self._wakeup.notify_all()
+        return len(rows)
+
+    # -- consumo -----------------------------------------------------------------
+    def take(self, limit: Optional[int] = None) -> List[str]:
+        """IDs prontos (sem espera de nova tentativa pendente), na ordem configurada."""
+        with self._lock:
+            rows = self._conn.execute(f"""SELECT ticket_id FROM work_queue WHERE namespace = ? AND failed = 0 AND next_attempt_at <= ?
+                ORDER BY {self._order_by} LIMIT ?""", (self.namespace, time.time(), limit or self.config.take_size)).fetchall()
+        return [row[0] for row in rows]
+
+    def complete(self, ticket_id: str) -> Optional[float]:
+        """Remove o chamado processado; devolve o instante da notificação por webhook, se houve."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT notified_at FROM work_queue WHERE namespace = ? AND ticket_id = ?", (self.namespace, ticket_id)).fetchone()
+            self._conn.execute("DELETE FROM work_queue WHERE namespace = ? AND ticket_id = ?", (self.namespace, ticket_id))
+        return row[0] if row else None
+
+    discard = complete
+
+    def retry(self, ticket_id: str, error: str) -> Tuple[int, bool]:
+        """Agenda nova tentativa com espera exponencial; devolve (tentativas, desistiu)."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT attempts FROM work_queue WHERE namespace = ? AND ticket_id = ?", (self.namespace, ticket_id)).fetchone()
+            attempts = (row[0] if row else 0) + 1; failed = attempts >= self.config.max_attempts
+            delay = min(self.config.retry_max_seconds, self.config.retry_base_seconds * 2 ** (attempts - 1))
+            self._conn.execute("""UPDATE work_queue SET attempts = ?, failed = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+                WHERE namespace = ? AND ticket_id = ?""", (attempts, int(failed), time.time() + delay, error, time.time(), self.namespace, ticket_id))
+        if failed: self.logger.warning(f"Chamado #{ticket_id} desistido após {attempts} tentativa(s): {error}")
+        else: self.logger.info(f"Chamado #{ticket_id}: tentativa {attempts} falhou ({error}); nova tentativa em {delay:.0f}s.")
+        return attempts, failed
+
+    def wait(self, timeout: float) -> None:
+        """
+        Espera até `timeout` segundos, o próximo vencimento futuro de nova tentativa ou um novo
+        enfileiramento. Itens já vencidos (ex.: a busca no GLPI falhou) não encurtam a espera.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM work_queue WHERE namespace = ? AND failed = 0 AND next_attempt_at > ?",
+                                     (self.namespace, now)).fetchone()
+        if row and row[0] is not None: timeout = min(timeout, row[0] - now)
+        with self._wakeup: self._wakeup.wait(timeout)
+
+    # -- manutenção e estatísticas -------------------------------------------------
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            row = self._conn.execute("""SELECT COALESCE(SUM(failed = 0 AND next_attempt_at <= ?), 0), COALESCE(SUM(failed = 0 AND next_attempt_at > ?), 0),
+                COALESCE(SUM(failed), 0) FROM work_queue WHERE namespace = ?""", (time.time(), time.time(), self.namespace)).fetchone()
+        return {"ready": row[0], "waiting": row[1], "failed": row[2]}
+
+    def compact(self, retention_days: int) -> int:
+        """Remove desistências mais antigas que `retention_days`."""
+        if retention_days <= 0: return 0
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM work_queue WHERE namespace = ? AND failed = 1 AND updated_at < ?",
+                                      (self.namespace, time.time() - retention_days * 86400)).rowcount
+
+    def close(self) -> None:
+        with self._lock: self._conn.close()
@@ -0,0 +1,92 @@
+"""
+Fila write-behind para gravações no GLPI.
+
+Acumula os `input` de várias atualizações/criações e os envia numa única
+requisição em massa (a API REST do GLPI aceita uma lista em `input`), ao atingir
+`batch_size` itens ou após `flush_seconds`. O resultado de cada item é
+informado individualmente ao `on_result`, para que o chamado só seja marcado
+como processado depois que a sua própria gravação for confirmada.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Marcador devolvido no lugar do resultado quando a gravação ficou na fila
+QUEUED = object()
+
+
+@dataclass
+class WriteBehindConfig:
+    enabled: bool; batch_size: int; flush_seconds: float
+    @classmethod
+    def from_env(cls) -> 'WriteBehindConfig':
+        return cls(enabled=os.getenv('GLPI_WRITE_BEHIND_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'sim'),
+                   batch_size=max(1, int(os.getenv('GLPI_WRITE_BATCH_SIZE', '20'))),
+                   flush_seconds=float(os.getenv('GLPI_WRITE_FLUSH_SECONDS', '10')))
+
+
+class WriteBehindQueue:
+    """
+    `send` recebe a lista de `input` e devolve um bool por item (na mesma ordem);
+    `on_result(context, ok)` é chamado para cada item na thread que fez o envio.
+    """
+    def __init__(self, name: str, send: Callable[[List[Dict[str, Any]]], List[bool]], on_result: Callable[[Any, bool], None],
+                 config: WriteBehindConfig):
+        self.name = name; self.send = send; self.on_result = on_result; self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._pending: List[Tuple[Dict[str, Any], Any]] = []; self._oldest: Optional[float] = None
+        self._cond = threading.Condition(); self._send_lock = threading.Lock(); self._closed = False
+        self.sent = 0; self.failed = 0; self.batches = 0
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True); self._thread.start()
+
+    def submit(self, item_input: Dict[str, Any], context: Any) -> None:
+        with self._cond:
+            if not self._pending: self._oldest = time.monotonic()
+            self._pending.append((item_input, context))
+            # Acorda a thread no primeiro item (para armar o prazo) e quando o lote enche
+            if len(self._pending) == 1 or len(self._pending) >= self.config.batch_size: self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = self.config.flush_seconds - (time.monotonic() - self._oldest) if self._oldest is not None else None
+                    self._cond.wait(timeout)
+                if self._closed: return
+            self.flush()
+
+    def _due(self) -> bool:
+        return bool(self._pending) and (len(self._pending) >= self.config.batch_size or time.monotonic() - self._oldest >= self.config.flush_seconds)
+
+    def flush(self) -> None:
+        """Envia tudo o que estiver na fila (em lotes de até `batch_size`) e aguarda as confirmações."""
+        with self._send_lock:
+            while True:
+                with self._cond:
+                    batch, self._pending = self._pending[:self.config.batch_size], self._pending[self.config.batch_size:]
+                    self._oldest = time.monotonic() if self._pending else None
+                if not batch: return
+                self._send_batch(batch)
+
+    def _send_batch(self, batch: List[Tuple[Dict[str, Any], Any]]) -> None:
+        started = time.monotonic()
+        try:
+            results = self.send([item_input for item_input, _ in batch])
+        except Exception as e:
+            self.logger.error(f"Falha no envio em lote ({self.name}): {e}", exc_info=True); results = []
+        results = list(results) + [False] * (len(batch) - len(results))
+        failed = 0
+        for (_, context), ok in zip(batch, results):
+            failed += not ok
+            try: self.on_result(context, ok)
+            except Exception as e: self.logger.error(f"Erro ao registrar o resultado de um item ({self.name}): {e}", exc_info=True)
+        self.sent += len(batch); self.failed += failed; self.batches += 1
+        self.logger.info(f"Lote de {len(batch)} gravação(ões) ({self.name}) enviado em {time.monotonic() - started:.2f}s: "
+                         f"{len(batch) - failed} confirmada(s), {failed} com falha.")
+
+    def close(self) -> None:
+        with self._cond: self._closed = True; self._cond.notify()
+        self._thread.join(timeout=5); self.flush()